@@ -0,0 +1,171 @@
+#!/usr/bin/env python3
+import argparse
+import csv
+import itertools
+import time
+from array import array
+from pathlib import Path
+
+import numpy as np
+
+from hackemulator import (ADDRESS_MASK, COMPUTE, DEST_A, DEST_D, DEST_M, END, HALT, JUMP_EQ, JUMP_GT, JUMP_LT,
+                          KBD, LOAD, RAM_SIZE, ROM_SIZE, HackMachine, decode, load_rom, parse_assignment,
+                          parse_range)
+
+# Runs many instances of one ROM in lockstep with the RAM as an (instances, RAM_SIZE) int16 array and
+# PC, A and D as vectors. Every step executes the instruction at the lowest PC among the running
+# instances for all instances there, so instances that branch apart wait at the higher PC until the
+# rest catch up and run as one group again. A and D are kept as int32 so the ALU functions of the
+# scalar emulator evaluate on whole vectors without overflowing. Each instance counts its cycles and
+# halts exactly as HackMachine does.
+class BatchMachine:
+  def __init__(self, rom, instances: int):
+    self.rom = array('H', rom)
+    if len(self.rom) > ROM_SIZE:
+      raise ValueError(f'Program has {len(self.rom)} instructions but the ROM holds {ROM_SIZE}')
+    self.ops = decode(self.rom)
+    self.ram = np.zeros((instances, RAM_SIZE), np.int16)
+    self.pc = np.zeros(instances, np.int64)
+    self.a = np.zeros(instances, np.int32)
+    self.d = np.zeros(instances, np.int32)
+    self.cycles = np.zeros(instances, np.int64)
+    self.halted = np.zeros(instances, bool)
+    self.steps = 0
+
+  def set_key(self, key: int):
+    self.ram[:, KBD] = key
+
+  # Runs every instance until it halts or has executed max_cycles more instructions. Returns the
+  # number of lockstep steps taken.
+  def run(self, max_cycles: int) -> int:
+    ops, ram, pc, a, d, cycles, halted = self.ops, self.ram, self.pc, self.a, self.d, self.cycles, self.halted
+    end = len(ops) - 1
+    limit = cycles + max_cycles
+    idle = len(ops)
+    steps = 0
+
+    while True:
+      waiting = np.where(halted | (cycles >= limit), idle, pc)
+      current = int(waiting.min())
+      if current == idle:
+        break
+      group = np.flatnonzero(waiting == current)
+      steps += 1
+      kind, value, reads_m, dest, jump = ops[current]
+
+      if kind == LOAD:
+        a[group] = value
+        pc[group] = current + 1
+        cycles[group] += 1
+        continue
+
+      if kind == COMPUTE:
+        a_group = a[group]
+        address = a_group & ADDRESS_MASK
+        out = np.asarray(value(d[group], ram[group, address].astype(np.int32) if reads_m else a_group), np.int32)
+        out = np.broadcast_to(out, group.shape)
+        if dest & DEST_M:
+          writable = address < KBD
+          ram[group[writable], address[writable]] = out[writable]
+        if dest & DEST_D:
+          d[group] = out
+        if dest & DEST_A:
+          a[group] = out
+        if jump:
+          taken = np.zeros(group.shape, bool)
+          if jump & JUMP_LT:
+            taken |= out < 0
+          if jump & JUMP_EQ:
+            taken |= out == 0
+          if jump & JUMP_GT:
+            taken |= out > 0
+          pc[group] = np.where(taken, np.minimum(address, end), current + 1)
+        else:
+          pc[group] = current + 1
+        cycles[group] += 1
+        continue
+
+      if kind == END:
+        halted[group] = True
+        continue
+
+      cycles[group] += 1
+      target = np.minimum(a[group] & ADDRESS_MASK, end)
+      if kind == HALT:
+        spinning = a[group] == current - 1
+        halted[group[spinning]] = True
+        group, target = group[~spinning], target[~spinning]
+      pc[group] = target
+
+    self.steps += steps
+    return steps
+
+# Every combination of the swept RAM values, one row per instance
+def sweep_inputs(sweeps: list[tuple[int, range]]) -> tuple[list[int], np.ndarray]:
+  addresses = [address for address, _ in sweeps]
+  values = np.array(list(itertools.product(*(values for _, values in sweeps))), np.int16)
+  return addresses, values.reshape(-1, len(addresses))
+
+# ADDRESS=FIRST-LAST where either bound may be negative
+def parse_sweep(text: str) -> tuple[int, range]:
+  address, values = text.split('=')
+  first, separator, last = values[1:].partition('-')
+  first = values[0] + first
+  return int(address), range(int(first), int(last if separator else first) + 1)
+
+def main():
+  parser = argparse.ArgumentParser(description='Runs a Hack program over many inputs in one vectorized batch')
+  parser.add_argument('--f', help='Hack program to run')
+  parser.add_argument('--sweep', help='Inputs as ADDRESS=FIRST-LAST, may be repeated for every combination',
+                      action='append', default=[])
+  parser.add_argument('--set', help='Initial RAM value as ADDRESS=VALUE for every instance, may be repeated',
+                      action='append', default=[])
+  parser.add_argument('--cycles', help='Maximum number of instructions per instance', type=int, default=1_000_000)
+  parser.add_argument('--ram', help='RAM range to report as FIRST-LAST, may be repeated', action='append', default=[])
+  parser.add_argument('--o', help='CSV file with the inputs, reported RAM and cycles of every instance')
+  parser.add_argument('-c', '--check', help='Also run every instance on the scalar emulator and compare',
+                      action='store_true')
+
+  args = parser.parse_args()
+  rom = load_rom(Path(args.f))
+  addresses, inputs = sweep_inputs([parse_sweep(text) for text in args.sweep])
+  presets = [parse_assignment(text) for text in args.set]
+  reported = [address for text in args.ram for address in parse_range(text)]
+
+  machine = BatchMachine(rom, len(inputs))
+  for address, value in presets:
+    machine.ram[:, address] = value
+  machine.ram[:, addresses] = inputs
+
+  start = time.perf_counter()
+  steps = machine.run(args.cycles)
+  elapsed = time.perf_counter() - start
+  total = int(machine.cycles.sum())
+  print(f'{len(inputs)} instances, {int(machine.halted.sum())} halted, {steps} lockstep steps, '
+        f'cycles {int(machine.cycles.min())}-{int(machine.cycles.max())}')
+  print(f'{elapsed * 1000:.1f} ms, {total / elapsed / 1e6:.2f} M instructions/s')
+
+  if args.o is not None:
+    with open(args.o, 'w', newline='') as f:
+      writer = csv.writer(f)
+      writer.writerow([f'in {address}' for address in addresses] + [f'RAM[{address}]' for address in reported] +
+                      ['cycles'])
+      for row, values in enumerate(inputs):
+        writer.writerow(list(values) + list(machine.ram[row, reported]) + [machine.cycles[row]])
+
+  if args.check:
+    mismatches = 0
+    for row, values in enumerate(inputs):
+      scalar = HackMachine(rom)
+      for address, value in presets + list(zip(addresses, values.tolist())):
+        scalar.ram[address] = value
+      scalar.run(args.cycles)
+      if (scalar.cycles != machine.cycles[row] or scalar.halted != machine.halted[row] or
+          not np.array_equal(np.frombuffer(scalar.ram, np.int16), machine.ram[row])):
+        mismatches += 1
+    print(f'{len(inputs) - mismatches} of {len(inputs)} instances match the scalar emulator')
+    if mismatches:
+      raise SystemExit(1)
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,438 @@
+#!/usr/bin/env python3
+import argparse
+import hashlib
+import importlib.util
+import time
+from array import array
+from pathlib import Path
+
+ROM_SIZE = 32768
+RAM_SIZE = 32768
+SCREEN = 16384
+KBD = 24576
+ADDRESS_MASK = 0x7FFF
+SCREEN_ROWS = 256
+WORDS_PER_ROW = 32
+
+# Op kinds of the decoded ROM
+LOAD = 0
+COMPUTE = 1
+GOTO = 2
+HALT = 3
+END = 4
+
+# Hack C-instruction bits
+A_BIT = 1 << 12
+DEST_A = 0b100
+DEST_D = 0b010
+DEST_M = 0b001
+JUMP_LT = 0b100
+JUMP_EQ = 0b010
+JUMP_GT = 0b001
+
+MAX_BLOCK = 256
+IDLE_INTERVAL = 1_000_000
+IDLE_WINDOW = 100_000
+MAX_IDLE_WINDOW = 1 << 24
+IDLE_PREFIX = 2048
+CONDITIONS = {0b001: 't > 0', 0b010: 't == 0', 0b011: 't >= 0', 0b100: 't < 0', 0b101: 't != 0', 0b110: 't <= 0'}
+
+def wrap(value):
+  return ((value + 32768) & 0xFFFF) - 32768
+
+# Python source of the documented computations, x is D and y is A or M. Arithmetic that can leave the
+# 16 bit range wraps inline so neither the dispatch loop nor compiled blocks range check.
+COMP_SOURCE = {
+  '101010' : '0',
+  '111111' : '1',
+  '111010' : '-1',
+  '001100' : '{x}',
+  '110000' : '{y}',
+  '001101' : '~{x}',
+  '110001' : '~{y}',
+  '001111' : '((32768 - {x}) & 65535) - 32768',
+  '110011' : '((32768 - {y}) & 65535) - 32768',
+  '011111' : '(({x} + 32769) & 65535) - 32768',
+  '110111' : '(({y} + 32769) & 65535) - 32768',
+  '001110' : '(({x} + 32767) & 65535) - 32768',
+  '110010' : '(({y} + 32767) & 65535) - 32768',
+  '000010' : '(({x} + {y} + 32768) & 65535) - 32768',
+  '010011' : '(({x} - {y} + 32768) & 65535) - 32768',
+  '000111' : '(({y} - {x} + 32768) & 65535) - 32768',
+  '000000' : '{x} & {y}',
+  '010101' : '{x} | {y}',
+}
+
+COMP_FUNCTIONS = {bits: eval(f'lambda x, y: {source.format(x="x", y="y")}') for bits, source in COMP_SOURCE.items()}
+
+# The ALU of projects/02 for control bits outside the documented table
+def alu_function(c_bits: int):
+  zx, nx, zy, ny, f, no = [(c_bits >> shift) & 1 for shift in range(5, -1, -1)]
+  def compute(x, y):
+    x = 0 if zx else x
+    x = ~x if nx else x
+    y = 0 if zy else y
+    y = ~y if ny else y
+    out = x + y if f else x & y
+    return wrap(~out if no else out)
+  return compute
+
+def load_project_module(name: str, relative_path: str):
+  spec = importlib.util.spec_from_file_location(name, Path(__file__).resolve().parent / relative_path)
+  module = importlib.util.module_from_spec(spec)
+  spec.loader.exec_module(module)
+  return module
+
+def rom_digest(rom) -> bytes:
+  return hashlib.sha1(array('H', rom).tobytes()).digest()
+
+def load_rom(file_path: Path) -> array:
+  with open(file_path, 'r') as f:
+    lines = f.read().splitlines()
+  if Path(file_path).suffix == '.asm':
+    assembler = load_project_module('assembler', '../06/assembler.py')
+    return array('H', assembler.assemble_records(assembler.parse_lines(lines)))
+  return array('H', [int(line.strip(), 2) for line in lines if line.strip() != ''])
+
+# Decodes every ROM word once into (kind, value, reads_m, dest, jump). For LOAD the value is the
+# constant, for COMPUTE it is the computation taking (D, A or M). An unconditional jump straight
+# back to the @ in front of it is the usual end of program loop and decodes as HALT. A trailing END
+# op stops programs that run off the end of the ROM.
+def decode(rom) -> list[tuple]:
+  ops = []
+  for index, word in enumerate(rom):
+    if word & 0x8000 == 0:
+      ops.append((LOAD, word, False, 0, 0))
+      continue
+    c_bits = (word >> 6) & 0b111111
+    fn = COMP_FUNCTIONS.get(format(c_bits, '06b')) or alu_function(c_bits)
+    dest = (word >> 3) & 0b111
+    jump = word & 0b111
+    if jump == 0b111 and dest == 0:
+      kind = HALT if index > 0 and ops[index - 1] == (LOAD, index - 1, False, 0, 0) else GOTO
+      ops.append((kind, None, False, 0, jump))
+    else:
+      ops.append((COMPUTE, fn, bool(word & A_BIT), dest, jump))
+  ops.append((END, None, False, 0, 0))
+  return ops
+
+class HackMachine:
+  def __init__(self, rom):
+    self.rom = array('H', rom)
+    if len(self.rom) > ROM_SIZE:
+      raise ValueError(f'Program has {len(self.rom)} instructions but the ROM holds {ROM_SIZE}')
+    self.ops = decode(self.rom)
+    self.ram = array('h', bytes(2 * RAM_SIZE))
+    self.pc = 0
+    self.a = 0
+    self.d = 0
+    self.cycles = 0
+    self.halted = False
+    self.dirty: None | bytearray = None
+    self.halt_when_idle = False
+    self.idle_loops: list[tuple[int, int, int]] = []
+
+  # Flags every screen row written from now on in self.dirty, starting with all rows dirty
+  def track_screen(self):
+    self.dirty = bytearray(b'\x01' * SCREEN_ROWS)
+
+  def reset(self):
+    self.pc = 0
+    self.cycles = 0
+    self.halted = False
+
+  def set_key(self, key: int):
+    self.ram[KBD] = key
+
+  # Runs until the program halts or max_cycles more instructions have executed. Returns the number of
+  # instructions executed by this call. Writes to the keyboard register are ignored as in Memory.hdl.
+  def run(self, max_cycles: int) -> int:
+    ops = self.ops
+    ram = self.ram
+    dirty = self.dirty
+    end = len(ops) - 1
+    pc, a, d = self.pc, self.a, self.d
+    start = self.cycles
+    cycles = start
+    limit = start + max_cycles
+
+    while cycles < limit:
+      kind, value, reads_m, dest, jump = ops[pc]
+      cycles += 1
+      if kind == LOAD:
+        a = value
+        pc += 1
+        continue
+      if kind == COMPUTE:
+        address = a & ADDRESS_MASK
+        out = value(d, ram[address] if reads_m else a)
+        if dest:
+          if dest & DEST_M and address < KBD:
+            ram[address] = out
+            if address >= SCREEN and dirty is not None:
+              dirty[(address - SCREEN) >> 5] = 1
+          if dest & DEST_D:
+            d = out
+          if dest & DEST_A:
+            a = out
+        if jump and (jump & JUMP_LT if out < 0 else jump & JUMP_EQ if out == 0 else jump & JUMP_GT):
+          pc = min(address, end)
+        else:
+          pc += 1
+        continue
+      if kind == GOTO or (kind == HALT and a != pc - 1):
+        pc = min(a & ADDRESS_MASK, end)
+        continue
+      cycles -= 1 if kind == END else 0
+      self.halted = True
+      break
+
+    self.pc, self.a, self.d = pc, a, d
+    self.cycles = cycles
+    return cycles - start
+
+# Compiles the code reachable from start into one Python function taking (ram, A, D) and returning
+# (pc, A, D, cycles). Conditional jumps become side exits so the block carries on along the fall
+# through path, and jumps to a known constant address are followed into their target until an
+# instruction repeats. While A holds a known constant, M accesses use a fixed RAM index. HALT and END
+# ops are left to the interpreter. With track_screen every write that can land in the screen map
+# also flags its row in the dirty bytearray. Returns the function, or None, and the longest path in
+# cycles.
+def compile_block(rom, ops, start: int, track_screen: bool = False) -> tuple:
+  end = len(ops) - 1
+  if ops[start][0] in (HALT, END):
+    return None, 1
+  lines = ['def block(ram, a, d, dirty):']
+  namespace = {}
+  known = None
+  visited = set()
+  pc = start
+  count = 0
+
+  while True:
+    kind, value, reads_m, dest, jump = ops[pc]
+    if kind in (HALT, END) or pc in visited or count >= MAX_BLOCK:
+      lines.append(f'  return {pc}, a, d, {count}')
+      break
+    visited.add(pc)
+    count += 1
+
+    if kind == LOAD:
+      lines.append(f'  a = {value}')
+      known = value
+      pc += 1
+      continue
+
+    target = min(known & ADDRESS_MASK, end) if known is not None else None
+    if kind == GOTO:
+      if target is None:
+        lines.append(f'  return min(a & {ADDRESS_MASK}, {end}), a, d, {count}')
+        break
+      pc = target
+      continue
+
+    c_bits = format((rom[pc] >> 6) & 0b111111, '06b')
+    address = str(known & ADDRESS_MASK) if known is not None else f'a & {ADDRESS_MASK}'
+    y = f'ram[{address}]' if reads_m else 'a'
+    if c_bits in COMP_SOURCE:
+      lines.append(f'  t = {COMP_SOURCE[c_bits].format(x="d", y=y)}')
+    else:
+      namespace[f'alu_{c_bits}'] = alu_function(int(c_bits, 2))
+      lines.append(f'  t = alu_{c_bits}(d, {y})')
+    if jump and target is None:
+      lines.append(f'  j = min(a & {ADDRESS_MASK}, {end})')
+    if dest & DEST_M:
+      if known is None:
+        lines.append(f'  if a & {ADDRESS_MASK} < {KBD}: ram[a & {ADDRESS_MASK}] = t')
+        if track_screen:
+          lines.append(f'  if {SCREEN} <= a & {ADDRESS_MASK} < {KBD}: dirty[((a & {ADDRESS_MASK}) - {SCREEN}) >> 5] = 1')
+      elif known & ADDRESS_MASK < KBD:
+        lines.append(f'  ram[{known & ADDRESS_MASK}] = t')
+        if track_screen and known & ADDRESS_MASK >= SCREEN:
+          lines.append(f'  dirty[{((known & ADDRESS_MASK) - SCREEN) // WORDS_PER_ROW}] = 1')
+    if dest & DEST_D:
+      lines.append('  d = t')
+    if dest & DEST_A:
+      lines.append('  a = t')
+      known = None
+
+    exit_pc = 'j' if target is None else target
+    if jump == 0b111:
+      if target is None:
+        lines.append(f'  return j, a, d, {count}')
+        break
+      pc = target
+      continue
+    if jump:
+      lines.append(f'  if {CONDITIONS[jump]}: return {exit_pc}, a, d, {count}')
+    pc += 1
+
+  exec(compile('\n'.join(lines), f'<block {start}>', 'exec'), namespace)
+  return namespace['block'], count
+
+# Compiled blocks of every ROM seen in this process, keyed by the ROM digest and screen tracking
+BLOCK_CACHE: dict[tuple[bytes, bool], list] = {}
+
+# Runs compiled blocks and falls back to the interpreter for HALT and END ops and for the last
+# cycles before the limit, so cycle limits stay exact.
+class BlockMachine(HackMachine):
+  def __init__(self, rom):
+    super().__init__(rom)
+    self.digest = rom_digest(self.rom)
+    self.blocks = BLOCK_CACHE.setdefault((self.digest, False), [None] * len(self.ops))
+
+  def track_screen(self):
+    super().track_screen()
+    self.blocks = BLOCK_CACHE.setdefault((self.digest, True), [None] * len(self.ops))
+
+  def run(self, max_cycles: int) -> int:
+    rom, ops, blocks, ram, dirty = self.rom, self.ops, self.blocks, self.ram, self.dirty
+    track_screen = dirty is not None
+    pc, a, d = self.pc, self.a, self.d
+    start = self.cycles
+    cycles = start
+    limit = start + max_cycles
+
+    while True:
+      block = blocks[pc]
+      if block is None:
+        block = blocks[pc] = compile_block(rom, ops, pc, track_screen)
+      fn, size = block
+      if fn is None or size > limit - cycles:
+        self.pc, self.a, self.d, self.cycles = pc, a, d, cycles
+        HackMachine.run(self, min(1, limit - cycles) if fn is None else limit - cycles)
+        if self.halted or self.cycles >= limit:
+          return self.cycles - start
+        pc, a, d, cycles = self.pc, self.a, self.d, self.cycles
+        continue
+      pc, a, d, executed = fn(ram, a, d, dirty)
+      cycles += executed
+
+# Runs compiled blocks and watches for idle loops. Every IDLE_INTERVAL cycles or so, the state at a block
+# entry is checkpointed, and for the next idle_window cycles every block exit to that entry compares A,
+# D and RAM with it, the registers, statics and stack first since loop state mostly changes there. A
+# repeat means the program loops with that period until the keyboard changes, whether it spins in place
+# or polls KBD through calls that rewrite the same stack words. The loop is then fast forwarded by whole
+# periods, which leaves the exact state a full run would reach, or with halt_when_idle the machine halts
+# there. A window without a repeat doubles up to MAX_IDLE_WINDOW for loops with longer periods, such as
+# one that repaints the whole screen each round. Windows open and close only at block entries, since a
+# checkpoint inside a block the loop runs through is never seen again as a block exit, and between
+# windows the blocks run unwatched. Detections are recorded in idle_loops as (pc, period, skipped cycles).
+class IdleMachine(BlockMachine):
+  def __init__(self, rom):
+    super().__init__(rom)
+    self.idle_window = IDLE_WINDOW
+
+  def run(self, max_cycles: int) -> int:
+    rom, ops, blocks, ram, dirty = self.rom, self.ops, self.blocks, self.ram, self.dirty
+    track_screen = dirty is not None
+    pc, a, d = self.pc, self.a, self.d
+    start = self.cycles
+    cycles = start
+    limit = start + max_cycles
+    check = min(limit, start + IDLE_WINDOW)
+
+    while True:
+      block = blocks[pc]
+      if block is None:
+        block = blocks[pc] = compile_block(rom, ops, pc, track_screen)
+      fn, size = block
+      if fn is None or size > check - cycles:
+        self.pc, self.a, self.d, self.cycles = pc, a, d, cycles
+        if fn is None or size > limit - cycles:
+          HackMachine.run(self, min(1, limit - cycles) if fn is None else limit - cycles)
+        elif limit - cycles < self.idle_window:
+          check = limit
+        elif not self.watch(limit):
+          self.idle_window = min(2 * self.idle_window, MAX_IDLE_WINDOW)
+          check = min(limit, self.cycles + max(IDLE_INTERVAL, self.idle_window))
+        if self.halted or self.cycles >= limit:
+          return self.cycles - start
+        pc, a, d, cycles = self.pc, self.a, self.d, self.cycles
+        continue
+      pc, a, d, executed = fn(ram, a, d, dirty)
+      cycles += executed
+
+  # Runs blocks for up to idle_window cycles, which fit before limit, from a checkpoint at the current
+  # block entry. Returns whether the state repeated, after fast forwarding or halting.
+  def watch(self, limit: int) -> bool:
+    rom, ops, blocks, ram, dirty = self.rom, self.ops, self.blocks, self.ram, self.dirty
+    track_screen = dirty is not None
+    pc, a, d = self.pc, self.a, self.d
+    cycles = self.cycles
+    end = cycles + self.idle_window
+    watch, watch_a, watch_d, watch_cycles = pc, a, d, cycles
+    watch_low, watch_ram = ram[:IDLE_PREFIX], ram.tobytes()
+
+    while True:
+      block = blocks[pc]
+      if block is None:
+        block = blocks[pc] = compile_block(rom, ops, pc, track_screen)
+      fn, size = block
+      if fn is None or size > end - cycles:
+        self.pc, self.a, self.d, self.cycles = pc, a, d, cycles
+        if fn is None and cycles < end:
+          HackMachine.run(self, 1)
+          if not self.halted:
+            pc, a, d, cycles = self.pc, self.a, self.d, self.cycles
+            continue
+        return False
+      pc, a, d, executed = fn(ram, a, d, dirty)
+      cycles += executed
+
+      if pc == watch and a == watch_a and d == watch_d and ram[:IDLE_PREFIX] == watch_low and \
+          ram.tobytes() == watch_ram:
+        period = cycles - watch_cycles
+        self.pc, self.a, self.d = pc, a, d
+        if self.halt_when_idle:
+          self.idle_loops.append((pc, period, 0))
+          self.cycles = cycles
+          self.halted = True
+          return True
+        skipped = (limit - cycles) // period * period
+        self.idle_loops.append((pc, period, skipped))
+        self.cycles = cycles + skipped
+        return True
+
+ENGINES = {'interpret': HackMachine, 'blocks': BlockMachine, 'idle': IdleMachine}
+
+def parse_assignment(text: str) -> tuple[int, int]:
+  address, value = text.split('=')
+  return int(address), int(value)
+
+def parse_range(text: str) -> range:
+  first, _, last = text.partition('-')
+  return range(int(first), int(last if last != '' else first) + 1)
+
+def main():
+  parser = argparse.ArgumentParser(description='Runs Hack machine code (.hack) or assembly (.asm)')
+  parser.add_argument('--f', help='Hack program to run')
+  parser.add_argument('--cycles', help='Maximum number of instructions to execute', type=int, default=10_000_000)
+  parser.add_argument('--set', help='Initial RAM value as ADDRESS=VALUE, may be repeated', action='append',
+                      default=[])
+  parser.add_argument('--key', help='Key code held down on the keyboard', type=int, default=0)
+  parser.add_argument('--ram', help='RAM range to print as FIRST-LAST, may be repeated', action='append', default=[])
+  parser.add_argument('-e', '--engine', help='Execution engine', choices=list(ENGINES), default='blocks')
+  parser.add_argument('-b', '--bench', help='Report the execution speed', action='store_true')
+
+  args = parser.parse_args()
+  machine = ENGINES[args.engine](load_rom(Path(args.f)))
+  for address, value in map(parse_assignment, args.set):
+    machine.ram[address] = value
+  machine.set_key(args.key)
+  machine.halt_when_idle = True
+
+  start = time.perf_counter()
+  executed = machine.run(args.cycles)
+  elapsed = time.perf_counter() - start
+
+  for address in (address for text in args.ram for address in parse_range(text)):
+    print(f'RAM[{address}] = {machine.ram[address]}')
+  for pc, period, skipped in machine.idle_loops:
+    print(f'Idle loop at pc {pc} with period {period}, {skipped} cycles skipped')
+  print(f'{"Halted" if machine.halted else "Stopped"} at pc {machine.pc} after {executed} cycles')
+  if args.bench:
+    print(f'{elapsed * 1000:.1f} ms, {executed / elapsed / 1e6:.2f} M instructions/s')
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,153 @@
+#!/usr/bin/env python3
+import argparse
+from bisect import bisect_right
+from collections import Counter
+from dataclasses import dataclass
+from pathlib import Path
+
+from hackemulator import (ADDRESS_MASK, COMPUTE, DEST_A, DEST_D, DEST_M, END, GOTO, HALT, JUMP_EQ, JUMP_GT,
+                          JUMP_LT, KBD, LOAD, HackMachine, load_project_module, load_rom, parse_assignment)
+
+START = '(start)'
+
+@dataclass
+class FunctionStats:
+  calls: int = 0
+  self_cycles: int = 0
+  inclusive_cycles: int = 0
+
+def load_symbols(symbol_file: Path) -> list[tuple[int, int, str]]:
+  with open(symbol_file, 'r') as f:
+    return [(int(first), int(end), name) for first, end, name in (line.split() for line in f if line.strip() != '')]
+
+# Counts every executed instruction and follows calls and returns of translated VM functions. A jump
+# onto a function entry is a call when the return address the translator pushed five words below SP
+# points just past the jump, so loops back to the first instruction of a function are not calls. A
+# jump to the return address of the innermost call is its return.
+class ProfilingMachine(HackMachine):
+  def __init__(self, rom, ranges: list[tuple[int, int, str]]):
+    super().__init__(rom)
+    self.ranges = ranges
+    self.entries = {first: name for first, _, name in ranges if name != START}
+    self.counts = [0] * len(self.ops)
+    self.stack: list[tuple[str, int, int]] = []
+    self.active: Counter[str] = Counter()
+    self.calls: Counter[str] = Counter()
+    self.inclusive: Counter[str] = Counter()
+
+  def transfer(self, source: int, target: int, cycles: int):
+    ram = self.ram
+    if self.stack and self.stack[-1][1] == target:
+      name, _, entered = self.stack.pop()
+      self.active[name] -= 1
+      if self.active[name] == 0:
+        self.inclusive[name] += cycles - entered
+    elif target in self.entries and ram[(ram[0] - 5) & ADDRESS_MASK] == source + 1:
+      name = self.entries[target]
+      self.calls[name] += 1
+      self.active[name] += 1
+      self.stack.append((name, source + 1, cycles))
+
+  def run(self, max_cycles: int) -> int:
+    ops = self.ops
+    ram = self.ram
+    counts = self.counts
+    transfer = self.transfer
+    end = len(ops) - 1
+    pc, a, d = self.pc, self.a, self.d
+    start = self.cycles
+    cycles = start
+    limit = start + max_cycles
+
+    while cycles < limit:
+      kind, value, reads_m, dest, jump = ops[pc]
+      counts[pc] += 1
+      cycles += 1
+      if kind == LOAD:
+        a = value
+        pc += 1
+        continue
+      if kind == COMPUTE:
+        address = a & ADDRESS_MASK
+        out = value(d, ram[address] if reads_m else a)
+        if dest:
+          if dest & DEST_M and address < KBD:
+            ram[address] = out
+          if dest & DEST_D:
+            d = out
+          if dest & DEST_A:
+            a = out
+        if jump and (jump & JUMP_LT if out < 0 else jump & JUMP_EQ if out == 0 else jump & JUMP_GT):
+          transfer(pc, min(address, end), cycles)
+          pc = min(address, end)
+        else:
+          pc += 1
+        continue
+      if kind == GOTO or (kind == HALT and a != pc - 1):
+        transfer(pc, min(a & ADDRESS_MASK, end), cycles)
+        pc = min(a & ADDRESS_MASK, end)
+        continue
+      if kind == END:
+        counts[pc] -= 1
+        cycles -= 1
+      self.halted = True
+      break
+
+    self.pc, self.a, self.d = pc, a, d
+    self.cycles = cycles
+    return cycles - start
+
+  # Functions still on the call stack, such as Sys.init, are charged up to the current cycle
+  def report(self) -> dict[str, FunctionStats]:
+    starts = [first for first, _, _ in self.ranges]
+    stats = {name: FunctionStats() for _, _, name in self.ranges}
+    for pc, count in enumerate(self.counts):
+      if count:
+        index = bisect_right(starts, pc) - 1
+        name = self.ranges[index][2] if index >= 0 and pc < self.ranges[index][1] else START
+        stats.setdefault(name, FunctionStats()).self_cycles += count
+    pending = Counter(self.inclusive)
+    outermost = {}
+    for name, _, entered in self.stack:
+      outermost.setdefault(name, entered)
+    for name, entered in outermost.items():
+      pending[name] += self.cycles - entered
+    for name, record in stats.items():
+      record.calls = self.calls[name]
+      record.inclusive_cycles = pending[name] if name != START else self.cycles
+    return stats
+
+def main():
+  parser = argparse.ArgumentParser(description='Profiles Hack programs per VM function')
+  parser.add_argument('--f', help='Hack program to profile, .hack with --symbols or .asm')
+  parser.add_argument('-s', '--symbols', help='Symbol file written by the assembler with --symbols')
+  parser.add_argument('--cycles', help='Maximum number of instructions to execute', type=int, default=10_000_000)
+  parser.add_argument('--set', help='Initial RAM value as ADDRESS=VALUE, may be repeated', action='append',
+                      default=[])
+  parser.add_argument('--top', help='Number of functions to report', type=int, default=20)
+
+  args = parser.parse_args()
+  file_path = Path(args.f)
+  rom = load_rom(file_path)
+  if args.symbols is not None:
+    ranges = load_symbols(Path(args.symbols))
+  else:
+    assembler = load_project_module('assembler', '../06/assembler.py')
+    with open(file_path, 'r') as f:
+      ranges = assembler.function_ranges(assembler.build_goto_map(f.read().splitlines()), len(rom))
+
+  machine = ProfilingMachine(rom, ranges)
+  for address, value in map(parse_assignment, args.set):
+    machine.ram[address] = value
+  machine.run(args.cycles)
+
+  stats = machine.report()
+  total = max(machine.cycles, 1)
+  print(f'{"function":<32}{"calls":>10}{"self":>14}{"self %":>9}{"inclusive":>14}{"incl %":>9}')
+  for name, record in sorted(stats.items(), key=lambda item: -item[1].self_cycles)[:args.top]:
+    print(f'{name:<32}{record.calls:>10}{record.self_cycles:>14}{record.self_cycles * 100 / total:>8.1f}%'
+          f'{record.inclusive_cycles:>14}{record.inclusive_cycles * 100 / total:>8.1f}%')
+  print(f'{"Halted" if machine.halted else "Stopped"} after {machine.cycles} cycles')
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+import argparse
+import struct
+import sys
+import zlib
+from pathlib import Path
+
+from hackemulator import ENGINES, SCREEN, SCREEN_ROWS, WORDS_PER_ROW, load_rom, parse_assignment
+
+SCREEN_WIDTH = 512
+SCREEN_HEIGHT = SCREEN_ROWS
+ROW_BYTES = SCREEN_WIDTH // 8
+
+# The leftmost pixel of a screen word is its least significant bit while PBM and PNG pack the
+# leftmost pixel into the most significant bit, so each byte of a row is bit reversed. PNG grayscale
+# also uses 1 for white where Hack and PBM use 1 for black.
+REVERSE_BITS = bytes(int(format(value, '08b')[::-1], 2) for value in range(256))
+INVERT_BITS = bytes(255 - value for value in range(256))
+
+# A 512x256 1 bit bitmap in PBM row order, updated only for rows flagged dirty
+class Framebuffer:
+  def __init__(self):
+    self.bitmap = bytearray(ROW_BYTES * SCREEN_HEIGHT)
+    self.rows_rendered = 0
+
+  def render(self, ram, dirty: bytearray):
+    row = dirty.find(1)
+    while row != -1:
+      words = ram[SCREEN + row * WORDS_PER_ROW:SCREEN + (row + 1) * WORDS_PER_ROW]
+      if sys.byteorder == 'big':
+        words.byteswap()
+      self.bitmap[row * ROW_BYTES:(row + 1) * ROW_BYTES] = words.tobytes().translate(REVERSE_BITS)
+      dirty[row] = 0
+      self.rows_rendered += 1
+      row = dirty.find(1, row + 1)
+
+  def pixel(self, x: int, y: int) -> int:
+    return (self.bitmap[y * ROW_BYTES + x // 8] >> (7 - x % 8)) & 1
+
+  def save_pbm(self, file_path: Path):
+    with open(file_path, 'wb') as f:
+      f.write(f'P4\n{SCREEN_WIDTH} {SCREEN_HEIGHT}\n'.encode() + self.bitmap)
+
+  def save_png(self, file_path: Path):
+    def chunk(kind: bytes, data: bytes) -> bytes:
+      return struct.pack('>I', len(data)) + kind + data + struct.pack('>I', zlib.crc32(kind + data))
+
+    inverted = bytes(self.bitmap).translate(INVERT_BITS)
+    scanlines = b''.join(b'\x00' + inverted[row * ROW_BYTES:(row + 1) * ROW_BYTES] for row in range(SCREEN_HEIGHT))
+    with open(file_path, 'wb') as f:
+      f.write(b'\x89PNG\r\n\x1a\n')
+      f.write(chunk(b'IHDR', struct.pack('>IIBBBBB', SCREEN_WIDTH, SCREEN_HEIGHT, 1, 0, 0, 0, 0)))
+      f.write(chunk(b'IDAT', zlib.compress(scanlines)))
+      f.write(chunk(b'IEND', b''))
+
+  def save(self, file_path: Path):
+    self.save_png(file_path) if Path(file_path).suffix == '.png' else self.save_pbm(file_path)
+
+# Runs a machine headless up to max_cycles. Key events (cycle, key) are written to KBD when their cycle
+# is reached, and at every snapshot cycle the dirty rows are rendered and the screen is saved to
+# output_pattern formatted with the cycle. A key event and a snapshot at the same cycle see the key.
+# Idle loops are skipped up to the next event, and the machine halts in one after the last key event.
+def run_headless(machine, max_cycles: int, key_events: list[tuple[int, int]], snapshot_cycles: list[int],
+                 output_pattern: str) -> tuple[Framebuffer, list[Path]]:
+  framebuffer = Framebuffer()
+  machine.track_screen()
+  events = sorted([(cycle, 0, key) for cycle, key in key_events] + [(cycle, 1, 0) for cycle in snapshot_cycles])
+  saved = []
+  pending_keys = len(key_events)
+  machine.halt_when_idle = pending_keys == 0
+  for cycle, kind, key in events:
+    if cycle > max_cycles:
+      break
+    if cycle > machine.cycles and not machine.halted:
+      machine.run(cycle - machine.cycles)
+    if kind == 0:
+      machine.set_key(key)
+      pending_keys -= 1
+      machine.halt_when_idle = pending_keys == 0
+      continue
+    framebuffer.render(machine.ram, machine.dirty)
+    file_path = Path(output_pattern.format(cycle=cycle))
+    framebuffer.save(file_path)
+    saved.append(file_path)
+  if machine.cycles < max_cycles and not machine.halted:
+    machine.run(max_cycles - machine.cycles)
+  framebuffer.render(machine.ram, machine.dirty)
+  return framebuffer, saved
+
+def main():
+  parser = argparse.ArgumentParser(description='Runs a Hack program headless and saves screen snapshots')
+  parser.add_argument('--f', help='Hack program to run')
+  parser.add_argument('-e', '--engine', help='Execution engine', choices=list(ENGINES), default='blocks')
+  parser.add_argument('--cycles', help='Maximum number of instructions to execute', type=int, default=10_000_000)
+  parser.add_argument('--set', help='Initial RAM value as ADDRESS=VALUE, may be repeated', action='append',
+                      default=[])
+  parser.add_argument('--key', help='Key press as CYCLE=KEY, KEY 0 releases, may be repeated', action='append',
+                      default=[])
+  parser.add_argument('--snapshot', help='Cycle to save the screen at, may be repeated', type=int, action='append',
+                      default=[])
+  parser.add_argument('--o', help='Snapshot file pattern with {cycle}, .png or .pbm', default='screen_{cycle}.png')
+
+  args = parser.parse_args()
+  machine = ENGINES[args.engine](load_rom(Path(args.f)))
+  for address, value in map(parse_assignment, args.set):
+    machine.ram[address] = value
+
+  framebuffer, saved = run_headless(machine, args.cycles, [parse_assignment(text) for text in args.key],
+                                    args.snapshot, args.o)
+  for file_path in saved:
+    print(f'Saved {file_path}')
+  for pc, period, skipped in machine.idle_loops:
+    print(f'Idle loop at pc {pc} with period {period}, {skipped} cycles skipped')
+  print(f'{"Halted" if machine.halted else "Stopped"} after {machine.cycles} cycles, '
+        f'{framebuffer.rows_rendered} rows rendered')
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+import argparse
+import mmap
+import struct
+import sys
+from array import array
+from pathlib import Path
+
+from hackemulator import ENGINES, RAM_SIZE, SCREEN_ROWS, load_rom, parse_assignment, parse_range, rom_digest
+
+MAGIC = b'HACKSNAP'
+VERSION = 1
+
+# magic, version, ROM sha1, pc, A, D, cycles, halted, padded so the RAM starts on a 64 byte boundary
+HEADER = struct.Struct('<8sH20sHhhQ?19x')
+RAM_OFFSET = HEADER.size
+SNAPSHOT_SIZE = RAM_OFFSET + 2 * RAM_SIZE
+
+# Writes the machine state as a fixed size file: the header followed by the RAM as little endian words
+def save_snapshot(machine, file_path: Path):
+  ram = array('h', machine.ram)
+  if sys.byteorder == 'big':
+    ram.byteswap()
+  with open(file_path, 'wb') as f:
+    f.write(HEADER.pack(MAGIC, VERSION, rom_digest(machine.rom), machine.pc, machine.a, machine.d, machine.cycles,
+                        machine.halted))
+    f.write(ram.tobytes())
+
+# A memory mapped snapshot. The RAM is a read only view into the file, so opening a snapshot reads
+# nothing but the header and any number of machines can be restored from it.
+class Snapshot:
+  def __init__(self, file_path: Path):
+    with open(file_path, 'rb') as f:
+      self.mapping = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    if len(self.mapping) != SNAPSHOT_SIZE:
+      self.mapping.close()
+      raise ValueError(f'{file_path} is not a Hack snapshot')
+    magic, version, self.digest, self.pc, self.a, self.d, self.cycles, self.halted = \
+      HEADER.unpack_from(self.mapping)
+    if magic != MAGIC or version != VERSION:
+      self.mapping.close()
+      raise ValueError(f'{file_path} is not a version {VERSION} Hack snapshot')
+    self.ram = memoryview(self.mapping)[RAM_OFFSET:].cast('h')
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, *exc):
+    self.close()
+
+  def close(self):
+    self.ram.release()
+    self.mapping.close()
+
+  # Copies the state into a machine running the same ROM. A machine tracking the screen gets every row
+  # flagged dirty since its screen contents were replaced.
+  def restore(self, machine):
+    if rom_digest(machine.rom) != self.digest:
+      raise ValueError('Snapshot was taken from a different ROM')
+    ram = array('h', self.ram)
+    if sys.byteorder == 'big':
+      ram.byteswap()
+    machine.ram[:] = ram
+    machine.pc, machine.a, machine.d = self.pc, self.a, self.d
+    machine.cycles = self.cycles
+    machine.halted = self.halted
+    if machine.dirty is not None:
+      machine.dirty[:] = b'\x01' * SCREEN_ROWS
+    return machine
+
+  # A new machine of the given engine that continues from the snapshot
+  def fork(self, rom, engine: type = ENGINES['blocks']):
+    return self.restore(engine(rom))
+
+def main():
+  parser = argparse.ArgumentParser(description='Saves and resumes Hack machine state snapshots')
+  parser.add_argument('--f', help='Hack program to run')
+  parser.add_argument('-e', '--engine', help='Execution engine', choices=list(ENGINES), default='blocks')
+  parser.add_argument('-r', '--restore', help='Snapshot to resume from instead of booting from zero')
+  parser.add_argument('--cycles', help='Maximum number of instructions to execute', type=int, default=10_000_000)
+  parser.add_argument('--set', help='RAM value as ADDRESS=VALUE applied before running, may be repeated',
+                      action='append', default=[])
+  parser.add_argument('--ram', help='RAM range to print as FIRST-LAST, may be repeated', action='append', default=[])
+  parser.add_argument('-s', '--save', help='Write a snapshot of the machine after running')
+
+  args = parser.parse_args()
+  rom = load_rom(Path(args.f))
+  if args.restore is not None:
+    with Snapshot(Path(args.restore)) as snapshot:
+      machine = snapshot.fork(rom, ENGINES[args.engine])
+  else:
+    machine = ENGINES[args.engine](rom)
+  for address, value in map(parse_assignment, args.set):
+    machine.ram[address] = value
+
+  executed = machine.run(args.cycles) if not machine.halted else 0
+
+  for address in (address for text in args.ram for address in parse_range(text)):
+    print(f'RAM[{address}] = {machine.ram[address]}')
+  print(f'{"Halted" if machine.halted else "Stopped"} at pc {machine.pc} after {executed} cycles '
+        f'({machine.cycles} in total)')
+  if args.save is not None:
+    save_snapshot(machine, Path(args.save))
+    print(f'Saved {args.save}')
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,465 @@
+#!/usr/bin/env python3
+import argparse
+import hashlib
+import re
+from dataclasses import dataclass, field
+from pathlib import Path
+
+# Chip folders searched in order, relative to this file
+HDL_DIRECTORIES = ['../01', '../02', '../03/a', '../03/b', '.']
+NET_SUFFIX = '.hnet'
+NET_MAGIC = '# HNET 1 '
+
+FALSE = 0
+TRUE = 1
+
+# Pins of the builtin chips as (inputs, outputs). Nand is the only gate and DFF the only state element.
+# The memory mapped devices and the ROM are behavioral blocks.
+PRIMITIVES = {
+  'Nand': ({'a': 1, 'b': 1}, {'out': 1}),
+  'DFF': ({'in': 1}, {'out': 1}),
+  'ROM32K': ({'address': 15}, {'out': 16}),
+  'Screen': ({'in': 16, 'load': 1, 'address': 13}, {'out': 16}),
+  'Keyboard': ({}, {'out': 16}),
+}
+# Input pins each primitive's outputs depend on within the same clock cycle
+COMBINATIONAL_PINS = {'Nand': ['a', 'b'], 'DFF': [], 'ROM32K': ['address'], 'Screen': ['address'], 'Keyboard': []}
+# Builtin chips of the course tools that behave like a chip of this repo
+ALIASES = {'ARegister': 'Register', 'DRegister': 'Register'}
+
+TOKEN_PATTERN = re.compile(r'//[^\n]*|/\*.*?\*/|[A-Za-z_][A-Za-z0-9_.]*|\d+|\.\.|[{}()\[\];,=]|\S', re.DOTALL)
+
+@dataclass
+class Connection:
+  pin: str
+  pin_bits: None | tuple[int, int]
+  signal: str
+  signal_bits: None | tuple[int, int]
+
+@dataclass
+class Part:
+  chip: str
+  connections: list[Connection]
+
+@dataclass
+class ChipDef:
+  name: str
+  inputs: dict[str, int]
+  outputs: dict[str, int]
+  parts: list[Part] = field(default_factory=list)
+
+def tokenize_hdl(text: str) -> list[str]:
+  return [token for token in TOKEN_PATTERN.findall(text) if not token.startswith(('//', '/*'))]
+
+class HDLParser:
+  def __init__(self, tokens: list[str]):
+    self.tokens = tokens
+    self.index = 0
+
+  @property
+  def current_token(self) -> str:
+    return self.tokens[self.index] if self.index < len(self.tokens) else ''
+
+  def process_token(self, expected: None | str = None) -> str:
+    token = self.current_token
+    if token == '' or (expected is not None and token != expected):
+      raise ValueError(f'Expected {expected or "a token"} but found {token or "the end of the file"}')
+    self.index += 1
+    return token
+
+  def parse_chip(self) -> ChipDef:
+    self.process_token('CHIP')
+    chip = ChipDef(self.process_token(), {}, {})
+    self.process_token('{')
+    while self.current_token in ('IN', 'OUT'):
+      pins = chip.inputs if self.process_token() == 'IN' else chip.outputs
+      pins.update(self.parse_pin_list())
+    self.process_token('PARTS')
+    self.process_token(':')
+    while self.current_token != '}':
+      chip.parts.append(self.parse_part())
+    self.process_token('}')
+    return chip
+
+  def parse_pin_list(self) -> dict[str, int]:
+    pins = {}
+    while True:
+      name = self.process_token()
+      width = 1
+      if self.current_token == '[':
+        self.process_token('[')
+        width = int(self.process_token())
+        self.process_token(']')
+      pins[name] = width
+      if self.process_token() == ';':
+        return pins
+
+  def parse_bits(self) -> None | tuple[int, int]:
+    if self.current_token != '[':
+      return None
+    self.process_token('[')
+    first = int(self.process_token())
+    last = first
+    if self.current_token == '..':
+      self.process_token('..')
+      last = int(self.process_token())
+    self.process_token(']')
+    return first, last
+
+  def parse_part(self) -> Part:
+    part = Part(self.process_token(), [])
+    self.process_token('(')
+    while True:
+      pin = self.process_token()
+      pin_bits = self.parse_bits()
+      self.process_token('=')
+      signal = self.process_token()
+      part.connections.append(Connection(pin, pin_bits, signal, self.parse_bits()))
+      if self.process_token() == ')':
+        break
+    self.process_token(';')
+    return part
+
+def parse_hdl(text: str) -> ChipDef:
+  return HDLParser(tokenize_hdl(text)).parse_chip()
+
+# Finds, parses and remembers the chips of the repo
+class HDLLibrary:
+  def __init__(self, directories: None | list[Path] = None):
+    base = Path(__file__).resolve().parent
+    self.directories = directories if directories is not None else [base / d for d in HDL_DIRECTORIES]
+    self.chips: dict[str, ChipDef] = {}
+
+  def path(self, name: str) -> Path:
+    for directory in self.directories:
+      file_path = directory / f'{name}.hdl'
+      if file_path.exists():
+        return file_path
+    raise ValueError(f'No HDL file for chip {name}')
+
+  def chip(self, name: str) -> ChipDef:
+    name = ALIASES.get(name, name)
+    if name not in self.chips:
+      with open(self.path(name), 'r') as f:
+        self.chips[name] = parse_hdl(f.read())
+    return self.chips[name]
+
+  def pins(self, name: str) -> tuple[dict[str, int], dict[str, int]]:
+    if name in PRIMITIVES:
+      return PRIMITIVES[name]
+    chip = self.chip(name)
+    return chip.inputs, chip.outputs
+
+  # Every HDL chip the named chip is built from, itself included
+  def hierarchy(self, name: str, primitives: dict = PRIMITIVES) -> list[str]:
+    seen = []
+    pending = [ALIASES.get(name, name)]
+    while pending:
+      current = pending.pop()
+      if current in primitives or current in seen:
+        continue
+      seen.append(current)
+      pending += [ALIASES.get(part.chip, part.chip) for part in self.chip(current).parts]
+    return sorted(seen)
+
+  def digest(self, name: str, primitives: dict = PRIMITIVES) -> str:
+    sha = hashlib.sha256(','.join(sorted(primitives)).encode())
+    for chip_name in self.hierarchy(name, primitives):
+      with open(self.path(chip_name), 'rb') as f:
+        sha.update(chip_name.encode() + b'\0' + hashlib.sha256(f.read()).digest())
+    return sha.hexdigest()
+
+# A flat netlist of primitive instances. Gates are (kind, inputs, outputs, path) with the nets of
+# every pin keyed by pin name. Nets 0 and 1 are the constants false and true.
+class Netlist:
+  def __init__(self, name: str):
+    self.name = name
+    self.parent = [FALSE, TRUE]
+    self.gates: list[tuple[str, dict[str, list[int]], dict[str, list[int]], str]] = []
+    self.inputs: dict[str, list[int]] = {}
+    self.outputs: dict[str, list[int]] = {}
+
+  def new_net(self) -> int:
+    self.parent.append(len(self.parent))
+    return len(self.parent) - 1
+
+  def find(self, net: int) -> int:
+    while self.parent[net] != net:
+      self.parent[net] = self.parent[self.parent[net]]
+      net = self.parent[net]
+    return net
+
+  def union(self, first: int, second: int):
+    first, second = self.find(first), self.find(second)
+    if first in (FALSE, TRUE) and second in (FALSE, TRUE) and first != second:
+      raise ValueError(f'{self.name} ties true to false')
+    if first != second:
+      self.parent[max(first, second)] = min(first, second)
+
+  # Rewrites every net to the representative of its set and checks each net has one driver
+  def resolve(self):
+    def resolve_pins(pins: dict[str, list[int]]) -> dict[str, list[int]]:
+      return {pin: [self.find(net) for net in nets] for pin, nets in pins.items()}
+
+    self.gates = [(kind, resolve_pins(inputs), resolve_pins(outputs), path)
+                  for kind, inputs, outputs, path in self.gates]
+    self.inputs, self.outputs = resolve_pins(self.inputs), resolve_pins(self.outputs)
+    drivers = {net: '(input)' for nets in self.inputs.values() for net in nets}
+    for _, _, outputs, path in self.gates:
+      for net in (net for nets in outputs.values() for net in nets):
+        if net in drivers or net in (FALSE, TRUE):
+          raise ValueError(f'{self.name}: {path} drives a net that is already driven by {drivers.get(net, "a constant")}')
+        drivers[net] = path
+    self.drivers = drivers
+
+  @property
+  def input_bits(self) -> list[int]:
+    return [net for nets in self.inputs.values() for net in nets]
+
+  @property
+  def output_bits(self) -> list[int]:
+    return [net for nets in self.outputs.values() for net in nets]
+
+def signal_nets(netlist: Netlist, signals: dict[str, list[int]], connection: Connection, count: int,
+                chip_name: str) -> list[int]:
+  if connection.signal in ('true', 'false'):
+    return [TRUE if connection.signal == 'true' else FALSE] * count
+  if connection.signal not in signals:
+    if connection.signal_bits is not None:
+      raise ValueError(f'{chip_name}: internal pin {connection.signal} cannot be subscripted')
+    signals[connection.signal] = [netlist.new_net() for _ in range(count)]
+  nets = signals[connection.signal]
+  first, last = connection.signal_bits or (0, len(nets) - 1)
+  if last >= len(nets) or last - first + 1 != count:
+    raise ValueError(f'{chip_name}: {connection.pin}={connection.signal} connects pins of different widths')
+  return nets[first:last + 1]
+
+# Adds the gates of one chip instance whose pins are bound to the given nets. Unconnected inputs of a
+# part are false and every output bit of a part gets a net, joined with each signal it is wired to.
+def instantiate(library: HDLLibrary, netlist: Netlist, name: str, pins: dict[str, list[int]], path: str,
+                primitives: dict):
+  if name in primitives:
+    inputs, _ = primitives[name]
+    netlist.gates.append((name, {pin: pins[pin] for pin in inputs},
+                          {pin: pins[pin] for pin in pins if pin not in inputs}, path))
+    return
+  chip = library.chip(name)
+  signals = dict(pins)
+  for index, part in enumerate(chip.parts):
+    part_name = ALIASES.get(part.chip, part.chip) if part.chip not in primitives else part.chip
+    part_inputs, part_outputs = primitives[part_name] if part_name in primitives else library.pins(part_name)
+    bindings = {pin: [FALSE] * width for pin, width in part_inputs.items()}
+    bindings.update({pin: [None] * width for pin, width in part_outputs.items()})
+    for connection in part.connections:
+      if connection.pin not in bindings:
+        raise ValueError(f'{chip.name}: {part.chip} has no pin {connection.pin}')
+      first, last = connection.pin_bits or (0, len(bindings[connection.pin]) - 1)
+      nets = signal_nets(netlist, signals, connection, last - first + 1, chip.name)
+      if connection.pin in part_inputs:
+        bindings[connection.pin][first:last + 1] = nets
+        continue
+      if connection.signal in chip.inputs or connection.signal in ('true', 'false'):
+        raise ValueError(f'{chip.name}: output {connection.pin} of {part.chip} drives {connection.signal}')
+      bits = bindings[connection.pin]
+      for bit, net in zip(range(first, last + 1), nets):
+        if bits[bit] is None:
+          bits[bit] = net
+        else:
+          netlist.union(bits[bit], net)
+    for pin in part_outputs:
+      bindings[pin] = [net if net is not None else netlist.new_net() for net in bindings[pin]]
+    instantiate(library, netlist, part_name, bindings, f'{path}/{part.chip}{index}', primitives)
+
+def flatten(library: HDLLibrary, name: str, primitives: dict = PRIMITIVES) -> Netlist:
+  inputs, outputs = primitives[name] if name in primitives else library.pins(name)
+  netlist = Netlist(name)
+  netlist.inputs = {pin: [netlist.new_net() for _ in range(width)] for pin, width in inputs.items()}
+  netlist.outputs = {pin: [netlist.new_net() for _ in range(width)] for pin, width in outputs.items()}
+  instantiate(library, netlist, name, netlist.inputs | netlist.outputs, name, primitives)
+  netlist.resolve()
+  return netlist
+
+# Orders the gates into levels so every gate comes after the gates driving its combinational inputs.
+# State elements and sources start a new path, so only a combinational loop is an error. Gates that
+# neither reach a chip output nor a state element are dropped.
+def levelize(netlist: Netlist, combinational_pins: dict = COMBINATIONAL_PINS) -> list[list[tuple]]:
+  driver_of = {net: gate for gate in netlist.gates for nets in gate[2].values() for net in nets}
+  live = set()
+  pending = list(netlist.output_bits)
+  for kind, inputs, _, _ in netlist.gates:
+    pending += [net for pin, nets in inputs.items() if pin not in combinational_pins[kind] for net in nets]
+  while pending:
+    gate = driver_of.get(pending.pop())
+    if gate is None or id(gate) in live:
+      continue
+    live.add(id(gate))
+    pending += [net for pin in combinational_pins[gate[0]] for net in gate[1][pin]]
+    if not combinational_pins[gate[0]]:
+      pending += [net for nets in gate[1].values() for net in nets]
+
+  levels_of = {}
+  levels: list[list[tuple]] = []
+  for gate in netlist.gates:
+    if id(gate) not in live:
+      continue
+    depth = iterative_level(gate, driver_of, combinational_pins, levels_of, netlist.name)
+    while len(levels) <= depth:
+      levels.append([])
+    levels[depth].append(gate)
+  return levels
+
+# Depth of a gate in combinational gates, without recursion since chips like the ALU are deep
+def iterative_level(gate, driver_of: dict, combinational_pins: dict, levels_of: dict, name: str) -> int:
+  stack = [(gate, False)]
+  on_stack = set()
+  while stack:
+    current, expanded = stack.pop()
+    key = id(current)
+    if key in levels_of:
+      continue
+    sources = [driver_of[net] for pin in combinational_pins[current[0]] for net in current[1][pin]
+               if net in driver_of]
+    if expanded:
+      on_stack.discard(key)
+      levels_of[key] = max((levels_of[id(source)] + 1 for source in sources), default=0)
+      continue
+    if key in on_stack:
+      raise ValueError(f'{name} has a combinational loop through {current[3]}')
+    on_stack.add(key)
+    stack.append((current, True))
+    stack += [(source, False) for source in sources if id(source) not in levels_of]
+  return levels_of[id(gate)]
+
+# Generates def evaluate(inputs, state, mask) returning (outputs, next_state). Values are bit vectors
+# with one bit per test vector, so mask is 1 for a single evaluation, all ones for many vectors packed
+# into an int, or an array of all ones words for NumPy. Inputs, outputs and state are lists with one
+# entry per bit in pin order and LSB first, the state holding each DFF's output. Constants are folded
+# and a Nand of a Nand of the same net becomes that net.
+def generate(netlist: Netlist, levels: list[list[tuple]]) -> tuple[str, int]:
+  state_gates = [gate for gate in netlist.gates if gate[0] == 'DFF']
+  unsupported = {gate[0] for gate in netlist.gates} - {'Nand', 'DFF'}
+  if unsupported:
+    raise ValueError(f'{netlist.name} uses {", ".join(sorted(unsupported))}, which only the clocked simulator runs')
+
+  value = {FALSE: '0', TRUE: 'mask'}
+  inverse = {}
+  lines = ['def evaluate(inputs, state, mask):']
+  for name, nets in (('inputs', netlist.input_bits), ('state', [gate[2]['out'][0] for gate in state_gates])):
+    for net in nets:
+      value[net] = f'n{net}'
+    if nets:
+      lines.append(f'  {", ".join(value[net] for net in nets)}, = {name}')
+
+  for gate in (gate for level in levels for gate in level if gate[0] == 'Nand'):
+    a, b, out = value[gate[1]['a'][0]], value[gate[1]['b'][0]], gate[2]['out'][0]
+    if a == '0' or b == '0':
+      value[out] = 'mask'
+    elif a == 'mask' and b == 'mask':
+      value[out] = '0'
+    elif a == b or a == 'mask' or b == 'mask':
+      operand = a if a != 'mask' else b
+      if operand in inverse:
+        value[out] = inverse[operand]
+      else:
+        value[out] = f'n{out}'
+        inverse[value[out]] = operand
+        lines.append(f'  n{out} = {operand} ^ mask')
+    else:
+      value[out] = f'n{out}'
+      lines.append(f'  n{out} = ({a} & {b}) ^ mask')
+
+  outputs = ', '.join(value.get(net, '0') for net in netlist.output_bits)
+  next_state = ', '.join(value.get(gate[1]['in'][0], '0') for gate in state_gates)
+  lines.append(f'  return [{outputs}], [{next_state}]')
+  return '\n'.join(lines) + '\n', len(state_gates)
+
+# A chip compiled to a straight line evaluation function
+class CompiledChip:
+  def __init__(self, name: str, inputs: dict[str, int], outputs: dict[str, int], source: str, state_size: int):
+    self.name = name
+    self.inputs = inputs
+    self.outputs = outputs
+    self.source = source
+    self.state_size = state_size
+    namespace = {}
+    exec(compile(source, f'<chip {name}>', 'exec'), namespace)
+    self.evaluate = namespace['evaluate']
+    self.state = [0] * state_size
+
+  # Evaluates once with pin values as integers, unconnected pins false. With tick the DFFs then
+  # take their inputs, as at the end of a clock cycle.
+  def __call__(self, tick: bool = False, **values: int) -> dict[str, int]:
+    bits = [(values.get(pin, 0) >> bit) & 1 for pin, width in self.inputs.items() for bit in range(width)]
+    outputs, next_state = self.evaluate(bits, self.state, 1)
+    if tick:
+      self.state = next_state
+    result = {}
+    for pin, width in self.outputs.items():
+      result[pin] = sum(bit << index for index, bit in enumerate(outputs[:width]))
+      outputs = outputs[width:]
+    return result
+
+def cache_path(library: HDLLibrary, name: str) -> Path:
+  return library.path(ALIASES.get(name, name)).with_suffix(NET_SUFFIX)
+
+# Compiles a chip, reusing the generated code cached next to its HDL file while the digest of every
+# HDL file in its hierarchy is unchanged
+def compile_chip(library: HDLLibrary, name: str, use_cache: bool = True) -> CompiledChip:
+  inputs, outputs = library.pins(name)
+  digest = library.digest(name)
+  file_path = cache_path(library, name)
+  if use_cache and file_path.exists():
+    with open(file_path, 'r') as f:
+      header, _, source = f.read().partition('\n')
+    if header.startswith(NET_MAGIC):
+      cached_digest, state_size = header[len(NET_MAGIC):].split()
+      if cached_digest == digest:
+        return CompiledChip(name, inputs, outputs, source, int(state_size))
+
+  netlist = flatten(library, name)
+  source, state_size = generate(netlist, levelize(netlist))
+  if use_cache:
+    with open(file_path, 'w') as f:
+      f.write(f'{NET_MAGIC}{digest} {state_size}\n{source}')
+  return CompiledChip(name, inputs, outputs, source, state_size)
+
+def parse_assignment(text: str) -> tuple[str, int]:
+  pin, value = text.split('=')
+  return pin, int(value, 0)
+
+def main():
+  parser = argparse.ArgumentParser(description='Compiles HDL chips into levelized gate netlists and Python code')
+  parser.add_argument('--f', help='Chip name or HDL file')
+  parser.add_argument('--set', help='Input pin value as PIN=VALUE, may be repeated', action='append', default=[])
+  parser.add_argument('--ticks', help='Clock cycles to run a sequential chip with the inputs held', type=int,
+                      default=0)
+  parser.add_argument('-n', '--no-cache', help=f'Do not read or write the generated code ({NET_SUFFIX})',
+                      action='store_true')
+  parser.add_argument('--o', help='Also write the generated Python code to this file')
+  parser.add_argument('-s', '--stats', help='Report the size and depth of the netlist', action='store_true')
+
+  args = parser.parse_args()
+  library = HDLLibrary()
+  name = Path(args.f).stem
+  if args.f.endswith('.hdl'):
+    library.directories.insert(0, Path(args.f).resolve().parent)
+
+  chip = compile_chip(library, name, not args.no_cache)
+  if args.o is not None:
+    with open(args.o, 'w') as f:
+      f.write(chip.source)
+  if args.stats:
+    netlist = flatten(library, name)
+    levels = levelize(netlist)
+    print(f'{name}: {len(library.hierarchy(name))} chips, {len(netlist.gates)} primitives, '
+          f'{sum(len(level) for level in levels)} live, {len(levels)} levels, {chip.state_size} DFFs, '
+          f'{chip.source.count(chr(10)) - 2} generated lines')
+
+  values = dict(map(parse_assignment, args.set))
+  for _ in range(args.ticks):
+    chip(tick=True, **values)
+  for pin, value in chip(**values).items():
+    print(f'{pin} = {value}')
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,250 @@
+#!/usr/bin/env python3
+import argparse
+import time
+from array import array
+from pathlib import Path
+
+from hackemulator import KBD, SCREEN, HackMachine, load_rom, parse_assignment, parse_range
+from hdlcompiler import COMBINATIONAL_PINS, PRIMITIVES, TRUE, HDLLibrary, flatten, levelize
+
+# Memory chips simulated as arrays of words instead of their Register trees, by address width
+RAM_BITS = {'RAM8': 3, 'RAM64': 6, 'RAM512': 9, 'RAM4K': 12, 'RAM16K': 14}
+MEMORY_BITS = RAM_BITS | {'Screen': 13, 'ROM32K': 15, 'Keyboard': 0}
+CLOCKED_PRIMITIVES = PRIMITIVES | {name: ({'in': 16, 'load': 1, 'address': bits}, {'out': 16})
+                                   for name, bits in RAM_BITS.items()}
+CLOCKED_PINS = COMBINATIONAL_PINS | {name: ['address'] for name in RAM_BITS}
+
+# A memory block of the netlist with the nets of its pins. Writable blocks take in at address when
+# load is set at the clock edge.
+class MemoryBlock:
+  def __init__(self, kind: str, gate: tuple):
+    _, inputs, outputs, self.path = gate
+    self.kind = kind
+    self.cells = array('H', bytes(2 << MEMORY_BITS[kind]))
+    self.address = inputs.get('address', [])
+    self.data = inputs.get('in', [])
+    self.load = inputs['load'][0] if 'load' in inputs else None
+    self.out = outputs['out']
+
+# Simulates a flattened chip one clock cycle at a time. After inputs change or the clock ticks, only
+# gates fed by a net that changed are evaluated, in level order, so each gate runs at most once per
+# settle. At the clock edge every DFF takes its input and every memory block with load set stores
+# its input, all sampled before any of them changes. Chips named in tables are not flattened but
+# looked up, each output bit in a truth table over the input bits it depends on, given as a list of
+# (input bit positions, table) per output bit.
+class ClockedSimulator:
+  def __init__(self, library: HDLLibrary, name: str, tables: None | dict[str, list[tuple[list[int], int]]] = None):
+    tables = tables or {}
+    primitives = CLOCKED_PRIMITIVES | {chip: library.pins(chip) for chip in tables}
+    pins = CLOCKED_PINS | {chip: list(library.pins(chip)[0]) for chip in tables}
+    self.netlist = flatten(library, name, primitives)
+    levels = levelize(self.netlist, pins)
+
+    # Nand gates keep (a, b, out) nets. Memory blocks have out -1 and table gates -2 - the index of
+    # their input nets (most significant first), output net and table.
+    self.level: list[int] = []
+    self.nand_a, self.nand_b, self.nand_out = [], [], []
+    self.table_inputs: list[tuple[int, ...]] = []
+    self.table_outputs: list[int] = []
+    self.table_bits: list[int] = []
+    self.memories: list[MemoryBlock] = []
+    self.memory_gate: list[int] = []
+    self.fanout: list[list[int]] = [[] for _ in self.netlist.parent]
+    for depth, gate in ((depth, gate) for depth, level in enumerate(levels) for gate in level):
+      kind, inputs, outputs, _ = gate
+      if kind == 'DFF':
+        continue
+      if kind in tables:
+        input_bits = [net for pin in pins[kind] for net in inputs[pin]]
+        output_bits = [net for nets in outputs.values() for net in nets]
+        for out, (support, table) in zip(output_bits, tables[kind]):
+          self.add_gate(depth, 0, 0, -2 - len(self.table_inputs), [input_bits[bit] for bit in support])
+          self.table_inputs.append(tuple(input_bits[bit] for bit in reversed(support)))
+          self.table_outputs.append(out)
+          self.table_bits.append(table)
+      elif kind == 'Nand':
+        self.add_gate(depth, inputs['a'][0], inputs['b'][0], outputs['out'][0], inputs['a'] + inputs['b'])
+      else:
+        self.memory_gate.append(len(self.level))
+        self.add_gate(depth, 0, 0, -1, [net for pin in pins[kind] for net in inputs[pin]])
+        self.memories.append(MemoryBlock(kind, gate))
+
+    self.gate_count = len(self.level)
+    self.memory_of = {gate: index for index, gate in enumerate(self.memory_gate)}
+    self.buckets: list[list[int]] = [[] for _ in levels]
+    self.scheduled = bytearray(self.gate_count)
+    self.values = bytearray(len(self.netlist.parent))
+    self.values[TRUE] = 1
+    self.dffs = [(gate[1]['in'][0], gate[2]['out'][0]) for gate in self.netlist.gates if gate[0] == 'DFF']
+    self.cycles = 0
+    self.evaluations = 0
+    for index in range(self.gate_count):
+      self.schedule(index)
+    self.settle()
+
+  def add_gate(self, depth: int, a: int, b: int, out: int, inputs: list[int]):
+    for net in set(inputs):
+      self.fanout[net].append(len(self.level))
+    self.level.append(depth)
+    self.nand_a.append(a)
+    self.nand_b.append(b)
+    self.nand_out.append(out)
+
+  def schedule(self, gate: int):
+    if not self.scheduled[gate]:
+      self.scheduled[gate] = 1
+      self.buckets[self.level[gate]].append(gate)
+
+  def drive(self, net: int, value: int):
+    if self.values[net] != value:
+      self.values[net] = value
+      for gate in self.fanout[net]:
+        self.schedule(gate)
+
+  def read_number(self, nets: list[int]) -> int:
+    values = self.values
+    return sum(values[net] << bit for bit, net in enumerate(nets))
+
+  def memory(self, kind: str) -> MemoryBlock:
+    return next(block for block in self.memories if block.kind == kind)
+
+  def set(self, pin: str, value: int):
+    for bit, net in enumerate(self.netlist.inputs[pin]):
+      self.drive(net, (value >> bit) & 1)
+
+  def get(self, pin: str) -> int:
+    return self.read_number(self.netlist.outputs[pin])
+
+  # Stores a word into a memory block from outside, such as a key press or a ROM image
+  def poke(self, block: MemoryBlock, address: int, value: int):
+    block.cells[address] = value & 0xFFFF
+    self.schedule(self.memory_gate[self.memories.index(block)])
+
+  def settle(self):
+    values, fanout, buckets, scheduled, level = self.values, self.fanout, self.buckets, self.scheduled, self.level
+    nand_a, nand_b, nand_out = self.nand_a, self.nand_b, self.nand_out
+    table_inputs, table_outputs, table_bits = self.table_inputs, self.table_outputs, self.table_bits
+    for bucket in buckets:
+      if not bucket:
+        continue
+      self.evaluations += len(bucket)
+      for gate in bucket:
+        scheduled[gate] = 0
+        out = nand_out[gate]
+        if out >= 0:
+          value = 1 - (values[nand_a[gate]] & values[nand_b[gate]])
+        elif out == -1:
+          block = self.memories[self.memory_of[gate]]
+          word = block.cells[self.read_number(block.address)]
+          for bit, net in enumerate(block.out):
+            self.drive(net, (word >> bit) & 1)
+          continue
+        else:
+          index = 0
+          for net in table_inputs[-2 - out]:
+            index = index << 1 | values[net]
+          value = (table_bits[-2 - out] >> index) & 1
+          out = table_outputs[-2 - out]
+        if values[out] != value:
+          values[out] = value
+          for target in fanout[out]:
+            if not scheduled[target]:
+              scheduled[target] = 1
+              buckets[level[target]].append(target)
+      bucket.clear()
+
+  def tick(self):
+    self.settle()
+    values = self.values
+    changed = [(out, values[net]) for net, out in self.dffs if values[net] != values[out]]
+    writes = [(index, self.read_number(block.address), self.read_number(block.data))
+              for index, block in enumerate(self.memories) if block.load is not None and values[block.load]]
+    for net, value in changed:
+      self.drive(net, value)
+    for index, address, word in writes:
+      self.memories[index].cells[address] = word
+      self.schedule(self.memory_gate[index])
+    self.settle()
+    self.cycles += 1
+
+# The Hack computer simulated from its HDL with a program in the ROM
+class ComputerSimulator(ClockedSimulator):
+  def __init__(self, library: HDLLibrary, rom, tables: None | dict[str, list[tuple[list[int], int]]] = None):
+    super().__init__(library, 'Computer', tables)
+    self.rom = self.memory('ROM32K')
+    self.ram = self.memory('RAM16K')
+    self.screen = self.memory('Screen')
+    self.keyboard = self.memory('Keyboard')
+    self.rom.cells[:len(rom)] = array('H', rom)
+    self.schedule(self.memory_gate[self.memories.index(self.rom)])
+    self.set('reset', 1)
+    self.tick()
+    self.set('reset', 0)
+    self.cycles = 0
+
+  def set_key(self, key: int):
+    self.poke(self.keyboard, 0, key)
+
+  def run(self, cycles: int) -> int:
+    for _ in range(cycles):
+      self.tick()
+    return cycles
+
+  # A RAM word as a signed value, with the screen and keyboard at their addresses in the memory map
+  def peek(self, address: int) -> int:
+    if address >= KBD:
+      word = self.keyboard.cells[0]
+    elif address >= SCREEN:
+      word = self.screen.cells[address - SCREEN]
+    else:
+      word = self.ram.cells[address]
+    return word - 65536 if word & 0x8000 else word
+
+def main():
+  parser = argparse.ArgumentParser(description='Runs a Hack program on the Computer chip built from its HDL')
+  parser.add_argument('--f', help='Hack program to run')
+  parser.add_argument('--cycles', help='Clock cycles to simulate', type=int, default=10_000)
+  parser.add_argument('--set', help='Initial RAM value as ADDRESS=VALUE, may be repeated', action='append',
+                      default=[])
+  parser.add_argument('--key', help='Key code held down on the keyboard', type=int, default=0)
+  parser.add_argument('--ram', help='RAM range to print as FIRST-LAST, may be repeated', action='append', default=[])
+  parser.add_argument('-c', '--check', help='Compare the RAM with the Hack emulator after the same cycles',
+                      action='store_true')
+
+  args = parser.parse_args()
+  rom = load_rom(Path(args.f))
+  start = time.perf_counter()
+  computer = ComputerSimulator(HDLLibrary(), rom)
+  build_seconds = time.perf_counter() - start
+  for address, value in map(parse_assignment, args.set):
+    computer.poke(computer.ram, address, value)
+  computer.set_key(args.key)
+
+  evaluations = computer.evaluations
+  start = time.perf_counter()
+  computer.run(args.cycles)
+  elapsed = time.perf_counter() - start
+
+  for address in (address for text in args.ram for address in parse_range(text)):
+    print(f'RAM[{address}] = {computer.peek(address)}')
+  print(f'{computer.gate_count} gates and {len(computer.dffs)} DFFs built in {build_seconds * 1000:.0f} ms')
+  print(f'{args.cycles} cycles in {elapsed * 1000:.1f} ms, {args.cycles / elapsed:.0f} cycles/s, '
+        f'{(computer.evaluations - evaluations) / args.cycles:.0f} gate evaluations per cycle')
+
+  if args.check:
+    machine = HackMachine(rom)
+    for address, value in map(parse_assignment, args.set):
+      machine.ram[address] = value
+    machine.set_key(args.key)
+    machine.run(args.cycles)
+    if machine.halted and machine.cycles < args.cycles:
+      print(f'The emulator halted after {machine.cycles} cycles')
+    mismatches = [address for address in range(KBD + 1) if computer.peek(address) != machine.ram[address]]
+    for address in mismatches[:20]:
+      print(f'RAM[{address}]: HDL {computer.peek(address)}, emulator {machine.ram[address]}')
+    if mismatches:
+      raise SystemExit(1)
+    print('RAM matches the emulator')
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,183 @@
+#!/usr/bin/env python3
+import argparse
+import random
+import time
+from pathlib import Path
+
+from hackemulator import load_rom
+from hdlcompiler import PRIMITIVES, HDLLibrary, flatten, generate, levelize
+from hdlsim import ClockedSimulator, ComputerSimulator
+
+TABLE_BITS = 8
+TABLE_SUFFIX = '.htab'
+TABLE_MAGIC = '# HTAB 1 '
+VERIFY_VECTORS = 256
+DEFAULT_CHIPS = ['Mux4Way16', 'DMux8Way', 'ALU', 'PC', 'CPU']
+
+# Input bit positions each output bit of a flat netlist depends on, following gates back to the inputs
+def output_supports(netlist) -> list[list[int]]:
+  position = {net: index for index, net in enumerate(netlist.input_bits)}
+  driver_of = {gate[2]['out'][0]: gate for gate in netlist.gates}
+  supports = []
+  for net in netlist.output_bits:
+    seen = set()
+    pending = [net]
+    while pending:
+      current = pending.pop()
+      if current in seen:
+        continue
+      seen.add(current)
+      if current in driver_of:
+        pending += driver_of[current][1]['a'] + driver_of[current][1]['b']
+    supports.append(sorted(position[current] for current in seen if current in position))
+  return supports
+
+# Truth tables of every output bit over its support, bit i of a table holding the output for the
+# support bits set as in i. Built by evaluating the gates once over all support combinations packed
+# into one int, then checked against the gates on random whole input vectors. None when the chip
+# holds state or memory or an output depends on more than table_bits inputs.
+def build_tables(library: HDLLibrary, name: str, table_bits: int = TABLE_BITS) -> None | list[tuple[list[int], int]]:
+  parts = {part.chip for chip in library.hierarchy(name) for part in library.chip(chip).parts}
+  if any(chip in PRIMITIVES and chip != 'Nand' for chip in parts):
+    return None
+  netlist = flatten(library, name)
+  supports = output_supports(netlist)
+  if any(len(support) > table_bits for support in supports):
+    return None
+  namespace = {}
+  exec(generate(netlist, levelize(netlist))[0], namespace)
+  evaluate = namespace['evaluate']
+
+  input_count = len(netlist.input_bits)
+  tables = []
+  for output, support in enumerate(supports):
+    rows = 1 << len(support)
+    planes = [0] * input_count
+    for shift, bit in enumerate(support):
+      planes[bit] = sum(1 << row for row in range(rows) if row >> shift & 1)
+    outputs, _ = evaluate(planes, [], (1 << rows) - 1)
+    tables.append((support, outputs[output]))
+
+  for _ in range(VERIFY_VECTORS):
+    bits = [random.getrandbits(1) for _ in range(input_count)]
+    outputs, _ = evaluate(bits, [], 1)
+    for (support, table), expected in zip(tables, outputs):
+      index = sum(bits[bit] << shift for shift, bit in enumerate(support))
+      if (table >> index) & 1 != expected:
+        raise ValueError(f'Truth table of {name} disagrees with its gates')
+  return tables
+
+def table_path(library: HDLLibrary, name: str) -> Path:
+  return library.path(name).with_suffix(TABLE_SUFFIX)
+
+# The tables of one chip, reused from the file next to its HDL while its hierarchy is unchanged. A
+# chip that cannot be tabulated is cached as such.
+def load_tables(library: HDLLibrary, name: str, table_bits: int = TABLE_BITS,
+                use_cache: bool = True) -> None | list[tuple[list[int], int]]:
+  key = f'{library.digest(name)} {table_bits}'
+  file_path = table_path(library, name)
+  if use_cache and file_path.exists():
+    with open(file_path, 'r') as f:
+      header, *lines = f.read().splitlines()
+    if header == TABLE_MAGIC + key:
+      if lines == ['none']:
+        return None
+      return [([int(bit) for bit in support.split(',') if bit != ''], int(table, 16))
+              for support, table in (line.split(' ') for line in lines)]
+
+  tables = build_tables(library, name, table_bits)
+  if use_cache:
+    with open(file_path, 'w') as f:
+      f.write(TABLE_MAGIC + key + '\n')
+      if tables is None:
+        f.write('none\n')
+      else:
+        f.writelines(f'{",".join(map(str, support))} {table:x}\n' for support, table in tables)
+  return tables
+
+# Tables for every chip in the hierarchy that can be tabulated. The simulator stops flattening at the
+# outermost of them, so a Mux16 becomes sixteen 3 input lane tables rather than 16 Mux tables.
+def chip_tables(library: HDLLibrary, name: str, table_bits: int = TABLE_BITS,
+                use_cache: bool = True) -> dict[str, list[tuple[list[int], int]]]:
+  tables = {}
+  for chip in library.hierarchy(name):
+    chip_table = load_tables(library, chip, table_bits, use_cache)
+    if chip_table is not None:
+      tables[chip] = chip_table
+  return tables
+
+# Drives both simulators with the same random inputs for a number of steps, settling and reading the
+# outputs and then ticking the clock each step. Returns the seconds and gate evaluations of each
+# simulator and the number of steps whose outputs differ.
+def compare(library: HDLLibrary, name: str, tables: dict, steps: int, seed: int) -> tuple:
+  simulators = [ClockedSimulator(library, name), ClockedSimulator(library, name, tables)]
+  inputs, _ = library.pins(name)
+  results = []
+  for simulator in simulators:
+    rng = random.Random(seed)
+    evaluations = simulator.evaluations
+    outputs = []
+    start = time.perf_counter()
+    for _ in range(steps):
+      for pin, width in inputs.items():
+        simulator.set(pin, rng.getrandbits(width))
+      simulator.settle()
+      outputs.append([simulator.get(pin) for pin in simulator.netlist.outputs])
+      simulator.tick()
+    results.append((time.perf_counter() - start, simulator.evaluations - evaluations, outputs))
+  (gate_seconds, gate_evaluations, gate_outputs), (table_seconds, table_evaluations, table_outputs) = results
+  mismatches = sum(expected != actual for expected, actual in zip(gate_outputs, table_outputs))
+  return (simulators, gate_seconds, table_seconds, gate_evaluations, table_evaluations, mismatches)
+
+def main():
+  parser = argparse.ArgumentParser(description='Replaces small sub-chips by truth tables and reports the speedup')
+  parser.add_argument('--f', help=f'Chip to compare, may be repeated (default: {", ".join(DEFAULT_CHIPS)})',
+                      action='append', default=[])
+  parser.add_argument('--program', help='Also run this Hack program on the Computer chip both ways')
+  parser.add_argument('--steps', help='Random input vectors or clock cycles per chip', type=int, default=2000)
+  parser.add_argument('--table-bits', help=f'Most inputs an output may depend on (default: {TABLE_BITS})', type=int,
+                      default=TABLE_BITS)
+  parser.add_argument('--seed', help='Random seed', type=int, default=0)
+  parser.add_argument('-n', '--no-cache', help=f'Do not read or write the tables ({TABLE_SUFFIX})',
+                      action='store_true')
+
+  args = parser.parse_args()
+  library = HDLLibrary()
+  failures = 0
+  print(f'{"chip":<12}{"tables":>8}{"gates":>8}{"->":>4}{"evals/step":>12}{"->":>8}{"ms":>10}{"->":>8}'
+        f'{"speedup":>9}  result')
+
+  def report(name: str, tables: dict, simulators: list, times: tuple, evaluations: tuple, steps: int, result: str):
+    print(f'{name:<12}{len(tables):>8}{simulators[0].gate_count:>8}{simulators[1].gate_count:>4}'
+          f'{evaluations[0] / steps:>12.0f}{evaluations[1] / steps:>8.0f}{times[0] * 1000:>10.0f}{times[1] * 1000:>8.0f}'
+          f'{times[0] / times[1]:>8.2f}x  {result}')
+
+  for name in args.f or DEFAULT_CHIPS:
+    tables = chip_tables(library, name, args.table_bits, not args.no_cache)
+    simulators, gate_seconds, table_seconds, gate_evaluations, table_evaluations, mismatches = \
+      compare(library, name, tables, args.steps, args.seed)
+    failures += bool(mismatches)
+    report(name, tables, simulators, (gate_seconds, table_seconds), (gate_evaluations, table_evaluations),
+           args.steps, f'{mismatches} mismatches' if mismatches else 'ok')
+
+  if args.program is not None:
+    rom = load_rom(Path(args.program))
+    tables = chip_tables(library, 'Computer', args.table_bits, not args.no_cache)
+    computers = [ComputerSimulator(library, rom), ComputerSimulator(library, rom, tables)]
+    times, evaluations = [], []
+    for computer in computers:
+      before = computer.evaluations
+      start = time.perf_counter()
+      computer.run(args.steps)
+      times.append(time.perf_counter() - start)
+      evaluations.append(computer.evaluations - before)
+    same = computers[0].ram.cells == computers[1].ram.cells and computers[0].screen.cells == computers[1].screen.cells
+    failures += not same
+    report('Computer', tables, computers, tuple(times), tuple(evaluations), args.steps,
+           'ok' if same else 'RAM differs')
+
+  if failures:
+    raise SystemExit(1)
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,155 @@
+#!/usr/bin/env python3
+import argparse
+import time
+from pathlib import Path
+
+import numpy as np
+
+from hdlcompiler import HDLLibrary, compile_chip
+
+BACKENDS = ['numpy', 'int']
+MAX_EXHAUSTIVE_BITS = 24
+WORD_BITS = 64
+
+def select(sel, *choices):
+  return np.choose(sel, choices)
+
+def alu(p: dict) -> dict:
+  x = np.where(p['zx'], 0, p['x'])
+  x = np.where(p['nx'], x ^ 0xFFFF, x)
+  y = np.where(p['zy'], 0, p['y'])
+  y = np.where(p['ny'], y ^ 0xFFFF, y)
+  out = np.where(p['f'], (x + y) & 0xFFFF, x & y)
+  out = np.where(p['no'], out ^ 0xFFFF, out)
+  return {'out': out, 'zr': (out == 0).astype(np.int64), 'ng': out >> 15}
+
+# What each combinational chip of projects 01 and 02 computes, on arrays of pin values
+REFERENCES = {
+  'Nand': lambda p: {'out': 1 - (p['a'] & p['b'])},
+  'Not': lambda p: {'out': 1 - p['in']},
+  'And': lambda p: {'out': p['a'] & p['b']},
+  'Or': lambda p: {'out': p['a'] | p['b']},
+  'Xor': lambda p: {'out': p['a'] ^ p['b']},
+  'Mux': lambda p: {'out': select(p['sel'], p['a'], p['b'])},
+  'DMux': lambda p: {pin: np.where(p['sel'] == index, p['in'], 0) for index, pin in enumerate('ab')},
+  'Not16': lambda p: {'out': p['in'] ^ 0xFFFF},
+  'And16': lambda p: {'out': p['a'] & p['b']},
+  'Or16': lambda p: {'out': p['a'] | p['b']},
+  'Mux16': lambda p: {'out': select(p['sel'], p['a'], p['b'])},
+  'Or8Way': lambda p: {'out': (p['in'] != 0).astype(np.int64)},
+  'Mux4Way16': lambda p: {'out': select(p['sel'], *(p[pin] for pin in 'abcd'))},
+  'Mux8Way16': lambda p: {'out': select(p['sel'], *(p[pin] for pin in 'abcdefgh'))},
+  'DMux4Way': lambda p: {pin: np.where(p['sel'] == index, p['in'], 0) for index, pin in enumerate('abcd')},
+  'DMux8Way': lambda p: {pin: np.where(p['sel'] == index, p['in'], 0) for index, pin in enumerate('abcdefgh')},
+  'HalfAdder': lambda p: {'sum': p['a'] ^ p['b'], 'carry': p['a'] & p['b']},
+  'FullAdder': lambda p: {'sum': p['a'] ^ p['b'] ^ p['c'], 'carry': (p['a'] + p['b'] + p['c']) >> 1},
+  'Add16': lambda p: {'out': (p['a'] + p['b']) & 0xFFFF},
+  'Inc16': lambda p: {'out': (p['in'] + 1) & 0xFFFF},
+  'ALU': alu,
+}
+
+# Bit planes hold one input or output bit for many test vectors, vector i in bit i of an array of
+# uint64 words. Exhaustive planes count through every input combination, bit k of the vector index
+# driving input bit k.
+def exhaustive_planes(input_bits: int, first: int, count: int) -> list[np.ndarray]:
+  index = np.arange(first, first + count, dtype=np.uint64)
+  return [pack_bits((index >> np.uint64(bit)) & np.uint64(1)) for bit in range(input_bits)]
+
+def random_planes(input_bits: int, count: int, rng: np.random.Generator) -> list[np.ndarray]:
+  words = -(-count // WORD_BITS)
+  return [rng.integers(0, 1 << 64, words, dtype=np.uint64, endpoint=False) for _ in range(input_bits)]
+
+def pack_bits(bits: np.ndarray) -> np.ndarray:
+  packed = np.packbits(bits.astype(np.uint8), bitorder='little')
+  return np.pad(packed, (0, -len(packed) % 8)).view(np.uint64)
+
+def unpack_bits(plane, count: int) -> np.ndarray:
+  words = -(-count // WORD_BITS)
+  plane = np.broadcast_to(np.asarray(plane, np.uint64), (words,))
+  return np.unpackbits(np.ascontiguousarray(plane).view(np.uint8), bitorder='little')[:count]
+
+# Python ints hold a whole plane in one arbitrary precision value
+def to_int(plane: np.ndarray) -> int:
+  return int.from_bytes(plane.tobytes(), 'little')
+
+def from_int(value: int, words: int) -> np.ndarray:
+  return np.frombuffer(value.to_bytes(words * 8, 'little'), np.uint64)
+
+# Evaluates the chip on every vector of the input planes at once and returns the output planes
+def evaluate_planes(chip, planes: list[np.ndarray], backend: str) -> list[np.ndarray]:
+  words = len(planes[0]) if planes else 1
+  if backend == 'int':
+    mask = (1 << (words * WORD_BITS)) - 1
+    outputs, _ = chip.evaluate([to_int(plane) for plane in planes], [], mask)
+    return [from_int(value, words) for value in outputs]
+  mask = np.full(words, np.iinfo(np.uint64).max, np.uint64)
+  outputs, _ = chip.evaluate(planes, [], mask)
+  return [np.broadcast_to(np.asarray(plane, np.uint64), (words,)) for plane in outputs]
+
+def pin_values(pins: dict[str, int], planes: list[np.ndarray], count: int) -> dict[str, np.ndarray]:
+  values = {}
+  offset = 0
+  for pin, width in pins.items():
+    values[pin] = sum(unpack_bits(planes[offset + bit], count).astype(np.int64) << bit for bit in range(width))
+    offset += width
+  return values
+
+# Number of vectors whose outputs differ from the reference model
+def count_mismatches(chip, input_planes: list[np.ndarray], output_planes: list[np.ndarray], count: int) -> int:
+  expected = REFERENCES[chip.name](pin_values(chip.inputs, input_planes, count))
+  actual = pin_values(chip.outputs, output_planes, count)
+  wrong = np.zeros(count, bool)
+  for pin in chip.outputs:
+    wrong |= np.asarray(expected[pin]) != actual[pin]
+  return int(wrong.sum())
+
+def main():
+  parser = argparse.ArgumentParser(description='Evaluates combinational chips on many test vectors at once')
+  parser.add_argument('--f', help='Chip name or HDL file')
+  parser.add_argument('-b', '--backend', help='Bit plane representation', choices=BACKENDS, default='numpy')
+  parser.add_argument('--vectors', help='Random vectors to test when the chip is too wide to sweep', type=int,
+                      default=1 << 20)
+  parser.add_argument('--batch', help='Vectors evaluated per call', type=int, default=1 << 16)
+  parser.add_argument('--seed', help='Random seed', type=int, default=0)
+  parser.add_argument('-c', '--check', help='Compare the outputs with the reference model of the chip',
+                      action='store_true')
+
+  args = parser.parse_args()
+  library = HDLLibrary()
+  if args.f.endswith('.hdl'):
+    library.directories.insert(0, Path(args.f).resolve().parent)
+  chip = compile_chip(library, Path(args.f).stem)
+  if chip.state_size:
+    raise SystemExit(f'{chip.name} has {chip.state_size} DFFs, only combinational chips can be vectorized')
+  if args.check and chip.name not in REFERENCES:
+    raise SystemExit(f'No reference model for {chip.name}')
+
+  input_bits = sum(chip.inputs.values())
+  exhaustive = input_bits <= MAX_EXHAUSTIVE_BITS
+  total = 1 << input_bits if exhaustive else args.vectors
+  batch = max(WORD_BITS, args.batch - args.batch % WORD_BITS)
+  rng = np.random.default_rng(args.seed)
+
+  evaluated = 0
+  mismatches = 0
+  seconds = 0.0
+  while evaluated < total:
+    count = min(batch, total - evaluated)
+    planes = exhaustive_planes(input_bits, evaluated, count) if exhaustive else random_planes(input_bits, count, rng)
+    start = time.perf_counter()
+    outputs = evaluate_planes(chip, planes, args.backend)
+    seconds += time.perf_counter() - start
+    if args.check:
+      mismatches += count_mismatches(chip, planes, outputs, count)
+    evaluated += count
+
+  kind = f'all {total}' if exhaustive else f'{total} random'
+  print(f'{chip.name}: {kind} vectors of {input_bits} input bits in {seconds * 1000:.1f} ms, '
+        f'{total / seconds / 1e6:.2f} M vectors/s ({args.backend})')
+  if args.check:
+    print(f'{total - mismatches} of {total} vectors match the reference model')
+    if mismatches:
+      raise SystemExit(1)
+
+if __name__ == '__main__':
+  main()
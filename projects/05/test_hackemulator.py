@@ -0,0 +1,24 @@
+from pathlib import Path
+
+from hackemulator import BlockMachine, IdleMachine, load_rom
+
+FILL = Path(__file__).resolve().parent.parent / '04' / 'fill' / 'Fill.asm'
+
+# Fill polls KBD and repaints the whole screen each round, a period longer than the first watch window
+def test_fill_goes_idle():
+  machine = IdleMachine(load_rom(FILL))
+  machine.halt_when_idle = True
+  machine.run(3_000_000)
+  assert machine.halted
+  assert machine.cycles < 3_000_000
+  assert [period for _, period, _ in machine.idle_loops] == [155648]
+
+def test_fast_forward_matches_full_run():
+  rom = load_rom(FILL)
+  idle, full = IdleMachine(rom), BlockMachine(rom)
+  for machine in [idle, full]:
+    machine.set_key(1)
+    machine.run(3_000_001)
+  assert idle.idle_loops and idle.idle_loops[0][2] > 0
+  assert (idle.pc, idle.a, idle.d, idle.cycles) == (full.pc, full.a, full.d, full.cycles)
+  assert idle.ram == full.ram
@@ -45,10 +45,13 @@ COMP = {
     'D-1' : '001110',
     'A-1' : '110010',
     'D+A' : '000010',
+    'A+D' : '000010',
     'D-A' : '010011',
     'A-D' : '000111',
     'D&A' : '000000',
+    'A&D' : '000000',
     'D|A' : '010101',
+    'A|D' : '010101',
   },
   1 : {
     'M'   : '110000',
@@ -57,10 +60,13 @@ COMP = {
     'M+1' : '110111',
     'M-1' : '110010',
     'D+M' : '000010',
+    'M+D' : '000010',
     'D-M' : '010011',
     'M-D' : '000111',
     'D&M' : '000000',
+    'M&D' : '000000',
     'D|M' : '010101',
+    'M|D' : '010101',
   }
 }
 
@@ -99,73 +105,121 @@ def is_comment(line):
 def is_label(line):
   return '(' in line and ')' in line
 
-def parse_a_instruction(data):
-  return ('0'+('0'*(15-int(data).bit_length()))+bin(int(data)).lstrip('-0b'))
-
-def assemble(file_path,output_file):
+def strip_line(line):
+  return line.split('//')[0].strip()
+
+# Assembly records are ('@', constant or symbol), ('(', label) and ('C', dest, comp, jump) with '' for
+# an omitted dest or jump. Comment records ('//', text) are skipped.
+def parse_line(line):
+  line = strip_line(line)
+  if is_blank(line) or is_comment(line):
+    return None
+  if is_label(line):
+    return ('(', line.strip('(').strip(')').strip())
+  if line[0] == '@':
+    var = line[1:]
+    return ('@', int(var) if str.isdigit(var[0]) else var)
+  dest, _, rhs = line.rpartition('=')
+  comp, _, jump = rhs.partition(';')
+  return ('C', dest.strip(), comp.strip(), jump.strip())
+
+def parse_lines(lines):
+  return [record for record in map(parse_line, lines) if record is not None]
+
+# Maps every label to the ROM address of the instruction that follows it
+def label_addresses(records):
+  goto_map = {}
+  abs_index = 0
+  for record in records:
+    if record[0] == '(':
+      goto_map[record[1]] = abs_index
+    elif record[0] != '//':
+      abs_index+=1
+  return goto_map
+
+def build_goto_map(lines):
+  return label_addresses(parse_lines(lines))
+
+# VM functions are the only labels the translator emits with a class prefix and no $ scope
+def is_function_label(label):
+  return '.' in label and '$' not in label
+
+# Splits a ROM of the given size into (first, end, name) ranges, one per function label plus the code
+# ahead of the first function
+def function_ranges(goto_map, size):
+  starts = sorted((address, label) for label, address in goto_map.items() if is_function_label(label))
+  bounds = [(0, '(start)')] + starts + [(size, None)]
+  return [(first, end, name) for (first, name), (end, _) in zip(bounds, bounds[1:]) if end > first]
+
+def write_symbols(ranges, symbol_file):
+  with open(symbol_file, 'w') as f:
+    f.writelines(f'{first} {end} {name}\n' for first, end, name in ranges)
+
+def c_instruction(dest, comp, jump):
+  a = 1 if 'M' in comp else 0
+  dst = DEST[dest] if dest != '' else '000'
+  jmp = JUMP[jump] if jump != '' else '000'
+  return int('111' + str(a) + COMP[a][comp] + dst + jmp, 2)
+
+# Assembles assembly records into a list of ROM words. Symbols that are neither predefined nor labels
+# become variables from RAM[16] on in order of first use.
+def assemble_records(records):
   buffer = []
   cache = {}
-  goto_map = {}
   slot = 16
-  abs_index = 0
+  goto_map = label_addresses(records)
+
+  for record in records:
+    if record[0] in ('(', '//'):
+      continue
+    elif record in cache:
+      buffer.append(cache[record])
+      continue
+    elif record[0] == '@':
+      var = record[1]
+      if isinstance(var, int):
+        instruction = var
+      elif var in PREDEF_SYMBOLS:
+        instruction = PREDEF_SYMBOLS[var]
+      elif var in goto_map:
+        instruction = goto_map[var]
+      else:
+        instruction = slot
+        slot += 1
+    else:
+      instruction = c_instruction(*record[1:])
 
-  # Generate goto_map
-  with open(file_path, 'r') as f:
-    for line in f:
-      line = line.strip('\n').strip()
-      if is_blank(line) or is_comment(line):
-        continue
-      if is_label(line):
-        goto_map[line.strip('(').strip(')').strip()] = abs_index
-        continue
-      abs_index+=1
+    buffer.append(instruction)
+    cache[record]=instruction
 
-  # Generate final machine code
+  return buffer
+
+# Assembles an iterable of Hack assembly lines into a list of 16 character binary words
+def assemble_lines(lines):
+  return [format(word, '016b') for word in assemble_records(parse_lines(lines))]
+
+def assemble(file_path,output_file,symbol_file=None):
   with open(file_path, 'r') as f:
-    for line in f:
-      line = line.strip('\n').strip()
-      instruction = ''
-
-      if is_blank(line) or is_comment(line) or is_label(line):
-        continue
-      elif line in cache:
-        buffer.append(cache[line])
-        continue
-      elif line[0] == '@':
-        var = line[1:]
-        if str.isdigit(var[0]):
-          instruction = parse_a_instruction(var)
-        elif var in PREDEF_SYMBOLS:
-          instruction = parse_a_instruction(PREDEF_SYMBOLS[var])
-        elif var in goto_map:
-          instruction = parse_a_instruction(goto_map[var])
-        else:
-          instruction = parse_a_instruction(slot)
-          slot += 1
-      else:
-        dst = '000' if '=' not in line else DEST[line.split('=')[0].strip()]
-        RHS = line.split('=')[1] if '=' in line else line
-        jmp = JUMP[RHS.split(';')[-1].strip()] if ';' in line else '000'
-        a = 1 if 'M' in RHS.split(';')[0].strip() else 0
-        c_bits = COMP[a][RHS.split(';')[0].strip()]
-        instruction = '111' + str(a) + c_bits + dst + jmp
+    lines = f.read().splitlines()
+  buffer = assemble_lines(lines)
 
-      buffer.append(instruction)
-      cache[line]=instruction
+  with open(output_file, 'w') as f:
+    f.writelines(line + '\n' for line in buffer)
 
-    with open(output_file, 'w') as f:
-      f.writelines(line + '\n' for line in buffer)
+  if symbol_file is not None:
+    write_symbols(function_ranges(build_goto_map(lines), len(buffer)), symbol_file)
 
 def main():
   parser = argparse.ArgumentParser(description='Assembles Hack assembly')
   parser.add_argument('--f', help='File to assemble')
   parser.add_argument('--o', help='Name of output file')
+  parser.add_argument('-s', '--symbols', help='Also write the ROM range of every VM function to this file')
 
   args = parser.parse_args()
   file_path = args.f
   output_file = args.o
 
-  assemble(file_path,output_file)
+  assemble(file_path,output_file,args.symbols)
 
 if __name__ == '__main__':
   main()
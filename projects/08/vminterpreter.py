@@ -0,0 +1,485 @@
+#!/usr/bin/env python3
+import argparse
+import bisect
+import importlib.util
+import math
+import time
+from array import array
+from pathlib import Path
+
+from vmtranslator import LabelValue, bootstrap_records, parse_commands, scoped_label, translate_commands
+
+RAM_SIZE = 32768
+KBD = 24576
+ADDRESS_MASK = 0x7FFF
+STACK_BASE = 256
+VARIABLE_BASE = 16
+TRANSLATOR_TEMPS = range(13, 16)
+HEAP_BASE = 2048
+HEAP_END = 16384
+
+SEGMENT_BASES = {'local': 1, 'argument': 2, 'this': 3, 'that': 4}
+FIXED_BASES = {'pointer': 3, 'temp': 5}
+
+# Opcodes of the preparsed program, labels resolve to the index of the next instruction
+PUSH_CONSTANT = 0
+PUSH_SEGMENT = 1
+POP_SEGMENT = 2
+PUSH_FIXED = 3
+POP_FIXED = 4
+BINARY = 5
+UNARY = 6
+GOTO = 7
+IF_GOTO = 8
+CALL = 9
+FUNCTION = 10
+RETURN = 11
+HALT = 12
+END = 13
+CALL_NATIVE = 14
+
+def wrap(value):
+  return ((value + 32768) & 0xFFFF) - 32768
+
+# Comparisons test the wrapped difference x - y like the D=A-D the translator emits, so results agree
+# with the Hack path even when the subtraction overflows
+BINARY_FUNCTIONS = {
+  'add': lambda x, y: wrap(x + y),
+  'sub': lambda x, y: wrap(x - y),
+  'and': lambda x, y: x & y,
+  'or': lambda x, y: x | y,
+  'eq': lambda x, y: -1 if x == y else 0,
+  'gt': lambda x, y: -1 if wrap(x - y) > 0 else 0,
+  'lt': lambda x, y: -1 if wrap(x - y) < 0 else 0,
+}
+
+UNARY_FUNCTIONS = {
+  'neg': lambda x: wrap(-x),
+  'not': lambda x: ~x,
+}
+
+# First fit allocator over the heap for the native Memory, Array and String routines
+class NativeHeap:
+  def __init__(self):
+    self.free: list[list[int]] = [[HEAP_BASE, HEAP_END - HEAP_BASE]]
+    self.sizes: dict[int, int] = {}
+
+  def alloc(self, size: int) -> int:
+    if size <= 0:
+      raise RuntimeError(f'Memory.alloc of {size} words')
+    for index, (address, length) in enumerate(self.free):
+      if length >= size:
+        if length == size:
+          del self.free[index]
+        else:
+          self.free[index] = [address + size, length - size]
+        self.sizes[address] = size
+        return address
+    raise RuntimeError(f'Heap overflow allocating {size} words')
+
+  def dealloc(self, address: int):
+    size = self.sizes.pop(address, None)
+    if size is None:
+      return
+    index = bisect.bisect(self.free, [address, size])
+    self.free.insert(index, [address, size])
+    for index in [index, index - 1]:
+      if 0 <= index < len(self.free) - 1 and sum(self.free[index]) == self.free[index + 1][0]:
+        self.free[index][1] += self.free.pop(index + 1)[1]
+
+def math_divide(machine, x, y):
+  if y == 0:
+    raise RuntimeError('Division by zero in Math.divide')
+  return wrap(int(x / y))
+
+def math_sqrt(machine, x):
+  if x < 0:
+    raise RuntimeError('Math.sqrt of a negative number')
+  return math.isqrt(x)
+
+def memory_init(machine):
+  machine.heap = NativeHeap()
+
+def memory_poke(machine, address, value):
+  if address & ADDRESS_MASK < KBD:
+    machine.ram[address & ADDRESS_MASK] = value
+
+# Strings are (chars, length, capacity) objects with their characters in a separate array
+def string_new(machine, capacity):
+  string = machine.heap.alloc(3)
+  machine.ram[string:string + 3] = array('h', [machine.heap.alloc(max(capacity, 1)), 0, capacity])
+  return string
+
+def string_dispose(machine, string):
+  machine.heap.dealloc(machine.ram[string])
+  machine.heap.dealloc(string)
+
+def string_char_at(machine, string, index):
+  return machine.ram[machine.ram[string] + index]
+
+def string_set_char_at(machine, string, index, c):
+  machine.ram[machine.ram[string] + index] = c
+
+def string_append_char(machine, string, c):
+  chars, length, capacity = machine.ram[string:string + 3]
+  if length >= capacity:
+    raise RuntimeError('String.appendChar on a full string')
+  machine.ram[chars + length] = c
+  machine.ram[string + 1] = length + 1
+  return string
+
+def string_erase_last_char(machine, string):
+  machine.ram[string + 1] = max(machine.ram[string + 1] - 1, 0)
+
+def string_int_value(machine, string):
+  chars, length, _ = machine.ram[string:string + 3]
+  value, sign = 0, 1
+  for index in range(length):
+    c = machine.ram[chars + index]
+    if index == 0 and c == ord('-'):
+      sign = -1
+    elif ord('0') <= c <= ord('9'):
+      value = value * 10 + c - ord('0')
+    else:
+      break
+  return wrap(sign * value)
+
+def string_set_int(machine, string, value):
+  chars, _, capacity = machine.ram[string:string + 3]
+  text = str(value)
+  if len(text) > capacity:
+    raise RuntimeError('String.setInt on a string that is too short')
+  machine.ram[chars:chars + len(text)] = array('h', map(ord, text))
+  machine.ram[string + 1] = len(text)
+
+# Native versions of the Jack OS routines the compiler leans on, called as fn(machine, *arguments).
+# A class runs natively only when every function of it that the program calls is listed here.
+NATIVES = {
+  'Math.init': lambda machine: 0,
+  'Math.abs': lambda machine, x: wrap(abs(x)),
+  'Math.multiply': lambda machine, x, y: wrap(x * y),
+  'Math.divide': math_divide,
+  'Math.min': lambda machine, x, y: min(x, y),
+  'Math.max': lambda machine, x, y: max(x, y),
+  'Math.sqrt': math_sqrt,
+  'Memory.init': memory_init,
+  'Memory.peek': lambda machine, address: machine.ram[address & ADDRESS_MASK],
+  'Memory.poke': memory_poke,
+  'Memory.alloc': lambda machine, size: machine.heap.alloc(size),
+  'Memory.deAlloc': lambda machine, address: machine.heap.dealloc(address),
+  'Array.new': lambda machine, size: machine.heap.alloc(size),
+  'Array.dispose': lambda machine, address: machine.heap.dealloc(address),
+  'String.new': string_new,
+  'String.dispose': string_dispose,
+  'String.length': lambda machine, string: machine.ram[string + 1],
+  'String.charAt': string_char_at,
+  'String.setCharAt': string_set_char_at,
+  'String.appendChar': string_append_char,
+  'String.eraseLastChar': string_erase_last_char,
+  'String.intValue': string_int_value,
+  'String.setInt': string_set_int,
+  'String.backSpace': lambda machine: 129,
+  'String.doubleQuote': lambda machine: 34,
+  'String.newLine': lambda machine: 128,
+}
+
+# Native classes whose objects live on the native heap
+NATIVE_DEPENDENCIES = {'Array': 'Memory', 'String': 'Memory'}
+
+def load_project_module(name: str, relative_path: str):
+  spec = importlib.util.spec_from_file_location(name, Path(__file__).resolve().parent / relative_path)
+  module = importlib.util.module_from_spec(spec)
+  spec.loader.exec_module(module)
+  return module
+
+# Preparses units of VM command records into (opcode, x, y) tuples with labels and functions resolved to instruction
+# indices. Static variables get the RAM addresses the assembler would give the translated program,
+# which allocates a slot for every unresolved symbol in order of first use.
+class VMProgram:
+  def __init__(self, units: dict[str, list[tuple]], use_bootstrap: bool = True, natives: None | dict = None):
+    self.commands: list[tuple[str, list]] = []
+    self.labels: dict[str, int] = {}
+    self.functions: dict[str, int] = {}
+    self.variables: dict[str, int] = {}
+
+    if use_bootstrap:
+      self.commands.append(('', ['call', 'Sys.init', 0]))
+    for name, commands in units.items():
+      function_name = ''
+      for command in commands:
+        words = list(command)
+        if words[0] in ['label', 'goto', 'if-goto']:
+          words[1] = scoped_label(function_name, words[1])
+        if words[0] == 'label':
+          self.labels[words[1]] = len(self.commands)
+          continue
+        if words[0] == 'function':
+          function_name = words[1]
+          self.functions[words[1]] = len(self.commands)
+        self.commands.append((name, words))
+
+    self.natives = self.usable_natives(natives if natives is not None else {})
+    self.code = [self.parse(index, name, words) for index, (name, words) in enumerate(self.commands)]
+    self.code.append((END, 0, 0))
+
+  # Drops every native of a class that code outside it calls a non native function of, and of classes
+  # that depend on a dropped class. Calls inside an OS class only reach its own helpers.
+  def usable_natives(self, natives: dict) -> dict:
+    called = {words[1] for name, words in self.commands if words[0] == 'call' and words[1].split('.')[0] != name}
+    classes = {name.split('.')[0] for name in natives}
+    classes -= {name.split('.')[0] for name in called if name not in natives}
+    while any(NATIVE_DEPENDENCIES.get(name, name) not in classes for name in classes):
+      classes = {name for name in classes if NATIVE_DEPENDENCIES.get(name, name) in classes}
+    return {name: fn for name, fn in natives.items() if name.split('.')[0] in classes}
+
+  def variable(self, symbol: str) -> int:
+    if symbol not in self.variables:
+      self.variables[symbol] = VARIABLE_BASE + len(self.variables)
+    return self.variables[symbol]
+
+  def function(self, symbol: str) -> None | int:
+    if symbol in self.functions:
+      return self.functions[symbol]
+    if symbol not in self.labels:
+      self.variable(symbol)
+    return self.labels.get(symbol)
+
+  def parse(self, index: int, name: str, words: list[str]) -> tuple:
+    command = words[0]
+    if command in ['push', 'pop']:
+      segment, value = words[1], words[2]
+      if segment == 'constant':
+        return PUSH_CONSTANT, value, 0
+      if segment in SEGMENT_BASES:
+        return PUSH_SEGMENT if command == 'push' else POP_SEGMENT, SEGMENT_BASES[segment], value
+      address = self.variable(f'{name}.vm.{value}') if segment == 'static' else FIXED_BASES[segment] + value
+      return PUSH_FIXED if command == 'push' else POP_FIXED, address, 0
+    if command in BINARY_FUNCTIONS:
+      return BINARY, BINARY_FUNCTIONS[command], 0
+    if command in UNARY_FUNCTIONS:
+      return UNARY, UNARY_FUNCTIONS[command], 0
+    if command in ['goto', 'if-goto']:
+      if words[1] not in self.labels:
+        raise ValueError(f'Unknown label {words[1]} in {name}')
+      target = self.labels[words[1]]
+      if command == 'if-goto':
+        return IF_GOTO, target, 0
+      return (HALT, 0, 0) if target == index else (GOTO, target, 0)
+    if command == 'call':
+      if words[1] in self.natives:
+        return CALL_NATIVE, self.natives[words[1]], words[2]
+      return CALL, self.function(words[1]), words[2]
+    if command == 'function':
+      return FUNCTION, words[2], 0
+    if command == 'return':
+      return RETURN, 0, 0
+    raise ValueError(f'Unknown VM command: {" ".join(words)}')
+
+class VMMachine:
+  def __init__(self, program: VMProgram, use_bootstrap: bool = True, track_return_slots: bool = False):
+    self.program = program
+    self.ram = array('h', bytes(2 * RAM_SIZE))
+    self.ram[0] = STACK_BASE if use_bootstrap else 0
+    self.pc = 0
+    self.steps = 0
+    self.halted = False
+    self.return_slots: None | set[int] = set() if track_return_slots else None
+    self.heap = NativeHeap()
+    self.native_calls = 0
+
+  # Runs until the program halts or max_steps more VM commands have executed and returns the number
+  # of commands executed. The stack pointer lives in a local and is written back to RAM[0] on exit.
+  def run(self, max_steps: int) -> int:
+    code = self.program.code
+    ram = self.ram
+    return_slots = self.return_slots
+    pc = self.pc
+    sp = ram[0]
+    start = self.steps
+    steps = start
+    limit = start + max_steps
+
+    try:
+      while steps < limit:
+        op, x, y = code[pc]
+        steps += 1
+        pc += 1
+        if op == PUSH_CONSTANT:
+          ram[sp] = x
+          sp += 1
+        elif op == PUSH_SEGMENT:
+          ram[sp] = ram[(ram[x] + y) & ADDRESS_MASK]
+          sp += 1
+        elif op == POP_SEGMENT:
+          sp -= 1
+          address = (ram[x] + y) & ADDRESS_MASK
+          if address < KBD:
+            ram[address] = ram[sp]
+        elif op == BINARY:
+          sp -= 1
+          ram[sp - 1] = x(ram[sp - 1], ram[sp])
+        elif op == IF_GOTO:
+          sp -= 1
+          if ram[sp]:
+            pc = x
+        elif op == GOTO:
+          pc = x
+        elif op == PUSH_FIXED:
+          ram[sp] = ram[x]
+          sp += 1
+        elif op == POP_FIXED:
+          sp -= 1
+          ram[x] = ram[sp]
+        elif op == UNARY:
+          ram[sp - 1] = x(ram[sp - 1])
+        elif op == CALL_NATIVE:
+          sp -= y
+          result = x(self, *ram[sp:sp + y])
+          ram[sp] = result if result is not None else 0
+          sp += 1
+          self.native_calls += 1
+        elif op == CALL:
+          if x is None:
+            self.pc, ram[0], self.steps = pc - 1, sp, steps - 1
+            raise RuntimeError(f'Call to undefined function {self.program.commands[pc - 1][1][1]}')
+          if return_slots is not None:
+            return_slots.add(sp)
+          ram[sp] = pc
+          ram[sp + 1] = ram[1]
+          ram[sp + 2] = ram[2]
+          ram[sp + 3] = ram[3]
+          ram[sp + 4] = ram[4]
+          sp += 5
+          ram[2] = sp - 5 - y
+          ram[1] = sp
+          pc = x
+        elif op == FUNCTION:
+          for _ in range(x):
+            ram[sp] = 0
+            sp += 1
+        elif op == RETURN:
+          frame = ram[1]
+          return_address = ram[frame - 5]
+          sp -= 1
+          ram[ram[2]] = ram[sp]
+          sp = ram[2] + 1
+          ram[4] = ram[frame - 1]
+          ram[3] = ram[frame - 2]
+          ram[2] = ram[frame - 3]
+          ram[1] = ram[frame - 4]
+          pc = return_address
+        else:
+          pc -= 1
+          steps -= 1
+          self.halted = True
+          break
+    except (IndexError, OverflowError):
+      self.pc, self.steps = pc - 1, steps - 1
+      raise RuntimeError(f'Stack overflow at {" ".join(self.program.commands[pc - 1][1])}') from None
+
+    self.pc = pc
+    self.steps = steps
+    ram[0] = sp
+    return steps - start
+
+def load_units(file_path: Path) -> dict[str, list[tuple]]:
+  candidates = [file_path] if not file_path.is_dir() else sorted(file_path.glob('*.vm'))
+  units = {}
+  for fp in candidates:
+    with open(fp, 'r') as f:
+      units[fp.stem] = parse_commands(f.read().splitlines())
+  return units
+
+# Runs the program both directly and as translated, assembled Hack code and compares the RAM below the
+# memory map. The translator's R13-R15 temporaries and the stack slots that held return addresses
+# (VM indices here, ROM addresses there) are left out. OS routines run from their VM code on both sides.
+def cross_check(units: dict[str, list[tuple]], use_bootstrap: bool, presets: list[tuple[int, int]],
+                max_steps: int, max_cycles: int) -> dict:
+  assembler = load_project_module('assembler', '../06/assembler.py')
+  hackemulator = load_project_module('hackemulator', '../05/hackemulator.py')
+
+  start = time.perf_counter()
+  vm_machine = VMMachine(VMProgram(units, use_bootstrap), use_bootstrap, track_return_slots=True)
+  for address, value in presets:
+    vm_machine.ram[address] = value
+  vm_machine.run(max_steps)
+  vm_seconds = time.perf_counter() - start
+
+  start = time.perf_counter()
+  label_value = LabelValue()
+  asm = bootstrap_records(False, label_value) if use_bootstrap else []
+  for name, commands in units.items():
+    asm += translate_commands(commands, name + '.vm', False, label_value)
+  rom = assembler.assemble_records(asm)
+  hack_machine = hackemulator.BlockMachine(rom)
+  for address, value in presets:
+    hack_machine.ram[address] = value
+  hack_machine.run(max_cycles)
+  hack_seconds = time.perf_counter() - start
+
+  skipped = set(TRANSLATOR_TEMPS) | vm_machine.return_slots
+  mismatches = [address for address in range(KBD)
+                if address not in skipped and vm_machine.ram[address] != hack_machine.ram[address]]
+  return {
+    'steps': vm_machine.steps,
+    'cycles': hack_machine.cycles,
+    'halted': (vm_machine.halted, hack_machine.halted),
+    'seconds': (vm_seconds, hack_seconds),
+    'mismatches': [(address, vm_machine.ram[address], hack_machine.ram[address]) for address in mismatches],
+  }
+
+def parse_assignment(text: str) -> tuple[int, int]:
+  address, value = text.split('=')
+  return int(address), int(value)
+
+def parse_range(text: str) -> range:
+  first, _, last = text.partition('-')
+  return range(int(first), int(last if last != '' else first) + 1)
+
+def main():
+  parser = argparse.ArgumentParser(description='Runs VM code directly')
+  parser.add_argument('--f', help='VM code (.vm) or folder containing VM code to run')
+  parser.add_argument('-b', '--bootstrap', help='Set SP to 256 and start by calling Sys.init', action='store_true')
+  parser.add_argument('--steps', help='Maximum number of VM commands to execute', type=int, default=10_000_000)
+  parser.add_argument('--set', help='Initial RAM value as ADDRESS=VALUE, may be repeated', action='append',
+                      default=[])
+  parser.add_argument('--ram', help='RAM range to print as FIRST-LAST, may be repeated', action='append', default=[])
+  parser.add_argument('-r', '--real-os', help='Run the OS routines from their VM code instead of natively',
+                      action='store_true')
+  parser.add_argument('--check', help='Also run the translated and assembled program and compare the RAM',
+                      action='store_true')
+  parser.add_argument('--cycles', help='Maximum number of Hack instructions for --check', type=int,
+                      default=100_000_000)
+
+  args = parser.parse_args()
+  units = load_units(Path(args.f))
+  presets = [parse_assignment(text) for text in args.set]
+
+  if args.check:
+    report = cross_check(units, args.bootstrap, presets, args.steps, args.cycles)
+    vm_seconds, hack_seconds = report['seconds']
+    print(f'VM: {report["steps"]} commands in {vm_seconds * 1000:.1f} ms, '
+          f'Hack: {report["cycles"]} instructions in {hack_seconds * 1000:.1f} ms')
+    if report['halted'] != (True, True):
+      print('Warning: a run stopped at its limit before halting')
+    for address, vm_value, hack_value in report['mismatches']:
+      print(f'RAM[{address}]: VM {vm_value}, Hack {hack_value}')
+    if report['mismatches']:
+      raise SystemExit(1)
+    print('RAM matches')
+    return
+
+  machine = VMMachine(VMProgram(units, args.bootstrap, None if args.real_os else NATIVES), args.bootstrap)
+  for address, value in presets:
+    machine.ram[address] = value
+  start = time.perf_counter()
+  executed = machine.run(args.steps)
+  elapsed = time.perf_counter() - start
+
+  for address in (address for text in args.ram for address in parse_range(text)):
+    print(f'RAM[{address}] = {machine.ram[address]}')
+  print(f'{"Halted" if machine.halted else "Stopped"} after {executed} commands and {machine.native_calls} native '
+        f'calls in {elapsed * 1000:.1f} ms')
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+from vmtranslator import LabelValue, bootstrap, is_comment, translate_lines
+
+PROJECTS = Path(__file__).resolve().parent.parent
+SUITES = ['07', '08']
+
+# RAM presets, compared RAM ranges and cycle budgets of the course test scripts (.tst and .cmp) for each
+# shipped program. Programs without an entry start with SP at 256 and compare the pointers and stack.
+PROGRAMS = {
+  'SimpleAdd': ([(0, 256)], ['0', '256'], 60),
+  'StackTest': ([(0, 256)], ['0', '256-265'], 1000),
+  'BasicTest': ([(0, 256), (1, 300), (2, 400), (3, 3000), (4, 3010)],
+                ['256', '300', '401-402', '3006', '3012', '3015', '11'], 600),
+  'PointerTest': ([(0, 256)], ['256', '3-4', '3032', '3046'], 450),
+  'StaticTest': ([(0, 256)], ['256'], 200),
+  'BasicLoop': ([(0, 256), (1, 300), (2, 400), (400, 3)], ['0', '256'], 600),
+  'FibonacciSeries': ([(0, 256), (1, 300), (2, 400), (400, 6), (401, 3000)], ['3000-3005'], 1100),
+  'SimpleFunction': ([(0, 317), (1, 317), (2, 310), (3, 3000), (4, 4000), (310, 1234), (311, 37), (312, 1000),
+                      (313, 305), (314, 300), (315, 3010), (316, 4010)], ['0-4', '310'], 300),
+  'NestedCall': ([], ['0-6'], 4000),
+  'FibonacciElement': ([], ['0', '261'], 6000),
+  'StaticsTest': ([], ['0', '261-262'], 2500),
+}
+DEFAULT_PROGRAM = ([(0, 256)], ['0-4', '256-299'], 100_000)
+
+def discover(root: Path = PROJECTS) -> list[Path]:
+  return sorted(fp for suite in SUITES for fp in (root / suite).glob('*/*/*.asm'))
+
+# The shipped programs were translated with comments on, which keeps every VM command as a comment
+# above its assembly. Returns whether the bootstrap was generated and the VM lines of each unit in
+# translation order. Programs translated from a single file before units were named get their stem.
+def recover_units(lines: list[str], default_name: str) -> tuple[bool, dict[str, list[str]]]:
+  use_bootstrap = False
+  units = {}
+  name = default_name + '.vm'
+  for line in lines:
+    if not is_comment(line):
+      continue
+    text = line[2:].strip()
+    if text == 'Bootstrap':
+      use_bootstrap = True
+    elif text.startswith('File: '):
+      name = text[len('File: '):]
+      units.setdefault(name, [])
+    elif text not in ('Call Sys.init', 'push const 0'):
+      units.setdefault(name, []).append(text)
+  return use_bootstrap, units
+
+def regenerate(use_bootstrap: bool, units: dict[str, list[str]]) -> list[str]:
+  label_value = LabelValue()
+  buffer = bootstrap(False, label_value) if use_bootstrap else []
+  for name, lines in units.items():
+    buffer += translate_lines(lines, name, False, label_value)
+  return buffer
+
+def parse_range(text: str) -> range:
+  first, _, last = text.partition('-')
+  return range(int(first), int(last if last != '' else first) + 1)
+
+# Assembles and runs the shipped program and its regeneration from the current translator. Runs in a
+# worker process, so it loads the assembler and emulator itself and returns plain data.
+def check_program(file_path: Path, engine: str) -> dict:
+  from vminterpreter import load_project_module
+  assembler = load_project_module('assembler', '../06/assembler.py')
+  hackemulator = load_project_module('hackemulator', '../05/hackemulator.py')
+
+  with open(file_path, 'r') as f:
+    shipped = f.read().splitlines()
+  presets, regions, max_cycles = PROGRAMS.get(file_path.stem, DEFAULT_PROGRAM)
+  addresses = [address for text in regions for address in parse_range(text)]
+
+  results = []
+  for asm in (shipped, regenerate(*recover_units(shipped, file_path.stem))):
+    rom = assembler.assemble_records(assembler.parse_lines(asm))
+    machine = hackemulator.ENGINES[engine](rom)
+    for address, value in presets:
+      machine.ram[address] = value
+    machine.run(max_cycles)
+    results.append((len(rom), machine.cycles, machine.halted, [machine.ram[address] for address in addresses]))
+
+  (shipped_size, shipped_cycles, shipped_halted, shipped_ram), (size, cycles, halted, ram) = results
+  return {
+    'name': str(file_path.relative_to(PROJECTS)),
+    'sizes': (shipped_size, size),
+    'cycles': (shipped_cycles, cycles),
+    'halted': (shipped_halted, halted),
+    'mismatches': [(address, expected, actual)
+                   for address, expected, actual in zip(addresses, shipped_ram, ram) if expected != actual],
+  }
+
+def main():
+  parser = argparse.ArgumentParser(description='Runs the shipped 07 and 08 programs against their regeneration')
+  parser.add_argument('--f', help='Shipped assembly program to check, may be repeated (default: all)',
+                      action='append', default=[])
+  parser.add_argument('-e', '--engine', help='Execution engine', choices=['interpret', 'blocks'], default='interpret')
+  parser.add_argument('-j', '--jobs', help='Number of worker processes (default: one per CPU)', type=int)
+
+  args = parser.parse_args()
+  candidates = [Path(text).resolve() for text in args.f] or discover()
+
+  with ProcessPoolExecutor(args.jobs) as executor:
+    reports = list(executor.map(check_program, candidates, [args.engine] * len(candidates)))
+
+  print(f'{"program":<56}{"words":>8}{"regen":>8}{"cycles":>10}{"regen":>10}  result')
+  failures = 0
+  for report in reports:
+    failures += bool(report['mismatches'])
+    result = 'FAIL' if report['mismatches'] else 'ok' if all(report['halted']) else 'ok (cycle limit)'
+    print(f'{report["name"]:<56}{report["sizes"][0]:>8}{report["sizes"][1]:>8}'
+          f'{report["cycles"][0]:>10}{report["cycles"][1]:>10}  {result}')
+    for address, expected, actual in report['mismatches']:
+      print(f'  RAM[{address}]: shipped {expected}, regenerated {actual}')
+  print(f'{len(reports) - failures} of {len(reports)} programs match')
+  if failures:
+    raise SystemExit(1)
+
+if __name__ == '__main__':
+  main()
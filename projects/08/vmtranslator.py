@@ -7,8 +7,8 @@ GENERIC_TRANSLATION = {
   'argument': 'ARG',
   'this': 'THIS',
   'that': 'THAT',
-  'pointer': '3',
-  'temp': '5',
+  'pointer': 3,
+  'temp': 5,
 }
 
 BINARY_OPS = {
@@ -46,114 +46,174 @@ def is_comment(line):
 def format_comment(line):
   return '// ' + line
 
-def binary_op(c):
-  return ['@SP', 'M=M-1', '@SP', 'A=M', 'D=M', '@SP', 'M=M-1', '@SP', 'A=M', 'A=M', 'D=' + c, '@SP',
-            'A=M', 'M=D', '@SP', 'M=M+1']
-
-def unary_op(c):
-  return ['@SP', 'M=M-1', '@SP', 'A=M', 'D=M', 'D=' + c, '@SP', 'A=M', 'M=D', '@SP', 'M=M+1']
-
-def logical_op(c, label_id):
-  ll = '(JL' + label_id + ')'
-  return ['@SP', 'M=M-1', '@SP', 'A=M', 'D=M', '@SP', 'M=M-1', '@SP', 'A=M', 'A=M', 'D=A-D', '@SP',
-                          'A=M', 'M=-1', '@JL' + label_id, 'D;' + c, '@SP', 'A=M', 'M=0', ll, '@SP', 'M=M+1']
+# VM command records are the words of a command with the index or count of push, pop, function and
+# call as an int, e.g. ('push', 'local', 2) or ('add',)
+def parse_command(line):
+  line = line.split('//')[0].strip()
+  if is_blank(line):
+    return None
+  words = line.split()
+  if words[0] in ['push', 'pop', 'function', 'call']:
+    return (words[0], words[1], int(words[2]))
+  return tuple(words)
+
+def parse_commands(lines):
+  return [command for command in map(parse_command, lines) if command is not None]
+
+def format_command(command):
+  return ' '.join(map(str, command))
+
+# Assembly records as the assembler takes them: ('@', constant or symbol), ('(', label),
+# ('C', dest, comp, jump) and ('//', comment)
+def at(value):
+  return ('@', value)
+
+def label(name):
+  return ('(', name)
+
+def c(dest, comp, jump=''):
+  return ('C', dest, comp, jump)
+
+def format_instruction(record):
+  kind = record[0]
+  if kind == '@':
+    return '@' + str(record[1])
+  if kind == '(':
+    return '(' + record[1] + ')'
+  if kind == '//':
+    return format_comment(record[1])
+  _, dest, comp, jump = record
+  return (dest + '=' if dest != '' else '') + comp + (';' + jump if jump != '' else '')
+
+PUSH_D = [at('SP'), c('A', 'M'), c('M', 'D'), at('SP'), c('M', 'M+1')]
+
+def binary_op(comp):
+  return [at('SP'), c('M', 'M-1'), at('SP'), c('A', 'M'), c('D', 'M'), at('SP'), c('M', 'M-1'), at('SP'),
+          c('A', 'M'), c('A', 'M'), c('D', comp)] + PUSH_D
+
+def unary_op(comp):
+  return [at('SP'), c('M', 'M-1'), at('SP'), c('A', 'M'), c('D', 'M'), c('D', comp)] + PUSH_D
+
+def logical_op(jump, label_id):
+  return [at('SP'), c('M', 'M-1'), at('SP'), c('A', 'M'), c('D', 'M'), at('SP'), c('M', 'M-1'), at('SP'),
+          c('A', 'M'), c('A', 'M'), c('D', 'A-D'), at('SP'), c('A', 'M'), c('M', '-1'), at('JL' + label_id),
+          c('', 'D', jump), at('SP'), c('A', 'M'), c('M', '0'), label('JL' + label_id), at('SP'), c('M', 'M+1')]
 
 def call(fn, nArgs, label_id):
-  ll = '(L' + label_id + ')'
   i_buffer = []
 
-  i_buffer += ['@L' + label_id, 'D=A', '@SP', 'A=M', 'M=D', '@SP', 'M=M+1'] # push return address
-  i_buffer += ['@LCL', 'D=M', '@SP', 'A=M', 'M=D', '@SP', 'M=M+1'] # push LCL
-  i_buffer += ['@ARG', 'D=M', '@SP', 'A=M', 'M=D', '@SP', 'M=M+1'] # push ARG
-  i_buffer += ['@THIS', 'D=M', '@SP', 'A=M', 'M=D', '@SP', 'M=M+1'] # push THIS
-  i_buffer += ['@THAT', 'D=M', '@SP', 'A=M', 'M=D', '@SP', 'M=M+1'] # push THAT
-  i_buffer += ['@SP', 'D=M', '@LCL', 'M=D', '@5', 'D=D-A', '@' + nArgs, 'D=D-A', '@ARG', 'M=D'] # reposition LCL
-  i_buffer += ['@' + fn, '0;JMP'] # goto function
-  i_buffer += [ll] # add return label
+  i_buffer += [at('L' + label_id), c('D', 'A')] + PUSH_D # push return address
+  for pointer in ['LCL', 'ARG', 'THIS', 'THAT']: # push LCL, ARG, THIS and THAT
+    i_buffer += [at(pointer), c('D', 'M')] + PUSH_D
+  i_buffer += [at('SP'), c('D', 'M'), at('LCL'), c('M', 'D'), at(5), c('D', 'D-A'), at(nArgs), c('D', 'D-A'),
+               at('ARG'), c('M', 'D')] # reposition LCL
+  i_buffer += [at(fn), c('', '0', 'JMP')] # goto function
+  i_buffer += [label('L' + label_id)] # add return label
 
   return i_buffer
 
-def translate(file_path, generate_comments, label_value):
-  buffer = []
-  static_label = str(file_path).split('/')[-1]
-  buffer.append('// File: ' + str(file_path).split('/')[-1]) if generate_comments else None
+def bootstrap_records(generate_comments, label_value):
+  buffer = [('//', 'Bootstrap')] if generate_comments else []
+  buffer += [at(256), c('D', 'A'), at('SP'), c('M', 'D')]
+  buffer.append(('//', 'Call Sys.init')) if generate_comments else None
+  buffer += call('Sys.init', 0, label_value.get_label())
+  return buffer
+
+def bootstrap(generate_comments, label_value):
+  return list(map(format_instruction, bootstrap_records(generate_comments, label_value)))
 
+def translate(file_path, generate_comments, label_value):
   with open(file_path, 'r') as f:
-    for line in f:
-      line = line.strip('\n').strip()
-      instruction_buffer = []
-
-      if is_blank(line) or is_comment(line):
-        continue
-      line = line.split('//')[0].strip() # Remove any trailing comments
-
-      if 'push' in line:
-        push, segment, value = line.split()
-        a = '@' + value
-        if segment == 'constant':
-          instruction_buffer = [a, 'D=A', '@SP', 'A=M', 'M=D', '@SP', 'M=M+1']
-        elif segment in ['local', 'argument', 'this', 'that']:
-            v = '@' + GENERIC_TRANSLATION[segment]
-            instruction_buffer = [a, 'D=A', v, 'A=M', 'A=D+A', 'D=M', '@SP', 'A=M', 'M=D', '@SP', 'M=M+1']
-        elif segment == 'static':
-          v = '@' + static_label + '.' + value
-          instruction_buffer = [v, 'D=M', '@SP', 'A=M', 'M=D', '@SP', 'M=M+1']
-        elif segment == 'temp' or segment == 'pointer':
-          v = '@' + GENERIC_TRANSLATION[segment]
-          instruction_buffer = [a, 'D=A', v, 'A=D+A', 'D=M', '@SP', 'A=M', 'M=D', '@SP', 'M=M+1']
-      elif 'pop' in line:
-        pop, segment, value = line.split()
-        a = '@' + value
-        v = '@' + static_label + '.' + value if segment == 'static' else '@' + GENERIC_TRANSLATION[segment]
-        if segment in ['local', 'argument', 'this', 'that']:
-          instruction_buffer = ['@SP', 'M=M-1', a, 'D=A', v, 'A=M', 'D=D+A', '@R13', 'M=D', '@SP', 'A=M', 'D=M',
-                                  '@R13', 'A=M', 'M=D']
-        elif segment == 'static':
-          instruction_buffer = [v, 'D=A', '@R13', 'M=D', '@SP', 'AM=M-1', 'D=M', '@R13', 'A=M', 'M=D']
-        else:
-          instruction_buffer = ['@SP', 'M=M-1', a, 'D=A', v, 'D=D+A', '@R13', 'M=D', '@SP', 'A=M', 'D=M',
-                                  '@R13', 'A=M', 'M=D']
-      elif line.split()[0] in ['label', 'goto', 'if-goto']:
-        v,d = line.split()
-        if v == 'label':
-          instruction_buffer = ['(' + d + ')']
-        elif v == 'goto':
-          instruction_buffer = ['@' + d, '0;JMP']
-        elif v == 'if-goto':
-          instruction_buffer = ['@SP', 'M=M-1', 'A=M', 'D=M', '@' + d, 'D;JNE']
-      elif line.split()[0] in ['function', 'call']:
-        c,fn,nArgs = line.split()
-        if c == 'call':
-          instruction_buffer = call(fn, nArgs, label_value.get_label())
-        if c == 'function':
-          a = '@0'
-          const_instruction = [a, 'D=A', '@SP', 'A=M', 'M=D', '@SP', 'M=M+1']
-          instruction_buffer = ['(' + fn + ')']
-          for ci in range(int(nArgs)):
-            instruction_buffer.append(format_comment('push const 0')) if generate_comments else None
-            instruction_buffer += const_instruction
-      elif line.split()[0] == 'return':
-        instruction_buffer = ['@LCL', 'D=M', '@R13', 'M=D', '@5', 'A=D-A', 'D=M', '@R14', 'M=D',
-                              '@SP', 'AM=M-1', 'D=M', '@ARG', 'A=M', 'M=D',
-                              '@ARG', 'D=M+1', '@SP', 'M=D',
-                              '@R13', 'AM=M-1', 'D=M', '@THAT', 'M=D',
-                              '@R13', 'AM=M-1', 'D=M', '@THIS', 'M=D',
-                              '@R13', 'AM=M-1', 'D=M', '@ARG', 'M=D',
-                              '@R13', 'AM=M-1', 'D=M', '@LCL', 'M=D',
-                              '@R14', 'A=M', '0;JMP']
+    return translate_lines(f, str(file_path).split('/')[-1], generate_comments, label_value)
+
+def scoped_label(function_name, label):
+  return function_name + '$' + label if function_name != '' else label
+
+RETURN = [at('LCL'), c('D', 'M'), at('R13'), c('M', 'D'), at(5), c('A', 'D-A'), c('D', 'M'), at('R14'), c('M', 'D'),
+          at('SP'), c('AM', 'M-1'), c('D', 'M'), at('ARG'), c('A', 'M'), c('M', 'D'),
+          at('ARG'), c('D', 'M+1'), at('SP'), c('M', 'D'),
+          at('R13'), c('AM', 'M-1'), c('D', 'M'), at('THAT'), c('M', 'D'),
+          at('R13'), c('AM', 'M-1'), c('D', 'M'), at('THIS'), c('M', 'D'),
+          at('R13'), c('AM', 'M-1'), c('D', 'M'), at('ARG'), c('M', 'D'),
+          at('R13'), c('AM', 'M-1'), c('D', 'M'), at('LCL'), c('M', 'D'),
+          at('R14'), c('A', 'M'), c('', '0', 'JMP')]
+
+# Translates VM command records into assembly records, static_label names the unit's statics (the .vm
+# file name). Labels are scoped to their function so they never clash with other functions or the L<n>
+# return labels. Commands that need no label are translated once per unit and their records reused.
+def translate_commands(commands, static_label, generate_comments, label_value):
+  buffer = []
+  cache = {}
+  function_name = ''
+  buffer.append(('//', 'File: ' + static_label)) if generate_comments else None
+
+  for command in commands:
+    instruction_buffer = []
+    kind = command[0]
+
+    if command in cache:
+      instruction_buffer = cache[command]
+    elif kind == 'push':
+      _, segment, value = command
+      if segment == 'constant':
+        instruction_buffer = [at(value), c('D', 'A')] + PUSH_D
+      elif segment in ['local', 'argument', 'this', 'that']:
+        instruction_buffer = [at(value), c('D', 'A'), at(GENERIC_TRANSLATION[segment]), c('A', 'M'), c('A', 'D+A'),
+                              c('D', 'M')] + PUSH_D
+      elif segment == 'static':
+        instruction_buffer = [at(static_label + '.' + str(value)), c('D', 'M')] + PUSH_D
+      elif segment == 'temp' or segment == 'pointer':
+        instruction_buffer = [at(value), c('D', 'A'), at(GENERIC_TRANSLATION[segment]), c('A', 'D+A'),
+                              c('D', 'M')] + PUSH_D
+    elif kind == 'pop':
+      _, segment, value = command
+      v = at(static_label + '.' + str(value)) if segment == 'static' else at(GENERIC_TRANSLATION[segment])
+      if segment in ['local', 'argument', 'this', 'that']:
+        instruction_buffer = [at('SP'), c('M', 'M-1'), at(value), c('D', 'A'), v, c('A', 'M'), c('D', 'D+A'),
+                              at('R13'), c('M', 'D'), at('SP'), c('A', 'M'), c('D', 'M'), at('R13'), c('A', 'M'),
+                              c('M', 'D')]
+      elif segment == 'static':
+        instruction_buffer = [v, c('D', 'A'), at('R13'), c('M', 'D'), at('SP'), c('AM', 'M-1'), c('D', 'M'),
+                              at('R13'), c('A', 'M'), c('M', 'D')]
       else:
-        c = line
-        if c in BINARY_OPS:
-          instruction_buffer = binary_op(BINARY_OPS[c])
-        elif c in UNARY_OPS:
-          instruction_buffer = unary_op(UNARY_OPS[c])
-        elif c in LOGICAL_OPS:
-          instruction_buffer = logical_op(LOGICAL_OPS[c], label_value.get_label())
-
-      buffer.append(format_comment(line)) if generate_comments else None
-      buffer += instruction_buffer
-
-    return buffer
+        instruction_buffer = [at('SP'), c('M', 'M-1'), at(value), c('D', 'A'), v, c('D', 'D+A'), at('R13'),
+                              c('M', 'D'), at('SP'), c('A', 'M'), c('D', 'M'), at('R13'), c('A', 'M'), c('M', 'D')]
+    elif kind in ['label', 'goto', 'if-goto']:
+      d = scoped_label(function_name, command[1])
+      if kind == 'label':
+        instruction_buffer = [label(d)]
+      elif kind == 'goto':
+        instruction_buffer = [at(d), c('', '0', 'JMP')]
+      elif kind == 'if-goto':
+        instruction_buffer = [at('SP'), c('M', 'M-1'), c('A', 'M'), c('D', 'M'), at(d), c('', 'D', 'JNE')]
+    elif kind == 'call':
+      instruction_buffer = call(command[1], command[2], label_value.get_label())
+    elif kind == 'function':
+      function_name = command[1]
+      instruction_buffer = [label(function_name)]
+      for ci in range(command[2]):
+        instruction_buffer.append(('//', 'push const 0')) if generate_comments else None
+        instruction_buffer += [at(0), c('D', 'A')] + PUSH_D
+    elif kind == 'return':
+      instruction_buffer = RETURN
+    elif kind in BINARY_OPS:
+      instruction_buffer = binary_op(BINARY_OPS[kind])
+    elif kind in UNARY_OPS:
+      instruction_buffer = unary_op(UNARY_OPS[kind])
+    elif kind in LOGICAL_OPS:
+      instruction_buffer = logical_op(LOGICAL_OPS[kind], label_value.get_label())
+    if kind in ['push', 'pop', 'return'] or kind in BINARY_OPS or kind in UNARY_OPS:
+      cache[command] = instruction_buffer
+
+    buffer.append(('//', format_command(command))) if generate_comments else None
+    buffer += instruction_buffer
+
+  return buffer
+
+# Translates an iterable of VM lines into assembly lines
+def translate_lines(lines, static_label, generate_comments, label_value):
+  records = translate_commands(parse_commands(lines), static_label, generate_comments, label_value)
+  return list(map(format_instruction, records))
 
 def main():
   parser = argparse.ArgumentParser(description='Translates VM code into Hack assembly')
@@ -173,10 +233,7 @@ def main():
   buffer = []
 
   if args.bootstrap:
-    buffer = ['// Bootstrap', '@256', 'D=A', '@SP', 'M=D']
-    buffer = buffer if generate_comments else buffer[1:]
-    buffer.append(format_comment('Call Sys.init')) if generate_comments else None
-    buffer += call('Sys.init', '0', label_value.get_label())
+    buffer = bootstrap(generate_comments, label_value)
 
   for fp in candidates:
     buffer += translate(fp, generate_comments, label_value)
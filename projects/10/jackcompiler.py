@@ -1,328 +1,206 @@
 #!/usr/bin/env python3
 import argparse
+import importlib.util
 from pathlib import Path
-from enum import Enum
-import string
-
-KEYWORDS = {'class', 'constructor', 'function', 'method', 'field', 'static', 'var', 'int', 'char', 
-            'boolean', 'void', 'true', 'false', 'null', 'this', 'let', 'do', 'if', 'else', 'while', 
-            'return'}
-
-SYMBOLS = {'{', '}', '|', '(', ')', '[', ']', '.', ',', ';', '+', '-', '*', '/', '&', '|', 
-           '<', '>', '=', '~'}
-
-INT_RANGE = range(0,32767)
-
-OP_CONV = { '<': '&lt;', '>': '&gt;', '&': '&amp;'}
-
-class LexicalLabels(Enum):
-  KEYWORD = 'keyword'
-  SYMBOL = 'symbol'
-  INT_CONST = 'integerConstant'
-  STR_CONST = 'stringConstant'
-  IDENTIFIER = 'identifier'
-
-  def __str__(self):
-    return self.value
-
-class Tokenizer:
+from array import array
+import hashlib
+import struct
+import sys
+
+WRITE_BUFFER_SIZE = 1 << 16
+
+NODE_KINDS = ['class', 'classVarDec', 'subroutineDec', 'parameterList', 'subroutineBody', 'varDec', 'statements',
+              'letStatement', 'ifStatement', 'whileStatement', 'doStatement', 'returnStatement', 'expression', 'term',
+              'expressionList', 'keyword', 'symbol', 'integerConstant', 'stringConstant', 'identifier']
+KIND_CODES = {kind: code for code, kind in enumerate(NODE_KINDS)}
+
+TREE_MAGIC = b'JTREE\x01'
+TREE_HEADER = struct.Struct('<6s32sIII')
+TREE_SUFFIX = '.jtree'
+
+# Registered before it runs, since dataclasses look their module up in sys.modules
+def load_project_module(name: str, relative_path: str):
+  if name in sys.modules:
+    return sys.modules[name]
+  spec = importlib.util.spec_from_file_location(name, Path(__file__).resolve().parent / relative_path)
+  module = importlib.util.module_from_spec(spec)
+  sys.modules[name] = module
+  spec.loader.exec_module(module)
+  return module
+
+# The tokenizer and parser are shared with the compiler, the analyzer only supplies the back ends
+jackfrontend = load_project_module('jackfrontend', '../11/jackfrontend.py')
+Parser = jackfrontend.Parser
+XMLWriter = jackfrontend.XMLWriter
+
+# Tokens are pulled one at a time from the front end's token generator so only the current token is held
+class Tokenizer(jackfrontend.Tokenizer):
   def __init__(self, file_path):
-    self.tokens = tokenize(file_path)
-    self.index = 0
+    self.file_path = file_path
+    self.tokens = jackfrontend.iter_tokens(file_path)
+    self.token = next(self.tokens, None)
 
   def advance(self):
-    self.index += 1 
-
-  @property
-  def token_type(self):
-    token = self.current_token
-    if token in KEYWORDS: return LexicalLabels.KEYWORD
-    elif token in SYMBOLS: return LexicalLabels.SYMBOL
-    elif token[0] in string.digits and int(token) in INT_RANGE: return LexicalLabels.INT_CONST
-    elif token[0] == '"' and token[-1] == '"': return LexicalLabels.STR_CONST
-    else: return LexicalLabels.IDENTIFIER
+    self.token = next(self.tokens, None)
 
   @property
   def current_token(self):
-    return self.tokens[self.index]
-
-class CompilationEngine:
-  def __init__(self, jack_tokenizer: Tokenizer):
-    self.tokenizer = jack_tokenizer
-    self.buffer = []
-
-  def add_start_tag(self, tag_name: str):
-    self.buffer.append(f'<{tag_name}>')
-
-  def add_end_tag(self, tag_name: str):
-    self.buffer.append(f'</{tag_name}>')
-
-  @property
-  def current_token(self):
-    return self.tokenizer.current_token
-
-  @property
-  def token_type(self):
-    return self.tokenizer.token_type
-
-  def process_token(self, expected_token):
-    if self.current_token != expected_token:
-      raise Exception(f'Token {expected_token} did not match current token {self.current_token}')
-    self.buffer.append(f'<{self.token_type}> {self.current_token} </{self.token_type}>')
-    self.tokenizer.advance()
-
-  def process_type(self, expected_type: LexicalLabels):
-    if self.token_type != expected_type:
-      raise Exception(f'Token type {self.token_type} does not match {expected_type}')
-    self.buffer.append(f'<{expected_type}> {self.current_token} </{expected_type}>')
-    self.tokenizer.advance()
-
-  def process_list(self, expected_tokens: list[str], fallback: LexicalLabels = None):
-    if self.current_token not in expected_tokens and self.token_type != fallback:
-      raise Exception(f'Token {self.current_token} of type {self.token_type} not in {expected_tokens} or {fallback}')
-    self.buffer.append(f'<{self.token_type}> {self.current_token} </{self.token_type}>')
-    self.tokenizer.advance()
-
-  def compile_class(self):
-    self.add_start_tag('class')
-    self.process_token('class')
-    self.process_type(LexicalLabels.IDENTIFIER)
-    self.process_token('{')
-    while self.current_token in ['static', 'field']:
-      self.compile_class_var_dec()
-    while self.current_token in ['constructor', 'function', 'method']:
-      self.compile_subroutine_dec()
-    self.process_token('}')
-    self.add_end_tag('class')
-
-  def compile_class_var_dec(self):
-    self.add_start_tag('classVarDec')
-    self.process_token('static') if self.current_token == 'static' else self.process_token('field')
-    self.process_list(['int', 'char', 'boolean'], LexicalLabels.IDENTIFIER)
-    self.process_type(LexicalLabels.IDENTIFIER)
-    while self.current_token != ';':
-      self.process_token(',')
-      self.process_type(LexicalLabels.IDENTIFIER)
-    self.process_token(';')
-    self.add_end_tag('classVarDec')
-
-  def compile_subroutine_dec(self):
-    self.add_start_tag('subroutineDec')
-    self.process_list(['constructor', 'function', 'method'])
-    self.process_list(['int', 'char', 'boolean', 'void'], LexicalLabels.IDENTIFIER)
-    self.process_type(LexicalLabels.IDENTIFIER)
-    self.process_token('(')
-    self.compile_parameter_list()
-    self.process_token(')')
-    self.compile_subroutine_body()
-    self.add_end_tag('subroutineDec')
-
-  def compile_parameter_list(self):
-    self.add_start_tag('parameterList')
-    if self.current_token != ')':
-      self.process_list(['int', 'char', 'boolean'], LexicalLabels.IDENTIFIER)
-      self.process_type(LexicalLabels.IDENTIFIER)
-      while self.current_token == ',':
-        self.process_token(',')
-        self.process_list(['int', 'char', 'boolean'], LexicalLabels.IDENTIFIER)
-        self.process_type(LexicalLabels.IDENTIFIER)
-    self.add_end_tag('parameterList')
-
-  def compile_subroutine_body(self):
-    self.add_start_tag('subroutineBody')
-    self.process_token('{')
-    while self.current_token == 'var':
-      self.compile_var_dec()
-    self.compile_statements()
-    self.process_token('}')
-    self.add_end_tag('subroutineBody')
-
-  def compile_var_dec(self):
-    self.add_start_tag('varDec')
-    self.process_token('var')
-    self.process_list(['int', 'char', 'boolean'], LexicalLabels.IDENTIFIER)
-    self.process_type(LexicalLabels.IDENTIFIER)
-    while self.current_token != ';' and self.current_token == ',':
-      self.process_token(',')
-      self.process_type(LexicalLabels.IDENTIFIER)
-    self.process_token(';')
-    self.add_end_tag('varDec')
-
-  def compile_statements(self):
-    self.add_start_tag('statements')
-    while self.current_token in ['let', 'while', 'if', 'do', 'return']:
-      if self.current_token == 'let':
-        self.compile_let()
-      elif self.current_token == 'while':
-        self.compile_while()
-      elif self.current_token == 'if':
-        self.compile_if()
-      elif self.current_token == 'do':
-        self.compile_do()
-      elif self.current_token == 'return':
-        self.compile_return()
-    self.add_end_tag('statements')
-
-  def compile_let(self):
-    self.add_start_tag('letStatement')
-    self.process_token('let')
-    self.process_type(LexicalLabels.IDENTIFIER)
-    if self.current_token == '[':
-      self.process_token('[')
-      self.compile_expression()
-      self.process_token(']')
-    self.process_token('=')
-    self.compile_expression()
-    self.process_token(';')
-    self.add_end_tag('letStatement')
-
-  def compile_if(self):
-    self.add_start_tag('ifStatement')
-    self.process_token('if')
-    self.process_token('(') 
-    self.compile_expression()
-    self.process_token(')')
-    self.process_token('{')
-    self.compile_statements()
-    self.process_token('}')
-    if self.current_token == 'else':
-      self.process_token('else')
-      self.process_token('{')
-      self.compile_statements()
-      self.process_token('}')
-    self.add_end_tag('ifStatement')
-
-  def compile_while(self):
-    self.add_start_tag('whileStatement')
-    self.process_token('while')
-    self.process_token('(')
-    self.compile_expression()
-    self.process_token(')')
-    self.process_token('{')
-    self.compile_statements()
-    self.process_token('}')
-    self.add_end_tag('whileStatement')
-
-  def compile_do(self):
-    self.add_start_tag('doStatement')
-    self.process_token('do')
-    self.subroutine_call()
-    self.process_token(';')
-    self.add_end_tag('doStatement')
-
-  def subroutine_call(self):
-    self.process_type(LexicalLabels.IDENTIFIER)
-    if self.current_token == '.':
-      self.process_token('.')
-      self.process_type(LexicalLabels.IDENTIFIER)
-
-    self.process_token('(') 
-    self.compile_expression_list()
-    self.process_token(')')
-
-  def compile_return(self):
-    self.add_start_tag('returnStatement')
-    self.process_token('return')
-    if self.current_token != ';':
-      self.compile_expression()
-    self.process_token(';')
-    self.add_end_tag('returnStatement')
-
-  def compile_expression(self):
-    self.add_start_tag('expression')
-    self.compile_term()
-    while self.current_token in ['+', '-', '*', '/', '&', '|', '<', '>', '=']:
-      op = self.current_token if self.current_token not in OP_CONV else OP_CONV[self.current_token]
-      self.buffer.append(f'<symbol> {op} </symbol>')
-      self.tokenizer.advance()
-      self.compile_term()
-    self.add_end_tag('expression')
-
-  def compile_term(self):
-    self.add_start_tag('term')
-    if self.token_type in [LexicalLabels.IDENTIFIER, LexicalLabels.INT_CONST, LexicalLabels.STR_CONST, LexicalLabels.KEYWORD]:
-      token = self.current_token[1:-1] if self.token_type == LexicalLabels.STR_CONST else self.current_token
-      self.buffer.append(f'<{self.token_type}> {token} </{self.token_type}>')
-      self.tokenizer.advance()
-      if self.current_token == '[':
-        self.process_token('[')
-        self.compile_expression()
-        self.process_token(']')
-      elif self.current_token == '.':
-        self.process_token('.')
-        self.process_type(LexicalLabels.IDENTIFIER)
-        self.process_token('(') 
-        self.compile_expression_list()
-        self.process_token(')')
-      elif self.current_token == '(':
-        self.process_token('(')
-        self.compile_expression()
-        self.process_token(')')
-
-    elif self.current_token == '(':
-      self.process_token('(')
-      self.compile_expression()
-      self.process_token(')')
-    elif self.current_token in ['-', '~']:
-      self.buffer.append(f'<symbol> {self.current_token} </symbol>')
-      self.tokenizer.advance()
-      self.compile_term()
-    else:
-      raise Exception(f'Token {self.current_token} of type {self.token_type} was not expected token')
-    self.add_end_tag('term')
-
-  def compile_expression_list(self):
-    self.add_start_tag('expressionList')
-    if self.current_token != ')':
-      self.compile_expression()
-      while self.current_token == ',':
-        self.process_token(',')
-        self.compile_expression()
-    self.add_end_tag('expressionList')
-
-def is_blank(line):
-  return line == ''
-
-def is_comment(line):
-  return len(line) > 2 and line[0] == '/' and line[1] == '/'
-
-def is_block_comment(line):
-  return ('/**' in line) or (len(line) >= 1 and line[0] == '*') or (len(line) >= 2 and line[0:1] == '*/')
-
-def tokenize_line(line):
-  tokens = []; s = ''; otl = 0; cs = ''
-
-  for c in line:
-    if otl != len(tokens):
-      s = ''; cs = ''; otl = len(tokens)
-    s += c; cs += c; s = s.strip()
-    if len(s) > 0 and (s[0] in string.ascii_letters or s[0] == '_') and c == ' ':
-      tokens.append(s)
-    elif len(s) > 1 and s[0] == '"' and s[-1] == '"':
-      tokens.append(cs.strip())
-    elif s in KEYWORDS or s in SYMBOLS:
-      tokens.append(s)
-    elif c in SYMBOLS and s != c:
-      tokens.append(s[:-1])
-      tokens.append(c)
-
-  return tokens
-
-def tokenize(file_path):
-  token_buffer = []
-
-  with open(file_path, 'r') as f:
-    for line in f:
-      line = line.strip('\n').strip()
-      if is_blank(line) or is_comment(line) or is_block_comment(line):
-        continue
-      token_buffer += tokenize_line(line.split('//')[0].strip())
-
-  return token_buffer
+    if self.token is None:
+      raise Exception('Unexpected end of input')
+    return self.token
+
+class TeeWriter:
+  def __init__(self, *writers):
+    self.writers = writers
+
+  def start_tag(self, tag_name: str):
+    for writer in self.writers: writer.start_tag(tag_name)
+
+  def end_tag(self, tag_name: str):
+    for writer in self.writers: writer.end_tag(tag_name)
+
+  def terminal(self, label, token: str):
+    for writer in self.writers: writer.terminal(label, token)
+
+# The parse tree is stored in preorder as parallel arrays: the node kind, an index into the
+# interned string table (-1 for non-terminals) and the index one past the node's last descendant
+class ParseTree:
+  def __init__(self, kinds: array, values: array, ends: array, strings: list[str]):
+    self.kinds = kinds
+    self.values = values
+    self.ends = ends
+    self.strings = strings
+
+  def __len__(self):
+    return len(self.kinds)
+
+  def kind(self, node: int) -> str:
+    return NODE_KINDS[self.kinds[node]]
+
+  def text(self, node: int) -> None | str:
+    value = self.values[node]
+    return self.strings[value] if value >= 0 else None
+
+  def children(self, node: int = 0):
+    child = node + 1
+    while child < self.ends[node]:
+      yield child
+      child = self.ends[child]
+
+  def tokens(self):
+    for node, value in enumerate(self.values):
+      if value >= 0:
+        yield NODE_KINDS[self.kinds[node]], self.strings[value]
+
+  def replay(self, writer):
+    open_nodes = []
+    for node in range(len(self.kinds)):
+      while open_nodes and self.ends[open_nodes[-1]] <= node:
+        writer.end_tag(NODE_KINDS[self.kinds[open_nodes.pop()]])
+      if self.values[node] >= 0:
+        writer.terminal(NODE_KINDS[self.kinds[node]], self.strings[self.values[node]])
+      else:
+        writer.start_tag(NODE_KINDS[self.kinds[node]])
+        open_nodes.append(node)
+    while open_nodes:
+      writer.end_tag(NODE_KINDS[self.kinds[open_nodes.pop()]])
+
+  def save(self, file_path, digest: bytes):
+    strings = '\0'.join(self.strings).encode()
+    values = array('i', self.values); ends = array('i', self.ends)
+    if sys.byteorder == 'big':
+      values.byteswap(); ends.byteswap()
+    with open(file_path, 'wb') as f:
+      f.write(TREE_HEADER.pack(TREE_MAGIC, digest, len(self.kinds), len(self.strings), len(strings)))
+      f.write(self.kinds.tobytes()); f.write(values.tobytes()); f.write(ends.tobytes()); f.write(strings)
+
+  # Returns None for a missing, stale, truncated or corrupt cache file so the caller parses afresh. The
+  # digest only covers the source, so the payload is checked against the header counts and every kind,
+  # string index and end is checked to be in range before the tree is replayed.
+  @classmethod
+  def load(cls, file_path, digest: bytes) -> 'None | ParseTree':
+    try:
+      with open(file_path, 'rb') as f:
+        data = f.read()
+    except OSError:
+      return None
+    try:
+      magic, stored_digest, n_nodes, n_strings, n_string_bytes = TREE_HEADER.unpack_from(data)
+      if magic != TREE_MAGIC or stored_digest != digest:
+        return None
+      if len(data) != TREE_HEADER.size + 9 * n_nodes + n_string_bytes or n_nodes == 0:
+        return None
+      offset = TREE_HEADER.size
+      kinds = array('B', data[offset:offset + n_nodes]); offset += n_nodes
+      values = array('i', data[offset:offset + 4 * n_nodes]); offset += 4 * n_nodes
+      ends = array('i', data[offset:offset + 4 * n_nodes]); offset += 4 * n_nodes
+      if sys.byteorder == 'big':
+        values.byteswap(); ends.byteswap()
+      strings = data[offset:].decode().split('\0') if n_strings > 0 else []
+    except (struct.error, ValueError):
+      return None
+    if len(strings) != n_strings or max(kinds) >= len(NODE_KINDS):
+      return None
+    if min(values) < -1 or max(values) >= n_strings or ends[0] != n_nodes:
+      return None
+    if any(end <= node or end > n_nodes for node, end in enumerate(ends)):
+      return None
+    return cls(kinds, values, ends, strings)
+
+class TreeBuilder:
+  def __init__(self):
+    self.kinds = array('B')
+    self.values = array('i')
+    self.ends = array('i')
+    self.strings: list[str] = []
+    self.string_index: dict[str, int] = {}
+    self.open_nodes: list[int] = []
+
+  def start_tag(self, tag_name: str):
+    self.open_nodes.append(len(self.kinds))
+    self.kinds.append(KIND_CODES[tag_name]); self.values.append(-1); self.ends.append(0)
+
+  def end_tag(self, tag_name: str):
+    self.ends[self.open_nodes.pop()] = len(self.kinds)
+
+  def terminal(self, label, token: str):
+    if token not in self.string_index:
+      self.string_index[token] = len(self.strings)
+      self.strings.append(token)
+    self.kinds.append(KIND_CODES[str(label)]); self.values.append(self.string_index[token])
+    self.ends.append(len(self.kinds))
+
+  def tree(self) -> ParseTree:
+    return ParseTree(self.kinds, self.values, self.ends, self.strings)
+
+def source_digest(file_path) -> bytes:
+  with open(file_path, 'rb') as f:
+    return hashlib.sha256(f.read()).digest()
+
+def tree_cache_path(file_path) -> Path:
+  return Path(file_path).with_suffix(TREE_SUFFIX)
+
+def load_parse_tree(file_path) -> None | ParseTree:
+  return ParseTree.load(tree_cache_path(file_path), source_digest(file_path))
+
+def parse_tree(file_path, use_cache: bool = True, writer = None) -> ParseTree:
+  digest = source_digest(file_path)
+  tree = ParseTree.load(tree_cache_path(file_path), digest) if use_cache else None
+  if tree is not None:
+    if writer is not None: tree.replay(writer)
+    return tree
+  builder = TreeBuilder()
+  Parser(Tokenizer(file_path), builder if writer is None else TeeWriter(writer, builder)).parse_class()
+  tree = builder.tree()
+  if use_cache:
+    tree.save(tree_cache_path(file_path), digest)
+  return tree
 
 def main():
   parser = argparse.ArgumentParser(description='Translates Jack language into XML code')
   parser.add_argument('--f', help='Input Jack program or folder containing jack programs')
+  parser.add_argument('-c', '--cache', help=f'Reuse or write a binary parse tree ({TREE_SUFFIX}) next to each source',
+                      action='store_true')
 
   args = parser.parse_args()
   file_path = Path(args.f)
@@ -330,11 +208,11 @@ def main():
   candidates = [file_path] if not file_path.is_dir() else [file for file in file_path.glob('*.jack')]
 
   for fp in candidates:
-    compilation_engine = CompilationEngine(Tokenizer(fp))
-    compilation_engine.compile_class()
-
-    with open(str(fp).split('/')[-1][:-4] + 'xml', 'w') as f:
-      f.writelines(line + '\n' for line in compilation_engine.buffer)
+    with open(str(fp).split('/')[-1][:-4] + 'xml', 'w', buffering=WRITE_BUFFER_SIZE) as f:
+      if args.cache:
+        parse_tree(fp, True, XMLWriter(f))
+        continue
+      Parser(Tokenizer(fp), XMLWriter(f)).parse_class()
 
 if __name__ == '__main__':
   main()
\ No newline at end of file
@@ -0,0 +1,61 @@
+import importlib.util
+import io
+from pathlib import Path
+
+import pytest
+
+# projects/11 also has a jackcompiler module, so this one is loaded under its own name
+spec = importlib.util.spec_from_file_location('jackparser', Path(__file__).resolve().parent / 'jackcompiler.py')
+jackparser = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(jackparser)
+
+SOURCE = '''
+class Main {
+  function int main() {
+    var int x;
+    let x = 1 + 2;
+    return x;
+  }
+}
+'''
+
+@pytest.fixture
+def source(tmp_path) -> Path:
+  file_path = tmp_path / 'Main.jack'
+  file_path.write_text(SOURCE)
+  return file_path
+
+def test_cached_tree_matches_fresh_parse(source):
+  fresh = jackparser.parse_tree(source)
+  cached = jackparser.load_parse_tree(source)
+  assert cached is not None
+  assert list(cached.tokens()) == list(fresh.tokens())
+
+@pytest.mark.parametrize('keep', [0, 20, 50, -1, -7])
+def test_truncated_cache_is_parsed_afresh(source, keep):
+  fresh = jackparser.parse_tree(source)
+  cache = jackparser.tree_cache_path(source)
+  data = cache.read_bytes()
+  cache.write_bytes(data[:keep] if keep >= 0 else data[:len(data) + keep])
+  assert jackparser.load_parse_tree(source) is None
+  assert list(jackparser.parse_tree(source).tokens()) == list(fresh.tokens())
+  assert cache.read_bytes() == data
+
+def test_corrupt_ends_are_rejected(source):
+  tree = jackparser.parse_tree(source)
+  cache = jackparser.tree_cache_path(source)
+  data = bytearray(cache.read_bytes())
+  end = jackparser.TREE_HEADER.size + 5 * len(tree) + 4
+  data[end:end + 4] = (0).to_bytes(4, 'little')
+  cache.write_bytes(bytes(data))
+  assert jackparser.load_parse_tree(source) is None
+
+# The analyzer uses the compiler's front end, which keeps keyword prefixes inside identifiers and
+# spaces inside string constants
+def test_xml_comes_from_the_shared_front_end(tmp_path):
+  file_path = tmp_path / 'Main.jack'
+  file_path.write_text('class Main { function void doubled() { do Output.printString("a b"); return; } }')
+  output = io.StringIO()
+  jackparser.parse_tree(file_path, False, jackparser.XMLWriter(output))
+  assert '<identifier> doubled </identifier>' in output.getvalue()
+  assert '<stringConstant> a b </stringConstant>' in output.getvalue()
@@ -0,0 +1,178 @@
+#!/usr/bin/env python3
+import argparse
+import json
+import random
+import subprocess
+import time
+from pathlib import Path
+
+from jackcompiler import (PHASES, CompilationEngine, LabelValue, PassManager, PASSES, VM_PASSES, Profiler,
+                          Tokenizer)
+
+REGRESSION_THRESHOLD = 0.15
+
+# Identifiers are kept to a letter plus digits so no generated name starts with a Jack keyword
+class CorpusGenerator:
+  def __init__(self, n_classes: int, n_methods: int, n_statements: int, depth: int, seed: int):
+    self.n_classes = n_classes
+    self.n_methods = n_methods
+    self.n_statements = n_statements
+    self.depth = depth
+    self.random = random.Random(seed)
+
+  def expression(self, names: list[str], depth: int) -> str:
+    if depth <= 0 or self.random.random() < 0.2:
+      choice = self.random.random()
+      if choice < 0.4: return self.random.choice(names)
+      if choice < 0.6: return f'a1[{self.random.choice(names)}]'
+      return str(self.random.randint(0, 999))
+    op = self.random.choice(['+', '-', '*', '/', '&', '|'])
+    left = self.expression(names, depth - 1)
+    right = self.expression(names, depth - 1)
+    return f'({left} {op} {right})' if self.random.random() < 0.5 else f'{left} {op} ({right})'
+
+  def condition(self, names: list[str]) -> str:
+    op = self.random.choice(['<', '>', '='])
+    condition = f'{self.expression(names, 2)} {op} {self.expression(names, 2)}'
+    return f'(~({condition}))' if self.random.random() < 0.3 else f'({condition})'
+
+  def statements(self, names: list[str], class_index: int, count: int, indent: str) -> list[str]:
+    lines = []
+    for _ in range(count):
+      choice = self.random.random()
+      target = self.random.choice(names)
+      if choice < 0.45:
+        lines.append(f'{indent}let {target} = {self.expression(names, self.depth)};')
+      elif choice < 0.55:
+        lines.append(f'{indent}let a1[{target}] = {self.expression(names, self.depth)};')
+      elif choice < 0.65:
+        lines.append(f'{indent}if {self.condition(names)} {{')
+        lines += self.statements(names, class_index, 2, indent + '  ')
+        lines.append(f'{indent}}} else {{')
+        lines += self.statements(names, class_index, 2, indent + '  ')
+        lines.append(f'{indent}}}')
+      elif choice < 0.75:
+        lines.append(f'{indent}while {self.condition(names)} {{')
+        lines += self.statements(names, class_index, 2, indent + '  ')
+        lines.append(f'{indent}}}')
+      elif choice < 0.85:
+        callee = self.random.randrange(self.n_classes)
+        lines.append(f'{indent}let {target} = C{callee}.f{self.random.randrange(self.n_methods)}({self.expression(names, 2)}, '
+                     f'{self.expression(names, 2)});')
+      else:
+        lines.append(f'{indent}do Output.printString("s{self.random.randint(0, 99)} value");')
+    return lines
+
+  def jack_class(self, class_index: int) -> str:
+    lines = [f'class C{class_index} {{', '  static int s1, s2;', '  field int x1, x2;', '']
+    for method_index in range(self.n_methods):
+      names = ['p1', 'p2', 'v1', 'v2', 'v3', 's1', 's2']
+      lines.append(f'  function int f{method_index}(int p1, int p2) {{')
+      lines.append('    var int v1, v2, v3;')
+      lines.append('    var Array a1;')
+      lines.append('    let a1 = Array.new(16);')
+      lines += self.statements(names, class_index, self.n_statements, '    ')
+      lines.append(f'    return {self.expression(names, self.depth)};')
+      lines.append('  }')
+      lines.append('')
+    lines.append('}')
+    return '\n'.join(lines) + '\n'
+
+  def write(self, directory: Path):
+    directory.mkdir(parents=True, exist_ok=True)
+    for class_index in range(self.n_classes):
+      (directory / f'C{class_index}.jack').write_text(self.jack_class(class_index))
+
+def git_revision() -> str:
+  try:
+    return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                          cwd=Path(__file__).parent).stdout.strip()
+  except OSError:
+    return ''
+
+def run_benchmark(directory: Path, repeat: int) -> dict:
+  candidates = sorted(directory.glob('*.jack'))
+  best = None
+  for _ in range(repeat):
+    profiler = Profiler(True, track_allocations=False)
+    label_value = LabelValue()
+    pass_manager = PassManager(list(PASSES) + list(VM_PASSES))
+    for fp in candidates:
+      with profiler.phase(fp.stem, 'tokenize'):
+        tokenizer = Tokenizer(fp)
+      CompilationEngine(tokenizer, label_value, False, pass_manager, profiler).compile_class()
+    totals = profiler.phase_totals()
+    total = sum(record.seconds for record in totals.values())
+    if best is None or total < best[0]:
+      best = (total, totals, profiler)
+
+  total, totals, profiler = best
+  return {
+    'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+    'revision': git_revision(),
+    'classes': len(candidates),
+    'tokens': profiler.tokens,
+    'vm_lines': profiler.vm_lines,
+    'phases': {phase: totals[phase].seconds for phase in PHASES},
+    'total': total,
+    'tokens_per_second': profiler.tokens / totals['tokenize'].seconds if totals['tokenize'].seconds else 0,
+    'vm_lines_per_second': profiler.vm_lines / total if total else 0,
+  }
+
+def load_history(history_file: Path) -> list[dict]:
+  if not history_file.exists():
+    return []
+  with open(history_file, 'r') as f:
+    return [json.loads(line) for line in f if line.strip() != '']
+
+def find_regressions(result: dict, history: list[dict]) -> list[str]:
+  comparable = [entry for entry in history if entry['tokens'] == result['tokens']]
+  if not comparable:
+    return []
+  regressions = []
+  for phase in PHASES + ['total']:
+    previous = sorted(entry['phases'][phase] if phase in PHASES else entry['total'] for entry in comparable)
+    baseline = previous[len(previous) // 2]
+    current = result['phases'][phase] if phase in PHASES else result['total']
+    if baseline > 0 and current > baseline * (1 + REGRESSION_THRESHOLD):
+      regressions.append(f'{phase}: {current * 1000:.2f} ms vs median {baseline * 1000:.2f} ms')
+  return regressions
+
+def main():
+  parser = argparse.ArgumentParser(description='Generates a synthetic Jack corpus and benchmarks the Jack compiler on it')
+  parser.add_argument('--f', help='Folder containing the Jack corpus to benchmark')
+  parser.add_argument('--generate', help='Write a synthetic corpus into this folder', action='store_true')
+  parser.add_argument('--classes', help='Number of generated classes', type=int, default=20)
+  parser.add_argument('--methods', help='Number of functions per generated class', type=int, default=8)
+  parser.add_argument('--statements', help='Number of top level statements per function', type=int, default=20)
+  parser.add_argument('--depth', help='Maximum generated expression depth', type=int, default=4)
+  parser.add_argument('--seed', help='Seed for the corpus generator', type=int, default=1)
+  parser.add_argument('--repeat', help='Runs per benchmark, the fastest is recorded', type=int, default=3)
+  parser.add_argument('--history', help='JSON lines file that benchmark results are appended to',
+                      default='jackbench_history.jsonl')
+
+  args = parser.parse_args()
+  directory = Path(args.f)
+
+  if args.generate:
+    CorpusGenerator(args.classes, args.methods, args.statements, args.depth, args.seed).write(directory)
+
+  history_file = Path(args.history)
+  result = run_benchmark(directory, args.repeat)
+  regressions = find_regressions(result, load_history(history_file))
+
+  with open(history_file, 'a') as f:
+    f.write(json.dumps(result) + '\n')
+
+  for phase in PHASES:
+    print(f'{phase:<14}{result["phases"][phase] * 1000:>10.2f} ms')
+  print(f'{"total":<14}{result["total"] * 1000:>10.2f} ms')
+  print(f'{result["tokens"]} tokens, {result["tokens_per_second"]:.0f} tokens/s')
+  print(f'{result["vm_lines"]} VM lines, {result["vm_lines_per_second"]:.0f} VM lines/s')
+  for regression in regressions:
+    print(f'Regression in {regression}')
+  if regressions:
+    raise SystemExit(1)
+
+if __name__ == '__main__':
+  main()
@@ -1,60 +1,33 @@
 #!/usr/bin/env python3
 import argparse
+import copy
+import importlib.util
 from pathlib import Path
-from enum import Enum
 from dataclasses import dataclass
-import string
+from contextlib import contextmanager, ExitStack
+import time
+import tracemalloc
+
+from jackfrontend import (ARGUMENT, CONSTRUCTOR, FALSE, FIELD, FUNCTION, INT, LOCAL, MAIN, METHOD, NULL, STATIC, THIS,
+                          TRUE, ArrayRef, BinaryOp, Call, ClassNode, Do, Expression, If, IntConst, KeywordConst, Let,
+                          LocalTee, Parser, Return, Statement, StrConst, Subroutine, Tokenizer, UnaryOp, Var, While,
+                          XMLWriter)
 
-ARGUMENT = 'argument'
-LOCAL = 'local'
 CONSTANT = 'constant'
 TEMP = 'temp'
 ARRAY = 'Array'
-MAIN = 'main'
 NEW = 'new'
 POINTER = 'pointer'
 MEMORY_ALLOC = 'Memory.alloc'
-METHOD = 'method'
-CONSTRUCTOR = 'constructor'
-FUNCTION = 'function'
-STATIC = 'static'
-FIELD = 'field'
-INT = 'int'
-CHAR = 'char'
-BOOLEAN = 'boolean'
-VOID = 'void'
-THIS = 'this'
-TRUE = 'true'
-FALSE = 'false'
-NULL = 'null'
 
 FIELD_CONV = {'field': 'this'}
 
-KEYWORDS = {'class', 'constructor', 'function', 'method', 'field', 'static', 'var', 'int', 'char', 
-            'boolean', 'void', 'true', 'false', 'null', 'this', 'let', 'do', 'if', 'else', 'while', 
-            'return'}
-
-SYMBOLS = {'{', '}', '|', '(', ')', '[', ']', '.', ',', ';', '+', '-', '*', '/', '&', '|', 
-           '<', '>', '=', '~'}
-
-INT_RANGE = range(0,32767)
-
-OP_CONV = {'+': 'add', '-': 'sub', '&': 'and', '|': 'or', '<': 'lt',
-            '>': 'gt', '=': 'eq', '*': 'call Math.multiply 2', '/': 'call Math.divide 2'}
+OP_CONV = {'+': ('add',), '-': ('sub',), '&': ('and',), '|': ('or',), '<': ('lt',),
+           '>': ('gt',), '=': ('eq',), '*': ('call', 'Math.multiply', 2), '/': ('call', 'Math.divide', 2)}
 UNARY_OP_CONV = {'-': 'neg', '~': 'not'}
 
 CONST_CONV = {'true': 'constant', 'false': 'constant', 'null': 'constant', 'this': 'pointer'}
-INDEX_CONV = {'true': '1', 'false': '0', 'null': '0', 'this': '0'}
-
-class LexicalLabels(Enum):
-  KEYWORD = 'keyword'
-  SYMBOL = 'symbol'
-  INT_CONST = 'integerConstant'
-  STR_CONST = 'stringConstant'
-  IDENTIFIER = 'identifier'
-
-  def __str__(self):
-    return self.value
+INDEX_CONV = {'true': 1, 'false': 0, 'null': 0, 'this': 0}
 
 class LabelValue:
   def __init__(self):
@@ -65,467 +38,975 @@ class LabelValue:
     self.value += 1
     return self.value
 
-class Tokenizer:
-  def __init__(self, file_path):
-    self.tokens = tokenize(file_path)
-    self.index = 0
+class StringPool:
+  def __init__(self, base: int):
+    self.base = base
+    self.literals: dict[str, int] = {}
+    self.call_sites = 0
 
-  def advance(self):
-    self.index += 1 
+  def intern(self, literal: str) -> int:
+    self.call_sites += 1
+    if literal not in self.literals:
+      self.literals[literal] = self.base + len(self.literals)
+    return self.literals[literal]
 
   @property
-  def token_type(self):
-    token = self.current_token
-    if token in KEYWORDS: return LexicalLabels.KEYWORD
-    elif token in SYMBOLS: return LexicalLabels.SYMBOL
-    elif token[0] in string.digits and int(token) in INT_RANGE: return LexicalLabels.INT_CONST
-    elif token[0] == '"' and token[-1] == '"': return LexicalLabels.STR_CONST
-    else: return LexicalLabels.IDENTIFIER
+  def pooled_bytes(self) -> int:
+    return sum(len(literal) for literal in self.literals)
+
+# Optimization passes take a ClassNode and return the (possibly rewritten) ClassNode
+
+def statement_lists(statements: list[Statement]):
+  yield statements
+  for statement in statements:
+    if isinstance(statement, If):
+      yield from statement_lists(statement.then)
+      if statement.otherwise is not None: yield from statement_lists(statement.otherwise)
+    elif isinstance(statement, While):
+      yield from statement_lists(statement.body)
+
+def terminates(statements: list[Statement]) -> bool:
+  if len(statements) == 0:
+    return False
+  last = statements[-1]
+  if isinstance(last, Return):
+    return True
+  if isinstance(last, If):
+    return last.otherwise is not None and terminates(last.then) and terminates(last.otherwise)
+  return False
+
+def eliminate_dead_code(class_node: ClassNode) -> ClassNode:
+  for subroutine in class_node.subroutines:
+    for statements in statement_lists(subroutine.body):
+      for i, statement in enumerate(statements):
+        if isinstance(statement, Return) or (isinstance(statement, If) and terminates([statement])):
+          del statements[i + 1:]
+          break
+  return class_node
+
+def constant_truth(expr: Expression) -> None | bool:
+  if isinstance(expr, KeywordConst) and expr.value in [TRUE, FALSE, NULL]:
+    return expr.value == TRUE
+  if isinstance(expr, IntConst):
+    return expr.value != 0
+  # ~ is bitwise, so it only negates the truth of true and false, ~1 is -2 and true
+  if isinstance(expr, UnaryOp) and expr.op == '~':
+    if isinstance(expr.operand, IntConst):
+      return (~expr.operand.value & 0xFFFF) != 0
+    if is_boolean(expr.operand):
+      truth = constant_truth(expr.operand)
+      return None if truth is None else not truth
+  return None
+
+def is_boolean(expr: Expression) -> bool:
+  if isinstance(expr, BinaryOp) and expr.op in ['<', '>', '=']:
+    return True
+  if isinstance(expr, BinaryOp) and expr.op in ['&', '|']:
+    return is_boolean(expr.left) and is_boolean(expr.right)
+  if isinstance(expr, UnaryOp) and expr.op == '~':
+    return is_boolean(expr.operand)
+  return isinstance(expr, KeywordConst) and expr.value in [TRUE, FALSE]
+
+def fold_constant_branches(class_node: ClassNode) -> ClassNode:
+  def fold(statements: list[Statement]) -> list[Statement]:
+    folded = []
+    for statement in statements:
+      if isinstance(statement, If):
+        statement.then = fold(statement.then)
+        statement.otherwise = fold(statement.otherwise) if statement.otherwise is not None else None
+        truth = constant_truth(statement.cond)
+        if truth is True:
+          folded += statement.then
+          continue
+        if truth is False:
+          folded += statement.otherwise if statement.otherwise is not None else []
+          continue
+      elif isinstance(statement, While):
+        statement.body = fold(statement.body)
+        if constant_truth(statement.cond) is False:
+          continue
+      folded.append(statement)
+    return folded
+
+  for subroutine in class_node.subroutines:
+    subroutine.body = fold(subroutine.body)
+  return class_node
+
+# Subexpressions are reused through hidden locals appended after the declared ones, since
+# locals belong to the frame and survive any calls made while evaluating the expression
+CSE_MIN_COST = 4
+
+# Expressions containing a call, string or tee have no key, since two of them never compute the same value
+def expression_key(expr: Expression):
+  if isinstance(expr, IntConst): return (IntConst, expr.value)
+  if isinstance(expr, KeywordConst): return (KeywordConst, expr.value)
+  if isinstance(expr, Var): return (Var, expr.kind, expr.index)
+  if isinstance(expr, (ArrayRef, BinaryOp, UnaryOp)):
+    children = [expression_key(expr.var)] if isinstance(expr, ArrayRef) else []
+    children += [expression_key(child) for child in expression_children(expr)]
+    if None in children:
+      return None
+    return (type(expr), getattr(expr, 'op', None), *children)
+  return None
+
+def expression_cost(expr: Expression) -> int:
+  if isinstance(expr, ArrayRef): return 4 + expression_cost(expr.index)
+  if isinstance(expr, BinaryOp): return (10 if expr.op in ['*', '/'] else 1) + expression_cost(expr.left) + expression_cost(expr.right)
+  if isinstance(expr, UnaryOp): return 1 + expression_cost(expr.operand)
+  if isinstance(expr, Call): return 10 + sum(expression_cost(arg) for arg in expr.args)
+  return 1
+
+def has_side_effects(expr: Expression) -> bool:
+  if isinstance(expr, (Call, StrConst)): return True
+  if isinstance(expr, ArrayRef): return has_side_effects(expr.index)
+  if isinstance(expr, BinaryOp): return has_side_effects(expr.left) or has_side_effects(expr.right)
+  if isinstance(expr, UnaryOp): return has_side_effects(expr.operand)
+  return False
+
+def is_frame_local(expr: Expression) -> bool:
+  if isinstance(expr, Var): return expr.kind in [LOCAL, ARGUMENT]
+  if isinstance(expr, BinaryOp): return is_frame_local(expr.left) and is_frame_local(expr.right)
+  if isinstance(expr, UnaryOp): return is_frame_local(expr.operand)
+  return isinstance(expr, (IntConst, KeywordConst))
+
+def expression_children(expr: Expression) -> list[Expression]:
+  if isinstance(expr, ArrayRef): return [expr.index]
+  if isinstance(expr, BinaryOp): return [expr.left, expr.right]
+  if isinstance(expr, UnaryOp): return [expr.operand]
+  if isinstance(expr, Call): return expr.args
+  if isinstance(expr, LocalTee): return [expr.expr]
+  return []
+
+def contains_array(expr: Expression) -> bool:
+  return isinstance(expr, ArrayRef) or any(contains_array(child) for child in expression_children(expr))
+
+def expression_segments(expr: Expression) -> set[tuple[str, int]]:
+  if isinstance(expr, Var):
+    segment = FIELD_CONV[expr.kind] if expr.kind in FIELD_CONV else expr.kind
+    return {(segment, expr.index), (POINTER, 0)} if segment == THIS else {(segment, expr.index)}
+  segments = set()
+  for child in expression_children(expr):
+    segments |= expression_segments(child)
+  return segments
+
+def array_address_key(var: Var, offset_expr: None | Expression) -> None | tuple:
+  if offset_expr is None:
+    return (expression_key(var), ())
+  if contains_array(offset_expr) or expression_key(offset_expr) is None:
+    return None
+  return (expression_key(var), expression_key(offset_expr))
+
+def array_address_keys(expr: Expression) -> set[None | tuple]:
+  keys = set()
+  if isinstance(expr, ArrayRef):
+    keys.add(array_address_key(expr.var, split_index(expr.index)[0]))
+  for child in expression_children(expr):
+    keys |= array_address_keys(child)
+  return keys
+
+# Splits an array index into a base expression and a constant offset that can be
+# addressed directly through the that segment, e.g. a[i + 2] becomes (i, 2)
+def split_index(expr: Expression) -> tuple[None | Expression, int]:
+  if isinstance(expr, IntConst): return None, expr.value
+  if isinstance(expr, BinaryOp) and expr.op == '+':
+    if isinstance(expr.right, IntConst): return expr.left, expr.right.value
+    if isinstance(expr.left, IntConst): return expr.right, expr.left.value
+  return expr, 0
+
+def reuse_common_subexpressions(class_node: ClassNode) -> ClassNode:
+  def candidate(expr: Expression, volatile: bool):
+    if not isinstance(expr, (ArrayRef, BinaryOp, UnaryOp)) or expression_cost(expr) < CSE_MIN_COST:
+      return None
+    if has_side_effects(expr) or (volatile and not is_frame_local(expr)):
+      return None
+    return expression_key(expr)
+
+  def count(expr: Expression, counts: dict, volatile: bool):
+    key = candidate(expr, volatile)
+    if key is not None:
+      counts[key] = counts.get(key, 0) + 1
+      if counts[key] > 1: return
+    for child in expression_children(expr):
+      count(child, counts, volatile)
+
+  def rewrite(expr: Expression, counts: dict, slots: dict, volatile: bool, next_slot: list[int]) -> Expression:
+    key = candidate(expr, volatile)
+    if key is not None and counts.get(key, 0) > 1:
+      if key in slots:
+        return Var('', LOCAL, slots[key], INT)
+      slots[key] = next_slot[0]; next_slot[0] += 1
+      return LocalTee(slots[key], rewrite_children(expr, counts, slots, volatile, next_slot))
+    return rewrite_children(expr, counts, slots, volatile, next_slot)
+
+  def rewrite_children(expr: Expression, counts: dict, slots: dict, volatile: bool, next_slot: list[int]) -> Expression:
+    if isinstance(expr, ArrayRef):
+      expr.index = rewrite(expr.index, counts, slots, volatile, next_slot)
+    elif isinstance(expr, BinaryOp):
+      expr.left = rewrite(expr.left, counts, slots, volatile, next_slot)
+      expr.right = rewrite(expr.right, counts, slots, volatile, next_slot)
+    elif isinstance(expr, UnaryOp):
+      expr.operand = rewrite(expr.operand, counts, slots, volatile, next_slot)
+    elif isinstance(expr, Call):
+      expr.args = [rewrite(arg, counts, slots, volatile, next_slot) for arg in expr.args]
+    return expr
+
+  def optimize(expr: Expression, base: int) -> tuple[Expression, int]:
+    counts = {}
+    volatile = has_side_effects(expr)
+    count(expr, counts, volatile)
+    if all(n < 2 for n in counts.values()):
+      return expr, base
+    next_slot = [base]
+    return rewrite(expr, counts, {}, volatile, next_slot), next_slot[0]
+
+  for subroutine in class_node.subroutines:
+    base = subroutine.n_locals; n_locals = base
+    for statements in statement_lists(subroutine.body):
+      for statement in statements:
+        for attr in ['value', 'index', 'cond', 'expr']:
+          expr = getattr(statement, attr, None)
+          if expr is not None and not isinstance(expr, list):
+            expr, used = optimize(expr, base)
+            setattr(statement, attr, expr)
+            n_locals = max(n_locals, used)
+    subroutine.n_locals = n_locals
+  return class_node
+
+# Whole-program inlining of trivial getters, setters and small functions. Candidate bodies are
+# copied before any class is optimized so hidden locals introduced by later passes never leak
+INLINE_SIZE = 8
+
+def is_trivial_expression(expr: Expression) -> bool:
+  if isinstance(expr, Var): return expr.kind in [FIELD, ARGUMENT, STATIC]
+  if isinstance(expr, BinaryOp): return expr.op not in ['*', '/'] and is_trivial_expression(expr.left) and is_trivial_expression(expr.right)
+  if isinstance(expr, UnaryOp): return is_trivial_expression(expr.operand)
+  return isinstance(expr, (IntConst, KeywordConst))
+
+def expression_size(expr: Expression) -> int:
+  return 1 + sum(expression_size(child) for child in expression_children(expr))
+
+def argument_uses(expr: Expression, uses: dict[int, int]):
+  if isinstance(expr, Var) and expr.kind == ARGUMENT:
+    uses[expr.index] = uses.get(expr.index, 0) + 1
+  for child in expression_children(expr):
+    argument_uses(child, uses)
+
+def uses_static(expr: Expression) -> bool:
+  return (isinstance(expr, Var) and expr.kind == STATIC) or any(uses_static(child) for child in expression_children(expr))
+
+# The lets of an inlined setter are stored one after another, so no argument may read a field or static
+# that an earlier let already wrote. A field written through another receiver may alias any field of this.
+def setter_reads_earlier_store(call: Call, lets: list[Let], offset: int) -> bool:
+  written = set()
+  for let in lets:
+    uses = {}
+    argument_uses(let.value, uses)
+    for index in uses:
+      if index < offset: continue
+      segments = expression_segments(call.args[index - offset])
+      if segments & written or ((THIS, None) in written and any(segment == THIS for segment, _ in segments)):
+        return True
+    if let.target.kind == FIELD:
+      written.add((THIS, let.target.index if isinstance(call.receiver, KeywordConst) else None))
+    else:
+      written.add((let.target.kind, let.target.index))
+  return False
+
+class Inliner:
+  def __init__(self, class_nodes: list[ClassNode], max_size: int = INLINE_SIZE):
+    self.max_size = max_size
+    self.candidates: dict[str, tuple[str, str, None | Expression, list[Let]]] = {}
+    self.inlined: dict[str, int] = {}
+    self.class_name = ''
+    for class_node in class_nodes:
+      for subroutine in class_node.subroutines:
+        candidate = self.__trivial_body(subroutine)
+        if candidate is not None:
+          self.candidates[class_node.name + '.' + subroutine.name] = (class_node.name, subroutine.kind) + candidate
+
+  def __trivial_body(self, subroutine: Subroutine) -> None | tuple[None | Expression, list[Let]]:
+    if subroutine.kind not in [METHOD, FUNCTION] or subroutine.n_locals > 0 or subroutine.name == MAIN:
+      return None
+    body = subroutine.body
+    if len(body) == 1 and isinstance(body[0], Return) and body[0].value is not None:
+      if is_trivial_expression(body[0].value) and expression_size(body[0].value) <= self.max_size:
+        return copy.deepcopy(body[0].value), []
+      return None
+    if len(body) == 0 or not isinstance(body[-1], Return) or body[-1].value is not None:
+      return None
+    lets = body[:-1]
+    for let in lets:
+      if not isinstance(let, Let) or let.index is not None or let.target.kind not in [FIELD, STATIC]:
+        return None
+      if not is_trivial_expression(let.value):
+        return None
+    if sum(1 + expression_size(let.value) for let in lets) > self.max_size:
+      return None
+    return None, copy.deepcopy(lets)
 
   @property
-  def current_token(self):
-    return self.tokens[self.index]
-
-@dataclass
-class SymbolData:
-  type_of: str
-  kind: str
-  index: int
-
-class SymbolTable:
-  def __init__(self):
-    self.symbol_table: dict[str, SymbolData] = {}
-    self.kind_id = {}
-    self.num_of_fields = 0
-
-  def add(self, name: str, type_of: str, kind: str):
-    index = self.__kind_lookup(kind)
-    if kind == FIELD: self.num_of_fields += 1
-    self.symbol_table[name] = SymbolData(type_of, kind, index)
-
-  def __kind_lookup(self, kind: str) -> int:
-    self.kind_id[kind] = 0 if kind not in self.kind_id else self.kind_id[kind] + 1
-    return self.kind_id[kind]
-
-  def reset(self):
-    self.symbol_table = {}; self.kind_id = {}
-
-  def get_symbol(self, name: str) -> None | SymbolData:
-    return self.symbol_table.get(name)
-
-class CompilationEngine:
-  def __init__(self, jack_tokenizer: Tokenizer, label_value: LabelValue):
-    self.tokenizer = jack_tokenizer
+  def total(self) -> int:
+    return sum(self.inlined.values())
+
+  def __call__(self, class_node: ClassNode) -> ClassNode:
+    self.class_name = class_node.name
+    for subroutine in class_node.subroutines:
+      subroutine.body = self.__rewrite_statements(subroutine.body)
+    return class_node
+
+  def __rewrite_statements(self, statements: list[Statement]) -> list[Statement]:
+    rewritten = []
+    for statement in statements:
+      if isinstance(statement, Do):
+        statement.expr = self.__rewrite_expression(statement.expr)
+        lets = self.__inline_setter(statement.expr)
+        if lets is not None:
+          rewritten += lets
+          continue
+        if not isinstance(statement.expr, Call) and not has_side_effects(statement.expr):
+          continue
+      elif isinstance(statement, Let):
+        statement.index = self.__rewrite_expression(statement.index) if statement.index is not None else None
+        statement.value = self.__rewrite_expression(statement.value)
+      elif isinstance(statement, If):
+        statement.cond = self.__rewrite_expression(statement.cond)
+        statement.then = self.__rewrite_statements(statement.then)
+        statement.otherwise = self.__rewrite_statements(statement.otherwise) if statement.otherwise is not None else None
+      elif isinstance(statement, While):
+        statement.cond = self.__rewrite_expression(statement.cond)
+        statement.body = self.__rewrite_statements(statement.body)
+      elif isinstance(statement, Return) and statement.value is not None:
+        statement.value = self.__rewrite_expression(statement.value)
+      rewritten.append(statement)
+    return rewritten
+
+  def __rewrite_expression(self, expr: Expression) -> Expression:
+    if isinstance(expr, ArrayRef):
+      expr.index = self.__rewrite_expression(expr.index)
+    elif isinstance(expr, BinaryOp):
+      expr.left = self.__rewrite_expression(expr.left)
+      expr.right = self.__rewrite_expression(expr.right)
+    elif isinstance(expr, UnaryOp):
+      expr.operand = self.__rewrite_expression(expr.operand)
+    elif isinstance(expr, Call):
+      expr.args = [self.__rewrite_expression(arg) for arg in expr.args]
+      candidate = self.__candidate(expr, True)
+      if candidate is not None:
+        return self.__substitute(candidate[2], candidate[1], expr)
+    return expr
+
+  def __candidate(self, call: Call, getter: bool):
+    candidate = self.candidates.get(call.name)
+    if candidate is None or (candidate[2] is not None) != getter:
+      return None
+    class_name, kind, value, lets = candidate
+    if (kind == METHOD) != (call.receiver is not None) or any(has_side_effects(arg) for arg in call.args):
+      return None
+    exprs = [value] if value is not None else [let.value for let in lets]
+    if class_name != self.class_name and (any(uses_static(expr) for expr in exprs) or any(let.target.kind == STATIC for let in lets)):
+      return None
+    uses = {}
+    for expr in exprs:
+      argument_uses(expr, uses)
+    offset = 1 if kind == METHOD else 0
+    for i, arg in enumerate(call.args):
+      if uses.get(i + offset, 0) > 1 and not isinstance(arg, (Var, IntConst, KeywordConst)):
+        return None
+      if len(lets) > 1 and contains_array(arg):
+        return None
+    if setter_reads_earlier_store(call, lets, offset):
+      return None
+    self.inlined[call.name] = self.inlined.get(call.name, 0) + 1
+    return candidate
+
+  def __inline_setter(self, expr: Expression) -> None | list[Let]:
+    if not isinstance(expr, Call):
+      return None
+    candidate = self.__candidate(expr, False)
+    if candidate is None:
+      return None
+    lets = []
+    for let in candidate[3]:
+      value = self.__substitute(let.value, candidate[1], expr)
+      if let.target.kind == FIELD and not isinstance(expr.receiver, KeywordConst):
+        lets.append(Let(copy.deepcopy(expr.receiver), IntConst(let.target.index), value))
+      else:
+        lets.append(Let(copy.deepcopy(let.target), None, value))
+    return lets
+
+  def __substitute(self, expr: Expression, kind: str, call: Call) -> Expression:
+    if isinstance(expr, Var) and expr.kind == ARGUMENT:
+      return copy.deepcopy(call.args[expr.index - 1 if kind == METHOD else expr.index])
+    if isinstance(expr, Var) and expr.kind == FIELD and not isinstance(call.receiver, KeywordConst):
+      return ArrayRef(copy.deepcopy(call.receiver), IntConst(expr.index))
+    if isinstance(expr, KeywordConst) and expr.value == THIS:
+      return copy.deepcopy(call.receiver)
+    if isinstance(expr, BinaryOp):
+      return BinaryOp(expr.op, self.__substitute(expr.left, kind, call), self.__substitute(expr.right, kind, call))
+    if isinstance(expr, UnaryOp):
+      return UnaryOp(expr.op, self.__substitute(expr.operand, kind, call))
+    return copy.deepcopy(expr)
+
+# VM passes take the generated VM commands of a class, records of their words such as ('goto', 'L3'),
+# and return the rewritten commands
+
+def thread_jumps(buffer: list[tuple]) -> list[tuple]:
+  def resolve(label: str) -> str:
+    seen = set()
+    while label in forward and label not in seen:
+      seen.add(label); label = forward[label]
+    return label
+
+  forward = {}
+  for i, command in enumerate(buffer):
+    if command[0] == 'label':
+      j = i + 1
+      while j < len(buffer) and buffer[j][0] == 'label': j += 1
+      if j < len(buffer) and buffer[j][0] == 'goto':
+        forward[command[1]] = buffer[j][1]
+
+  threaded = []
+  for command in buffer:
+    if command[0] in ['goto', 'if-goto']: command = (command[0], resolve(command[1]))
+    threaded.append(command)
+
+  changed = True
+  while changed:
+    referenced = {command[1] for command in threaded if command[0] in ['goto', 'if-goto']}
+    pruned = []
+    reachable = True
+    for i, command in enumerate(threaded):
+      if command[0] == 'label' and command[1] not in referenced:
+        continue
+      if command[0] in ['label', 'function']:
+        reachable = True
+      if not reachable:
+        continue
+      if command[0] == 'goto' and i + 1 < len(threaded) and threaded[i + 1] == ('label', command[1]):
+        continue
+      if command[0] in ['goto', 'return']:
+        reachable = False
+      pruned.append(command)
+    changed = len(pruned) != len(threaded)
+    threaded = pruned
+  return threaded
+
+def vm_line(command: tuple) -> str:
+  return ' '.join(map(str, command))
+
+PASSES = {
+  'dead-code': eliminate_dead_code,
+  'constant-branches': fold_constant_branches,
+  'cse': reuse_common_subexpressions,
+}
+
+VM_PASSES = {
+  'jump-threading': thread_jumps,
+}
+
+class PassManager:
+  def __init__(self, passes: list[str]):
+    self.passes = [(name, PASSES[name]) for name in passes if name in PASSES]
+    self.vm_passes = [(name, VM_PASSES[name]) for name in passes if name in VM_PASSES]
+    unknown = [name for name in passes if name not in PASSES and name not in VM_PASSES]
+    if unknown:
+      raise Exception(f'Unknown optimization passes {unknown}')
+    self.timings: dict[str, float] = {name: 0.0 for name in passes}
+
+  def add_pass(self, name: str, optimization, first: bool = True):
+    self.passes.insert(0 if first else len(self.passes), (name, optimization))
+    self.timings[name] = 0.0
+
+  def __timed(self, name: str, optimization, target):
+    start = time.perf_counter()
+    target = optimization(target)
+    self.timings[name] += time.perf_counter() - start
+    return target
+
+  def run(self, class_node: ClassNode) -> ClassNode:
+    for name, optimization in self.passes:
+      class_node = self.__timed(name, optimization, class_node)
+    return class_node
+
+  def run_vm(self, buffer: list[tuple]) -> list[tuple]:
+    for name, optimization in self.vm_passes:
+      buffer = self.__timed(name, optimization, buffer)
+    return buffer
+
+class CodeGenerator:
+  def __init__(self, label_value: LabelValue, pool_strings: bool = False):
     self.label_value = label_value
-    self.cst = SymbolTable()
-    self.sst = SymbolTable()
+    self.pool_strings = pool_strings
+    self.string_pool: None | StringPool = None
     self.buffer = []
     self.class_name = ''
-
-  @property
-  def current_token(self):
-    return self.tokenizer.current_token
-
-  @property
-  def token_type(self):
-    return self.tokenizer.token_type
-
-  def __process_st_kind(self, expected_token):
-    if self.current_token != expected_token:
-      raise Exception(f'Token {expected_token} did not match current token {self.current_token}')
-    self.tokenizer.advance()
-    return expected_token
-
-  def __process_st_type(self, expected_tokens: list[str], fallback: LexicalLabels = None):
-    if self.current_token not in expected_tokens and self.token_type != fallback:
-      raise Exception(f'Token {self.current_token} of type {self.token_type} not in {expected_tokens} or {fallback}')
-    token = self.current_token
-    self.tokenizer.advance()
-    return token
-
-  def __process_st_name(self, expected_type: LexicalLabels):
-    if self.token_type != expected_type:
-      raise Exception(f'Token type {self.token_type} does not match {expected_type}')
-    token = self.current_token
-    self.tokenizer.advance()
-    return token
-
-  def __process_token(self, expected_token):
-    if self.current_token != expected_token:
-      raise Exception(f'Token {expected_token} did not match current token {self.current_token}')
-    self.tokenizer.advance()
-
-  def __process_type(self, expected_type: LexicalLabels):
-    if self.token_type != expected_type:
-      raise Exception(f'Token type {self.token_type} does not match {expected_type}')
-    self.tokenizer.advance()
-
-  def __process_list(self, expected_tokens: list[str], fallback: LexicalLabels = None):
-    if self.current_token not in expected_tokens and self.token_type != fallback:
-      raise Exception(f'Token {self.current_token} of type {self.token_type} not in {expected_tokens} or {fallback}')
-    self.tokenizer.advance()
-
-  def __lookup(self, name: str) -> SymbolData:
-    s_data = self.cst.get_symbol(name) if name in self.cst.symbol_table else self.sst.get_symbol(name)
-    if s_data is None:
-      raise Exception(f'Symbol {name} was not found in either symbol table')
-    return s_data
-
-  def __is_in_symbol_table(self, name: str) -> bool:
-    return True if name in self.cst.symbol_table or name in self.sst.symbol_table else False
+    self.that_address: None | tuple[tuple, set[tuple[str, int]]] = None
 
   def __write_pop(self, segment: str, index: int):
     segment = FIELD_CONV[segment] if segment in FIELD_CONV else segment
-    self.buffer.append(f'pop {segment} {index}')
+    if self.that_address is not None and ((segment, index) in self.that_address[1] or (segment, index) == (POINTER, 1)):
+      self.that_address = None
+    self.buffer.append(('pop', segment, index))
 
   def __write_push(self, segment: str, index: int):
     segment = FIELD_CONV[segment] if segment in FIELD_CONV else segment
-    self.buffer.append(f'push {segment} {index}')
+    self.buffer.append(('push', segment, index))
 
-  def __write_arithmetic(self, command: str):
+  def __write_arithmetic(self, *command):
     self.buffer.append(command)
 
   def __write_label(self, label: str):
-    self.buffer.append(f'label {label}')
+    self.that_address = None
+    self.buffer.append(('label', label))
 
   def __write_goto(self, label: str):
-    self.buffer.append(f'goto {label}')
+    self.buffer.append(('goto', label))
 
   def __write_if(self, label: str):
-    self.buffer.append(f'if-goto {label}')
+    self.buffer.append(('if-goto', label))
 
   def __write_call(self, name: str, n_args: int):
-    self.buffer.append(f'call {name} {n_args}')
+    if self.that_address is not None and any(segment not in [LOCAL, ARGUMENT] for segment, _ in self.that_address[1]):
+      self.that_address = None
+    self.buffer.append(('call', name, n_args))
 
   def __write_function(self, name: str, n_args):
-    self.buffer.append(f'function {name} {n_args}')
+    self.that_address = None
+    self.buffer.append(('function', name, n_args))
 
   def __write_return(self):
-    self.buffer.append('return')
+    self.buffer.append(('return',))
 
   def __generate_label(self):
     return f'L{self.label_value.get_value}'
 
-  def compile_class(self):
-    self.__process_token('class')
-    self.class_name = self.current_token
-    self.__process_type(LexicalLabels.IDENTIFIER)
-    self.__process_token('{')
-    while self.current_token in [STATIC, FIELD]:
-      self.__compile_class_var_dec()
-    while self.current_token in [VOID, FUNCTION, METHOD]:
-      self.sst.reset()
-      self.__compile_subroutine_dec()
-    self.__process_token('}')
-
-  def __compile_class_var_dec(self):
-    s_kind = self.__process_st_kind(STATIC) if self.current_token == STATIC else self.__process_st_kind(FIELD)
-    s_type = self.__process_st_type([INT, CHAR, BOOLEAN], LexicalLabels.IDENTIFIER)
-    s_name = self.__process_st_name(LexicalLabels.IDENTIFIER)
-    self.cst.add(s_name, s_type, s_kind)
-    while self.current_token != ';':
-      self.__process_token(',')
-      s_name = self.__process_st_name(LexicalLabels.IDENTIFIER)
-      self.cst.add(s_name, s_type, s_kind)
-    self.__process_token(';')
-
-  def __compile_subroutine_dec(self):
-    fn_type = self.current_token
-    self.__process_list([VOID, FUNCTION, METHOD])
-    self.__process_list([INT, CHAR, BOOLEAN, VOID], LexicalLabels.IDENTIFIER)
-    fn_name = self.current_token
-    if fn_name == MAIN or fn_type == METHOD: self.sst.add(THIS, self.class_name, ARGUMENT)
-    self.__process_type(LexicalLabels.IDENTIFIER)
-    self.__process_token('(')
-    self.__compile_parameter_list()
-    self.__process_token(')')
-    self.__compile_subroutine_body(fn_name, fn_type)
-
-  def __compile_parameter_list(self):
-    if self.current_token != ')':
-      s_type = self.__process_st_type([INT, CHAR, BOOLEAN], LexicalLabels.IDENTIFIER)
-      s_name = self.__process_st_name(LexicalLabels.IDENTIFIER)
-      s_kind = ARGUMENT
-      self.sst.add(s_name, s_type, s_kind)
-      while self.current_token == ',':
-        self.__process_token(',')
-        s_type = self.__process_st_type([INT, CHAR, BOOLEAN], LexicalLabels.IDENTIFIER)
-        s_name = self.__process_st_name(LexicalLabels.IDENTIFIER)
-        self.sst.add(s_name, s_type, s_kind)
-
-  def __compile_subroutine_body(self, fn_name: str, fn_type):
-    n_vars = 0
-    self.__process_token('{')
-    while self.current_token == 'var':
-      n_vars += self.__compile_var_dec()
-    self.__write_function(self.class_name + '.' + fn_name, n_vars)
-    if fn_type == CONSTRUCTOR:
-      self.__write_push(CONSTANT, self.cst.num_of_fields)
+  def generate_class(self, class_node: ClassNode):
+    self.class_name = class_node.name
+    if self.pool_strings:
+      self.string_pool = StringPool(class_node.n_statics)
+    for subroutine in class_node.subroutines:
+      self.__generate_subroutine(subroutine, class_node.n_fields)
+
+  def __generate_subroutine(self, subroutine: Subroutine, n_fields: int):
+    self.__write_function(self.class_name + '.' + subroutine.name, subroutine.n_locals)
+    if subroutine.kind == CONSTRUCTOR:
+      self.__write_push(CONSTANT, n_fields)
       self.__write_call(MEMORY_ALLOC, 1)
       self.__write_pop(POINTER, 0)
-    if fn_type == METHOD:
+    if subroutine.kind == METHOD:
       self.__write_push(ARGUMENT, 0)
       self.__write_pop(POINTER, 0)
-    self.__compile_statements()
-    self.__process_token('}')
-
-  def __compile_var_dec(self) -> int:
-    self.__process_token('var')
-    n_vars = 1
-    s_type = self.__process_st_type([INT, CHAR, BOOLEAN], LexicalLabels.IDENTIFIER)
-    s_name = self.__process_st_name(LexicalLabels.IDENTIFIER)
-    s_kind = LOCAL
-    self.sst.add(s_name, s_type, s_kind)
-    while self.current_token != ';' and self.current_token == ',':
-      self.__process_token(',')
-      s_name = self.__process_st_name(LexicalLabels.IDENTIFIER)
-      self.sst.add(s_name, s_type, s_kind)
-      n_vars += 1
-    self.__process_token(';')
-    return n_vars
-
-  def __compile_statements(self):
-    while self.current_token in ['let', 'while', 'if', 'do', 'return']:
-      if self.current_token == 'let':
-        self.__compile_let()
-      elif self.current_token == 'while':
-        self.__compile_while()
-      elif self.current_token == 'if':
-        self.__compile_if()
-      elif self.current_token == 'do':
-        self.__compile_do()
-      elif self.current_token == 'return':
-        self.__compile_return()
-
-  def __compile_let(self):
-    self.__process_token('let')
-    symbol = self.__lookup(self.__process_st_name(LexicalLabels.IDENTIFIER))
-    is_array_manipulation = True if symbol.type_of == ARRAY and self.current_token == '[' else False
-    if self.current_token == '[':
-      self.__process_token('[')
-      self.__compile_expression()
-      self.__write_push(symbol.kind, symbol.index)
-      self.__write_arithmetic('add')
-      self.__process_token(']')
-    self.__process_token('=')
-    self.__compile_expression()
-    if is_array_manipulation:
-      self.__write_pop('temp', 0)
-      self.__write_pop('pointer', 1)
-      self.__write_push('temp', 0)
-    self.__write_pop(symbol.kind, symbol.index) if not is_array_manipulation else self.__write_pop('that', 0)
-    self.__process_token(';')
-
-  def __compile_if(self):
-    self.__process_token('if')
-    self.__process_token('(') 
-    self.__compile_expression()
-    label_true = self.__generate_label()
-    label_false = self.__generate_label()
-    label_end = self.__generate_label()
-    has_else = False
+    self.__generate_statements(subroutine.body)
+
+  def __generate_statements(self, statements: list[Statement]):
+    for statement in statements:
+      if isinstance(statement, Let):
+        self.__generate_let(statement)
+      elif isinstance(statement, While):
+        self.__generate_while(statement)
+      elif isinstance(statement, If):
+        self.__generate_if(statement)
+      elif isinstance(statement, Do):
+        self.__generate_expression(statement.expr)
+        self.__write_pop(TEMP, 0)
+      elif isinstance(statement, Return):
+        self.__generate_expression(statement.value) if statement.value is not None else self.__write_push(CONSTANT, 0)
+        self.__write_return()
+
+  def __generate_let(self, statement: Let):
+    target = statement.target
+    if statement.index is None:
+      self.__generate_expression(statement.value)
+      self.__write_pop(target.kind, target.index)
+      return
+    offset_expr, offset = split_index(statement.index)
+    value_keys = array_address_keys(statement.value)
+    if not value_keys or (not has_side_effects(statement.value) and value_keys == {array_address_key(target, offset_expr)} - {None}):
+      self.__point_that(target, offset_expr)
+      self.__generate_expression(statement.value)
+    elif is_frame_local(target) and (offset_expr is None or is_frame_local(offset_expr)):
+      self.__generate_expression(statement.value)
+      self.__point_that(target, offset_expr)
+    else:
+      if offset_expr is not None: self.__generate_expression(offset_expr)
+      self.__write_push(target.kind, target.index)
+      if offset_expr is not None: self.__write_arithmetic('add')
+      self.__generate_expression(statement.value)
+      self.__write_pop(TEMP, 0)
+      self.__write_pop(POINTER, 1)
+      self.__write_push(TEMP, 0)
+    self.__write_pop('that', offset)
+
+  # THAT keeps pointing at the last computed array address until a label, a store to one of
+  # the variables it was computed from, or a call that may change a field or static
+  def __point_that(self, var: Var, offset_expr: None | Expression):
+    key = array_address_key(var, offset_expr)
+    if key is not None and self.that_address is not None and self.that_address[0] == key:
+      return
+    if offset_expr is not None: self.__generate_expression(offset_expr)
+    self.__write_push(var.kind, var.index)
+    if offset_expr is not None: self.__write_arithmetic('add')
+    self.__write_pop(POINTER, 1)
+    if key is not None:
+      segments = expression_segments(var) | (expression_segments(offset_expr) if offset_expr is not None else set())
+      self.that_address = (key, segments)
+
+  # Branches jump only to the block that is not laid out next, and a negated comparison
+  # swaps the targets instead of emitting a not, so no goto or label is written unless used
+  def __generate_branch(self, cond: Expression, label_true: None | str, label_false: None | str):
+    truth = constant_truth(cond)
+    if truth is not None:
+      target = label_true if truth else label_false
+      if target is not None: self.__write_goto(target)
+      return
+    if isinstance(cond, UnaryOp) and cond.op == '~' and is_boolean(cond.operand):
+      self.__generate_branch(cond.operand, label_false, label_true)
+      return
+    self.__generate_expression(cond)
+    if label_true is None:
+      label_true = self.__generate_label()
+      self.__write_if(label_true)
+      self.__write_goto(label_false)
+      self.__write_label(label_true)
+      return
     self.__write_if(label_true)
-    self.__write_goto(label_false)
-    self.__write_label(label_true)
-    self.__process_token(')')
-    self.__process_token('{')
-    self.__compile_statements()
-    self.__process_token('}')
-    if self.current_token == 'else':
-      has_else = True
-      self.__process_token('else')
-      self.__process_token('{')
-      self.__write_goto(label_end)
-      self.__write_label(label_false)
-      self.__compile_statements()
-      self.__process_token('}')
-    if has_else: self.__write_label(label_end)
-    else: self.__write_label(label_false)
-
-  def __compile_while(self):
-    label_one = self.__generate_label()
-    label_two = self.__generate_label()
-    self.__write_label(label_one)
-    self.__process_token('while')
-    self.__process_token('(')
-    self.__compile_expression()
-    self.__write_arithmetic('not')
-    self.__write_if(label_two)
-    self.__process_token(')')
-    self.__process_token('{')
-    self.__compile_statements()
-    self.__write_goto(label_one)
-    self.__process_token('}')
-    self.__write_label(label_two)
-
-  def __compile_do(self):
-    self.__process_token('do')
-    self.__compile_expression()
-    self.__write_pop(TEMP, 0)
-    self.__process_token(';')
-
-  def __compile_return(self):
-    self.__process_token('return')
-    self.__compile_expression() if self.current_token != ';' else self.__write_push(CONSTANT, 0)
-    self.__write_return()
-    self.__process_token(';')
-
-  def __compile_expression(self):
-    self.__compile_term()
-    while self.current_token in ['+', '-', '*', '/', '&', '|', '<', '>', '=']:
-      op = OP_CONV[self.current_token]
-      self.tokenizer.advance()
-      self.__compile_term()
-      self.__write_arithmetic(op)
-
-  def __compile_term(self):
-    if self.current_token in [TRUE, FALSE, NULL, THIS]:
-      self.__write_push(CONST_CONV[self.current_token], INDEX_CONV[self.current_token])
-      if self.current_token == TRUE: self.__write_arithmetic('neg')
-      self.tokenizer.advance()
-    elif self.__is_in_symbol_table(self.current_token):
-      symbol = self.__lookup(self.current_token)
-      name = symbol.type_of
-      self.tokenizer.advance()
-      if symbol.type_of == ARRAY and self.current_token == '[':
-        self.__process_token('[')
-        self.__compile_expression()
-        self.__write_push(symbol.kind, symbol.index)
-        self.__write_arithmetic('add')
-        self.__process_token(']')
-        self.__write_pop('pointer', 1)
-        self.__write_push('that', 0)
+    if label_false is not None: self.__write_goto(label_false)
+
+  def __generate_if(self, statement: If):
+    label_end = self.__generate_label()
+    if not statement.otherwise:
+      self.__generate_branch(statement.cond, None, label_end)
+      self.__generate_statements(statement.then)
+      self.__write_label(label_end)
+      return
+    cond = statement.cond
+    then_first = constant_truth(cond) is not None or (isinstance(cond, UnaryOp) and cond.op == '~' and is_boolean(cond.operand))
+    first, second = (statement.then, statement.otherwise) if then_first else (statement.otherwise, statement.then)
+    label_second = self.__generate_label()
+    self.__generate_branch(cond, None, label_second) if then_first else self.__generate_branch(cond, label_second, None)
+    self.__generate_statements(first)
+    if not terminates(first): self.__write_goto(label_end)
+    self.__write_label(label_second)
+    self.__generate_statements(second)
+    self.__write_label(label_end)
+
+  # Loops are rotated so the condition sits at the bottom and a single if-goto closes each iteration
+  def __generate_while(self, statement: While):
+    label_body = self.__generate_label()
+    label_cond = self.__generate_label()
+    if constant_truth(statement.cond) is not True: self.__write_goto(label_cond)
+    self.__write_label(label_body)
+    self.__generate_statements(statement.body)
+    self.__write_label(label_cond)
+    self.__generate_branch(statement.cond, label_body, None)
+
+  def __generate_expression(self, expr: Expression):
+    if isinstance(expr, IntConst):
+      self.__write_push(CONSTANT, expr.value)
+    elif isinstance(expr, KeywordConst):
+      self.__write_push(CONST_CONV[expr.value], INDEX_CONV[expr.value])
+      if expr.value == TRUE: self.__write_arithmetic('neg')
+    elif isinstance(expr, Var):
+      self.__write_push(expr.kind, expr.index)
+    elif isinstance(expr, StrConst):
+      if self.string_pool is not None:
+        self.__generate_pooled_string(expr.value)
       else:
-        self.__write_push(symbol.kind, symbol.index)
-      if self.current_token == '.':
-        self.__process_token('.')
-        method = self.current_token
-        self.__process_type(LexicalLabels.IDENTIFIER)
-        self.__process_token('(')
-        n_args = self.__compile_expression_list()
-        self.__process_token(')')
-        self.__write_call(name + '.' + method, n_args + 1)
-    elif self.token_type is LexicalLabels.INT_CONST:
-      self.__write_push(CONSTANT, self.current_token)
-      self.__process_type(LexicalLabels.INT_CONST)
-    elif self.token_type is LexicalLabels.STR_CONST:
-      token = self.current_token[1:-1]
-      self.__write_push(CONSTANT, len(token))
-      self.__write_call('String.new', 1)
-      for c in token:
-        self.__write_push(CONSTANT, ord(c))
-        self.__write_call('String.appendChar', 2)
-      self.__process_type(LexicalLabels.STR_CONST)
-    elif self.current_token == '(':
-      self.__process_token('(')
-      self.__compile_expression()
-      self.__process_token(')')
-    elif self.current_token in ['-', '~']:
-      unary_op = UNARY_OP_CONV[self.current_token]
-      self.tokenizer.advance()
-      self.__compile_term()
-      self.__write_arithmetic(unary_op)
-    elif self.token_type is LexicalLabels.IDENTIFIER:
-      name = self.current_token
-      self.__process_type(LexicalLabels.IDENTIFIER)
-      if self.current_token == '(':
-        self.__process_token('(')
-        self.__write_push(POINTER, 0)
-        n_args = self.__compile_expression_list()
-        self.__process_token(')')
-        self.__write_call(self.class_name + '.' + name, n_args + 1)
-      elif self.current_token == '.':
-        self.__process_token('.')
-        method = self.current_token
-        self.__process_type(LexicalLabels.IDENTIFIER)
-        self.__process_token('(')
-        n_args = self.__compile_expression_list()
-        self.__process_token(')')
-        self.__write_call(name + '.' + method, n_args)
-      elif self.current_token == '[':
-        self.__process_token('[')
-        self.__compile_expression()
-        self.__process_token(']')
+        self.__generate_string(expr.value)
+    elif isinstance(expr, ArrayRef):
+      offset_expr, offset = split_index(expr.index)
+      self.__point_that(expr.var, offset_expr)
+      self.__write_push('that', offset)
+    elif isinstance(expr, BinaryOp):
+      self.__generate_expression(expr.left)
+      self.__generate_expression(expr.right)
+      self.__write_arithmetic(*OP_CONV[expr.op])
+    elif isinstance(expr, UnaryOp):
+      self.__generate_expression(expr.operand)
+      self.__write_arithmetic(UNARY_OP_CONV[expr.op])
+    elif isinstance(expr, Call):
+      if expr.receiver is not None: self.__generate_expression(expr.receiver)
+      for arg in expr.args:
+        self.__generate_expression(arg)
+      self.__write_call(expr.name, len(expr.args) + (1 if expr.receiver is not None else 0))
+    elif isinstance(expr, LocalTee):
+      self.__generate_expression(expr.expr)
+      self.__write_pop(LOCAL, expr.index)
+      self.__write_push(LOCAL, expr.index)
     else:
-      raise Exception(f'Token {self.current_token} of type {self.token_type} was not expected token')
-
-  def __compile_expression_list(self) -> int:
-    n_args = 0
-    if self.current_token != ')':
-      self.__compile_expression()
-      n_args += 1
-      while self.current_token == ',':
-        self.__process_token(',')
-        self.__compile_expression()
-        n_args += 1
-    return n_args
-
-def is_blank(line: str):
-  return line == ''
-
-def is_comment(line: str):
-  return len(line) > 2 and line[0] == '/' and line[1] == '/'
-
-def block_comment_start(line: str):
-  return len(line) > 2 and line[0:3] == '/**'
-
-def remove_trailing_comments(line: str):
-  return line.split('//')[0].strip() if '//' in line else line.split('/**')[0].strip()
-
-def tokenize_line(line):
-  tokens = []; s = ''; otl = 0; cs = ''
-
-  for index, c in enumerate(line):
-    if otl != len(tokens):
-      s = ''; cs = ''; otl = len(tokens)
-    s += c; cs += c; s = s.strip()
-    if len(s) > 0 and (s[0] in string.ascii_letters or s[0] == '_') and c == ' ':
-      tokens.append(s)
-    elif len(s) > 1 and s[0] == '"' and s[-1] == '"':
-      tokens.append(cs.strip())
-    elif s in SYMBOLS:
-      tokens.append(s)
-    elif s in KEYWORDS and (len(tokens) <= 0 or tokens[-1] != '.') and (index+1 < len(line) and line[index+1] not in string.ascii_letters):
-      tokens.append(s)
-    elif c in SYMBOLS and s != c and (len(s) > 0 and s[0] != '"'):
-      tokens.append(s[:-1])
-      tokens.append(c)
-
-  return tokens
-
-def tokenize(file_path):
-  token_buffer = []
-  in_block_comment = False
-
-  with open(file_path, 'r') as f:
-    for line in f:
-      line = line.strip('\n').strip()
-      if block_comment_start(line):
-        in_block_comment = True
-
-      if in_block_comment and '*/' in line:
-        in_block_comment = False
-      elif not is_blank(line) and not is_comment(line) and not in_block_comment:
-        token_buffer += tokenize_line(remove_trailing_comments(line))
-
-  return token_buffer
+      raise Exception(f'Expression {expr} can not be generated')
+
+  def __generate_string(self, token: str):
+    self.__write_push(CONSTANT, len(token))
+    self.__write_call('String.new', 1)
+    for c in token:
+      self.__write_push(CONSTANT, ord(c))
+      self.__write_call('String.appendChar', 2)
+
+  # Pooled literals live in statics appended after the class's own statics and are
+  # built lazily the first time a call site runs, so they must never be mutated or disposed
+  def __generate_pooled_string(self, token: str):
+    index = self.string_pool.intern(token)
+    label_ready = self.__generate_label()
+    self.__write_push(STATIC, index)
+    self.__write_if(label_ready)
+    self.__generate_string(token)
+    self.__write_pop(STATIC, index)
+    self.__write_label(label_ready)
+    self.__write_push(STATIC, index)
+
+PHASES = ['tokenize', 'parse', 'optimize', 'codegen', 'vm-optimize']
+
+@dataclass
+class PhaseRecord:
+  seconds: float = 0.0
+  allocated: int = 0
+  peak: int = 0
+
+class Profiler:
+  def __init__(self, enabled: bool = False, track_allocations: bool = True):
+    self.enabled = enabled
+    self.track_allocations = enabled and track_allocations
+    self.records: dict[str, dict[str, PhaseRecord]] = {}
+    self.tokens = 0
+    self.vm_lines = 0
+
+  @contextmanager
+  def phase(self, class_name: str, phase: str):
+    if not self.enabled:
+      yield
+      return
+    if self.track_allocations:
+      if not tracemalloc.is_tracing(): tracemalloc.start()
+      tracemalloc.reset_peak()
+      before, _ = tracemalloc.get_traced_memory()
+    start = time.perf_counter()
+    yield
+    record = self.records.setdefault(class_name, {}).setdefault(phase, PhaseRecord())
+    record.seconds += time.perf_counter() - start
+    if self.track_allocations:
+      after, peak = tracemalloc.get_traced_memory()
+      record.allocated += after - before
+      record.peak = max(record.peak, peak - before)
+
+  def phase_totals(self) -> dict[str, PhaseRecord]:
+    totals = {phase: PhaseRecord() for phase in PHASES}
+    for phases in self.records.values():
+      for phase, record in phases.items():
+        totals[phase].seconds += record.seconds
+        totals[phase].allocated += record.allocated
+        totals[phase].peak = max(totals[phase].peak, record.peak)
+    return totals
+
+  def report(self) -> list[str]:
+    lines = [f'{"class":<24}{"phase":<14}{"ms":>10}{"alloc KiB":>12}{"peak KiB":>12}']
+    for class_name, phases in list(self.records.items()) + [('total', self.phase_totals())]:
+      for phase in PHASES:
+        record = phases.get(phase, PhaseRecord())
+        lines.append(f'{class_name:<24}{phase:<14}{record.seconds * 1000:>10.3f}'
+                     f'{record.allocated / 1024:>12.1f}{record.peak / 1024:>12.1f}')
+    totals = self.phase_totals()
+    tokenize_time = totals['tokenize'].seconds
+    compile_time = sum(record.seconds for record in totals.values())
+    lines.append(f'{self.tokens} tokens, {self.tokens / tokenize_time if tokenize_time else 0:.0f} tokens/s')
+    lines.append(f'{self.vm_lines} VM lines, {self.vm_lines / compile_time if compile_time else 0:.0f} VM lines/s')
+    return lines
+
+class CompilationEngine:
+  def __init__(self, jack_tokenizer: None | Tokenizer, label_value: LabelValue, pool_strings: bool = False,
+               pass_manager: None | PassManager = None, profiler: None | Profiler = None, writer = None):
+    self.parser = Parser(jack_tokenizer, writer)
+    self.generator = CodeGenerator(label_value, pool_strings)
+    self.pass_manager = pass_manager if pass_manager is not None else PassManager(list(PASSES) + list(VM_PASSES))
+    self.profiler = profiler if profiler is not None else Profiler()
+    self.buffer = []
+    self.class_name = ''
+    self.string_pool: None | StringPool = None
+
+  def parse_class(self) -> ClassNode:
+    with self.profiler.phase(Path(self.parser.tokenizer.file_path).stem, 'parse'):
+      return self.parser.parse_class()
+
+  def compile_class(self, class_node: None | ClassNode = None, name: None | str = None):
+    name = Path(self.parser.tokenizer.file_path).stem if name is None else name
+    class_node = self.parse_class() if class_node is None else class_node
+    with self.profiler.phase(name, 'optimize'):
+      class_node = self.pass_manager.run(class_node)
+    with self.profiler.phase(name, 'codegen'):
+      self.generator.generate_class(class_node)
+    with self.profiler.phase(name, 'vm-optimize'):
+      self.buffer = self.pass_manager.run_vm(self.generator.buffer)
+    self.class_name = class_node.name
+    self.string_pool = self.generator.string_pool
+    self.profiler.tokens += len(self.parser.tokenizer.tokens) if self.parser.tokenizer is not None else 0
+    self.profiler.vm_lines += len(self.buffer)
+
+def load_project_module(name: str, relative_path: str):
+  spec = importlib.util.spec_from_file_location(name, Path(__file__).resolve().parent / relative_path)
+  module = importlib.util.module_from_spec(spec)
+  spec.loader.exec_module(module)
+  return module
+
+# Keeps the parsed tree of every class in memory and only retokenizes and reparses files whose
+# mtime or size changed. With inlining every class is regenerated from the cached trees because
+# a changed accessor can affect any caller.
+class WatchSession:
+  def __init__(self, directory: Path, pool_strings: bool, passes: list[str], inline: bool, inline_size: int,
+               build_output: None | str = None):
+    self.directory = directory
+    self.pool_strings = pool_strings
+    self.passes = passes
+    self.inline = inline
+    self.inline_size = inline_size
+    self.build_output = build_output
+    self.label_value = LabelValue()
+    self.stamps: dict[Path, tuple[int, int]] = {}
+    self.failed_stamps: None | dict[Path, tuple[int, int]] = None
+    self.class_nodes: dict[Path, ClassNode] = {}
+    self.buffers: dict[Path, list[tuple]] = {}
+    self.vmtranslator = load_project_module('vmtranslator', '../08/vmtranslator.py') if build_output else None
+    self.assembler = load_project_module('assembler', '../06/assembler.py') if build_output else None
+
+  def scan(self) -> dict[Path, tuple[int, int]]:
+    stamps = {}
+    for fp in self.directory.glob('*.jack'):
+      stat = fp.stat()
+      stamps[fp] = (stat.st_mtime_ns, stat.st_size)
+    return stamps
+
+  # Parses every changed file before touching the session, so a syntax error leaves the previous trees
+  # and stamps in place and every changed file is compiled again once the error is fixed. The failed
+  # stamps are kept so an unchanged broken tree is not retried on every poll.
+  def refresh(self) -> list[str]:
+    stamps = self.scan()
+    changed = [fp for fp, stamp in stamps.items() if self.stamps.get(fp) != stamp]
+    removed = [fp for fp in self.stamps if fp not in stamps]
+    if (not changed and not removed) or stamps == self.failed_stamps:
+      return []
+    try:
+      self.compile(changed, removed)
+    except Exception:
+      self.failed_stamps = stamps
+      raise
+    self.stamps = stamps
+    self.failed_stamps = None
+    return [fp.stem for fp in changed] + [fp.stem for fp in removed]
+
+  def compile(self, changed: list[Path], removed: list[Path]):
+    parsed = {fp: CompilationEngine(Tokenizer(fp), self.label_value).parse_class() for fp in changed}
+    for fp in removed:
+      self.class_nodes.pop(fp, None); self.buffers.pop(fp, None)
+      Path(fp.stem + '.vm').unlink(missing_ok=True)
+    self.class_nodes.update(parsed)
+
+    targets = list(self.class_nodes) if self.inline else changed
+    pass_manager = PassManager(self.passes)
+    if self.inline:
+      pass_manager.add_pass('inline', Inliner(list(self.class_nodes.values()), self.inline_size))
+    for fp in targets:
+      compilation_engine = CompilationEngine(None, self.label_value, self.pool_strings, pass_manager)
+      compilation_engine.compile_class(copy.deepcopy(self.class_nodes[fp]), fp.stem)
+      self.buffers[fp] = compilation_engine.buffer
+      with open(fp.stem + '.vm', 'w') as f:
+        f.writelines(vm_line(command) + '\n' for command in compilation_engine.buffer)
+
+    if self.build_output is not None:
+      self.build()
+
+  def build(self):
+    label_value = self.vmtranslator.LabelValue()
+    buffer = self.vmtranslator.bootstrap_records(False, label_value)
+    for fp in sorted(self.buffers):
+      buffer += self.vmtranslator.translate_commands(self.buffers[fp], fp.stem + '.vm', False, label_value)
+    with open(self.build_output, 'w') as f:
+      f.writelines(format(word, '016b') + '\n' for word in self.assembler.assemble_records(buffer))
+
+  def run(self, poll_interval: float):
+    while True:
+      start = time.perf_counter()
+      try:
+        names = self.refresh()
+      except Exception as e:
+        print(f'Error: {e}')
+        names = []
+      if names:
+        print(f'Compiled {", ".join(sorted(names))} in {(time.perf_counter() - start) * 1000:.1f} ms')
+      time.sleep(poll_interval)
 
 def main():
   parser = argparse.ArgumentParser(description='Translates Jack language into XML code')
   parser.add_argument('--f', help='Input Jack program or folder containing jack programs')
+  parser.add_argument('-p', '--pool-strings', help='Intern string literals into class statics built on first use',
+                      action='store_true')
+  default_passes = ','.join(list(PASSES) + list(VM_PASSES))
+  parser.add_argument('--passes', help=f'Comma separated optimization passes to run (default: {default_passes})',
+                      default=default_passes)
+  parser.add_argument('-t', '--time-passes', help='Report the time spent in each optimization pass', action='store_true')
+  parser.add_argument('-i', '--inline', help='Inline trivial getters, setters and small functions across all classes',
+                      action='store_true')
+  parser.add_argument('--inline-size', help=f'Largest body in AST nodes that is inlined (default: {INLINE_SIZE})',
+                      type=int, default=INLINE_SIZE)
+  parser.add_argument('-w', '--watch', help='Keep running and recompile the classes of the folder that change',
+                      action='store_true')
+  parser.add_argument('--poll', help='Seconds between checks for changed files in watch mode', type=float, default=0.05)
+  parser.add_argument('--build', help='In watch mode also translate and assemble the program into this .hack file')
+  parser.add_argument('-x', '--xml', help='Also write the analyzer XML of each class from the same parse',
+                      action='store_true')
+  parser.add_argument('--profile', help='Report time and allocations per phase and class plus throughput',
+                      action='store_true')
 
   args = parser.parse_args()
   file_path = Path(args.f)
 
   candidates = [file_path] if not file_path.is_dir() else [file for file in file_path.glob('*.jack')]
+  passes = [name for name in args.passes.split(',') if name != '']
+
+  if args.watch:
+    directory = file_path if file_path.is_dir() else file_path.parent
+    WatchSession(directory, args.pool_strings, passes, args.inline, args.inline_size, args.build).run(args.poll)
+    return
 
   label_value = LabelValue()
+  pass_manager = PassManager(passes)
+  profiler = Profiler(args.profile)
+  xml_files = ExitStack()
+  engines = []
   for fp in candidates:
-    compilation_engine = CompilationEngine(Tokenizer(fp), label_value)
-    compilation_engine.compile_class()
+    with profiler.phase(fp.stem, 'tokenize'):
+      tokenizer = Tokenizer(fp)
+    writer = XMLWriter(xml_files.enter_context(open(fp.stem + '.xml', 'w', buffering=1 << 16))) if args.xml else None
+    engines.append(CompilationEngine(tokenizer, label_value, args.pool_strings, pass_manager, profiler, writer))
+
+  class_nodes = [None] * len(engines)
+  inliner = None
+  if args.inline:
+    class_nodes = [compilation_engine.parse_class() for compilation_engine in engines]
+    inliner = Inliner(class_nodes, args.inline_size)
+    pass_manager.add_pass('inline', inliner)
+
+  for fp, compilation_engine, class_node in zip(candidates, engines, class_nodes):
+    compilation_engine.compile_class(class_node)
+
+    pool = compilation_engine.string_pool
+    if pool is not None and pool.call_sites > 0:
+      print(f'{compilation_engine.class_name}: pooled {len(pool.literals)} literals ({pool.pooled_bytes} bytes) '
+            f'across {pool.call_sites} call sites')
 
     with open(str(fp).split('/')[-1][:-4] + 'vm', 'w') as f:
-      f.writelines(line + '\n' for line in compilation_engine.buffer)
+      f.writelines(vm_line(command) + '\n' for command in compilation_engine.buffer)
+  xml_files.close()
+
+  if inliner is not None:
+    print(f'Inlined {inliner.total} calls to {len(inliner.inlined)} subroutines')
+    for name, count in sorted(inliner.inlined.items()):
+      print(f'  {name}: {count}')
+
+  if args.time_passes:
+    for name, elapsed in pass_manager.timings.items():
+      print(f'{name}: {elapsed * 1000:.3f} ms')
+
+  if args.profile:
+    print('\n'.join(profiler.report()))
 
 if __name__ == '__main__':
   main()
\ No newline at end of file
@@ -0,0 +1,541 @@
+from enum import Enum
+from dataclasses import dataclass
+import string
+
+ARGUMENT = 'argument'
+LOCAL = 'local'
+MAIN = 'main'
+METHOD = 'method'
+CONSTRUCTOR = 'constructor'
+FUNCTION = 'function'
+STATIC = 'static'
+FIELD = 'field'
+INT = 'int'
+CHAR = 'char'
+BOOLEAN = 'boolean'
+VOID = 'void'
+THIS = 'this'
+TRUE = 'true'
+FALSE = 'false'
+NULL = 'null'
+
+KEYWORDS = {'class', 'constructor', 'function', 'method', 'field', 'static', 'var', 'int', 'char', 
+            'boolean', 'void', 'true', 'false', 'null', 'this', 'let', 'do', 'if', 'else', 'while', 
+            'return'}
+
+SYMBOLS = {'{', '}', '|', '(', ')', '[', ']', '.', ',', ';', '+', '-', '*', '/', '&', '|', 
+           '<', '>', '=', '~'}
+
+INT_RANGE = range(0,32767)
+
+XML_ESCAPES = {'<': '&lt;', '>': '&gt;', '&': '&amp;'}
+
+class LexicalLabels(Enum):
+  KEYWORD = 'keyword'
+  SYMBOL = 'symbol'
+  INT_CONST = 'integerConstant'
+  STR_CONST = 'stringConstant'
+  IDENTIFIER = 'identifier'
+
+  def __str__(self):
+    return self.value
+
+class Tokenizer:
+  def __init__(self, file_path):
+    self.file_path = file_path
+    self.tokens = tokenize(file_path)
+    self.index = 0
+
+  def advance(self):
+    self.index += 1 
+
+  @property
+  def token_type(self):
+    token = self.current_token
+    if token in KEYWORDS: return LexicalLabels.KEYWORD
+    elif token in SYMBOLS: return LexicalLabels.SYMBOL
+    elif token[0] in string.digits and int(token) in INT_RANGE: return LexicalLabels.INT_CONST
+    elif token[0] == '"' and token[-1] == '"': return LexicalLabels.STR_CONST
+    else: return LexicalLabels.IDENTIFIER
+
+  @property
+  def current_token(self):
+    return self.tokens[self.index]
+
+@dataclass
+class SymbolData:
+  type_of: str
+  kind: str
+  index: int
+
+class SymbolTable:
+  def __init__(self):
+    self.symbol_table: dict[str, SymbolData] = {}
+    self.kind_id = {}
+    self.num_of_fields = 0
+
+  def add(self, name: str, type_of: str, kind: str):
+    index = self.__kind_lookup(kind)
+    if kind == FIELD: self.num_of_fields += 1
+    self.symbol_table[name] = SymbolData(type_of, kind, index)
+
+  def __kind_lookup(self, kind: str) -> int:
+    self.kind_id[kind] = 0 if kind not in self.kind_id else self.kind_id[kind] + 1
+    return self.kind_id[kind]
+
+  def reset(self):
+    self.symbol_table = {}; self.kind_id = {}
+
+  def get_symbol(self, name: str) -> None | SymbolData:
+    return self.symbol_table.get(name)
+
+# AST nodes produced by the Parser and consumed by the optimization passes and the CodeGenerator
+
+@dataclass(slots=True)
+class IntConst:
+  value: int
+
+@dataclass(slots=True)
+class StrConst:
+  value: str
+
+@dataclass(slots=True)
+class KeywordConst:
+  value: str
+
+@dataclass(slots=True)
+class Var:
+  name: str
+  kind: str
+  index: int
+  type_of: str
+
+@dataclass(slots=True)
+class ArrayRef:
+  var: Var
+  index: 'Expression'
+
+@dataclass(slots=True)
+class Call:
+  name: str
+  args: list['Expression']
+  receiver: None | Var | KeywordConst = None
+
+@dataclass(slots=True)
+class BinaryOp:
+  op: str
+  left: 'Expression'
+  right: 'Expression'
+
+@dataclass(slots=True)
+class UnaryOp:
+  op: str
+  operand: 'Expression'
+
+@dataclass(slots=True)
+class LocalTee:
+  index: int
+  expr: 'Expression'
+
+Expression = IntConst | StrConst | KeywordConst | Var | ArrayRef | Call | BinaryOp | UnaryOp | LocalTee
+
+@dataclass(slots=True)
+class Let:
+  target: Var
+  index: None | Expression
+  value: Expression
+
+@dataclass(slots=True)
+class If:
+  cond: Expression
+  then: list['Statement']
+  otherwise: None | list['Statement'] = None
+
+@dataclass(slots=True)
+class While:
+  cond: Expression
+  body: list['Statement']
+
+@dataclass(slots=True)
+class Do:
+  expr: Expression
+
+@dataclass(slots=True)
+class Return:
+  value: None | Expression = None
+
+Statement = Let | If | While | Do | Return
+
+@dataclass(slots=True)
+class Subroutine:
+  kind: str
+  return_type: str
+  name: str
+  n_locals: int
+  body: list[Statement]
+
+@dataclass(slots=True)
+class ClassNode:
+  name: str
+  n_fields: int
+  n_statics: int
+  subroutines: list[Subroutine]
+
+# Writers receive the parse as start_tag/end_tag/terminal events while the AST is built, so one
+# pass over the tokens yields both the analyzer XML and the tree the VM code generator consumes
+class XMLWriter:
+  def __init__(self, output):
+    self.output = output
+
+  def start_tag(self, tag_name: str):
+    self.output.write(f'<{tag_name}>\n')
+
+  def end_tag(self, tag_name: str):
+    self.output.write(f'</{tag_name}>\n')
+
+  def terminal(self, label, token: str):
+    token = XML_ESCAPES[token] if str(label) == 'symbol' and token in XML_ESCAPES else token
+    self.output.write(f'<{label}> {token} </{label}>\n')
+
+class Parser:
+  def __init__(self, jack_tokenizer: Tokenizer, writer = None):
+    self.tokenizer = jack_tokenizer
+    self.writer = writer
+    self.cst = SymbolTable()
+    self.sst = SymbolTable()
+    self.class_name = ''
+
+  def __advance(self):
+    if self.writer is not None:
+      token_type = self.token_type
+      token = self.current_token[1:-1] if token_type is LexicalLabels.STR_CONST else self.current_token
+      self.writer.terminal(token_type, token)
+    self.tokenizer.advance()
+
+  def __start_tag(self, tag_name: str):
+    if self.writer is not None: self.writer.start_tag(tag_name)
+
+  def __end_tag(self, tag_name: str):
+    if self.writer is not None: self.writer.end_tag(tag_name)
+
+  @property
+  def current_token(self):
+    return self.tokenizer.current_token
+
+  @property
+  def token_type(self):
+    return self.tokenizer.token_type
+
+  def __process_st_kind(self, expected_token):
+    if self.current_token != expected_token:
+      raise Exception(f'Token {expected_token} did not match current token {self.current_token}')
+    self.__advance()
+    return expected_token
+
+  def __process_st_type(self, expected_tokens: list[str], fallback: LexicalLabels = None):
+    if self.current_token not in expected_tokens and self.token_type != fallback:
+      raise Exception(f'Token {self.current_token} of type {self.token_type} not in {expected_tokens} or {fallback}')
+    token = self.current_token
+    self.__advance()
+    return token
+
+  def __process_st_name(self, expected_type: LexicalLabels):
+    if self.token_type != expected_type:
+      raise Exception(f'Token type {self.token_type} does not match {expected_type}')
+    token = self.current_token
+    self.__advance()
+    return token
+
+  def __process_token(self, expected_token):
+    if self.current_token != expected_token:
+      raise Exception(f'Token {expected_token} did not match current token {self.current_token}')
+    self.__advance()
+
+  def __lookup(self, name: str) -> Var:
+    s_data = self.sst.get_symbol(name) if name in self.sst.symbol_table else self.cst.get_symbol(name)
+    if s_data is None:
+      raise Exception(f'Symbol {name} was not found in either symbol table')
+    return Var(name, s_data.kind, s_data.index, s_data.type_of)
+
+  def __is_in_symbol_table(self, name: str) -> bool:
+    return True if name in self.cst.symbol_table or name in self.sst.symbol_table else False
+
+  def parse_class(self) -> ClassNode:
+    self.__start_tag('class')
+    self.__process_token('class')
+    self.class_name = self.__process_st_name(LexicalLabels.IDENTIFIER)
+    self.__process_token('{')
+    while self.current_token in [STATIC, FIELD]:
+      self.__parse_class_var_dec()
+    subroutines = []
+    while self.current_token in [CONSTRUCTOR, FUNCTION, METHOD]:
+      self.sst.reset()
+      subroutines.append(self.__parse_subroutine_dec())
+    self.__process_token('}')
+    self.__end_tag('class')
+    return ClassNode(self.class_name, self.cst.num_of_fields, self.cst.kind_id.get(STATIC, -1) + 1, subroutines)
+
+  def __parse_class_var_dec(self):
+    self.__start_tag('classVarDec')
+    s_kind = self.__process_st_kind(STATIC) if self.current_token == STATIC else self.__process_st_kind(FIELD)
+    s_type = self.__process_st_type([INT, CHAR, BOOLEAN], LexicalLabels.IDENTIFIER)
+    s_name = self.__process_st_name(LexicalLabels.IDENTIFIER)
+    self.cst.add(s_name, s_type, s_kind)
+    while self.current_token != ';':
+      self.__process_token(',')
+      s_name = self.__process_st_name(LexicalLabels.IDENTIFIER)
+      self.cst.add(s_name, s_type, s_kind)
+    self.__process_token(';')
+    self.__end_tag('classVarDec')
+
+  def __parse_subroutine_dec(self) -> Subroutine:
+    self.__start_tag('subroutineDec')
+    fn_type = self.__process_st_type([CONSTRUCTOR, FUNCTION, METHOD])
+    return_type = self.__process_st_type([INT, CHAR, BOOLEAN, VOID], LexicalLabels.IDENTIFIER)
+    fn_name = self.current_token
+    if fn_name == MAIN or fn_type == METHOD: self.sst.add(THIS, self.class_name, ARGUMENT)
+    self.__process_st_name(LexicalLabels.IDENTIFIER)
+    self.__process_token('(')
+    self.__start_tag('parameterList')
+    self.__parse_parameter_list()
+    self.__end_tag('parameterList')
+    self.__process_token(')')
+    self.__start_tag('subroutineBody')
+    self.__process_token('{')
+    n_locals = 0
+    while self.current_token == 'var':
+      n_locals += self.__parse_var_dec()
+    body = self.__parse_statements()
+    self.__process_token('}')
+    self.__end_tag('subroutineBody')
+    self.__end_tag('subroutineDec')
+    return Subroutine(fn_type, return_type, fn_name, n_locals, body)
+
+  def __parse_parameter_list(self):
+    if self.current_token != ')':
+      s_type = self.__process_st_type([INT, CHAR, BOOLEAN], LexicalLabels.IDENTIFIER)
+      s_name = self.__process_st_name(LexicalLabels.IDENTIFIER)
+      s_kind = ARGUMENT
+      self.sst.add(s_name, s_type, s_kind)
+      while self.current_token == ',':
+        self.__process_token(',')
+        s_type = self.__process_st_type([INT, CHAR, BOOLEAN], LexicalLabels.IDENTIFIER)
+        s_name = self.__process_st_name(LexicalLabels.IDENTIFIER)
+        self.sst.add(s_name, s_type, s_kind)
+
+  def __parse_var_dec(self) -> int:
+    self.__start_tag('varDec')
+    self.__process_token('var')
+    n_vars = 1
+    s_type = self.__process_st_type([INT, CHAR, BOOLEAN], LexicalLabels.IDENTIFIER)
+    s_name = self.__process_st_name(LexicalLabels.IDENTIFIER)
+    s_kind = LOCAL
+    self.sst.add(s_name, s_type, s_kind)
+    while self.current_token != ';' and self.current_token == ',':
+      self.__process_token(',')
+      s_name = self.__process_st_name(LexicalLabels.IDENTIFIER)
+      self.sst.add(s_name, s_type, s_kind)
+      n_vars += 1
+    self.__process_token(';')
+    self.__end_tag('varDec')
+    return n_vars
+
+  def __parse_statements(self) -> list[Statement]:
+    self.__start_tag('statements')
+    statements = []
+    while self.current_token in ['let', 'while', 'if', 'do', 'return']:
+      if self.current_token == 'let':
+        statements.append(self.__parse_let())
+      elif self.current_token == 'while':
+        statements.append(self.__parse_while())
+      elif self.current_token == 'if':
+        statements.append(self.__parse_if())
+      elif self.current_token == 'do':
+        statements.append(self.__parse_do())
+      elif self.current_token == 'return':
+        statements.append(self.__parse_return())
+    self.__end_tag('statements')
+    return statements
+
+  def __parse_let(self) -> Let:
+    self.__start_tag('letStatement')
+    self.__process_token('let')
+    target = self.__lookup(self.__process_st_name(LexicalLabels.IDENTIFIER))
+    index = None
+    if self.current_token == '[':
+      self.__process_token('[')
+      index = self.__parse_expression()
+      self.__process_token(']')
+    self.__process_token('=')
+    value = self.__parse_expression()
+    self.__process_token(';')
+    self.__end_tag('letStatement')
+    return Let(target, index, value)
+
+  def __parse_if(self) -> If:
+    self.__start_tag('ifStatement')
+    self.__process_token('if')
+    self.__process_token('(')
+    cond = self.__parse_expression()
+    self.__process_token(')')
+    self.__process_token('{')
+    then = self.__parse_statements()
+    self.__process_token('}')
+    otherwise = None
+    if self.current_token == 'else':
+      self.__process_token('else')
+      self.__process_token('{')
+      otherwise = self.__parse_statements()
+      self.__process_token('}')
+    self.__end_tag('ifStatement')
+    return If(cond, then, otherwise)
+
+  def __parse_while(self) -> While:
+    self.__start_tag('whileStatement')
+    self.__process_token('while')
+    self.__process_token('(')
+    cond = self.__parse_expression()
+    self.__process_token(')')
+    self.__process_token('{')
+    body = self.__parse_statements()
+    self.__process_token('}')
+    self.__end_tag('whileStatement')
+    return While(cond, body)
+
+  def __parse_do(self) -> Do:
+    self.__start_tag('doStatement')
+    self.__process_token('do')
+    expr = self.__parse_term(True)
+    self.__process_token(';')
+    self.__end_tag('doStatement')
+    return Do(expr)
+
+  def __parse_return(self) -> Return:
+    self.__start_tag('returnStatement')
+    self.__process_token('return')
+    value = self.__parse_expression() if self.current_token != ';' else None
+    self.__process_token(';')
+    self.__end_tag('returnStatement')
+    return Return(value)
+
+  def __parse_expression(self) -> Expression:
+    self.__start_tag('expression')
+    expr = self.__parse_term()
+    while self.current_token in ['+', '-', '*', '/', '&', '|', '<', '>', '=']:
+      op = self.current_token
+      self.__advance()
+      expr = BinaryOp(op, expr, self.__parse_term())
+    self.__end_tag('expression')
+    return expr
+
+  # A do statement parses its subroutine call as a bare term, without the term tag
+  def __parse_term(self, bare: bool = False) -> Expression:
+    if not bare: self.__start_tag('term')
+    if self.current_token in [TRUE, FALSE, NULL, THIS]:
+      term = KeywordConst(self.current_token)
+      self.__advance()
+    elif self.__is_in_symbol_table(self.current_token):
+      var = self.__lookup(self.current_token)
+      self.__advance()
+      if self.current_token == '[':
+        self.__process_token('[')
+        term = ArrayRef(var, self.__parse_expression())
+        self.__process_token(']')
+      elif self.current_token == '.':
+        self.__process_token('.')
+        method = self.__process_st_name(LexicalLabels.IDENTIFIER)
+        term = Call(var.type_of + '.' + method, self.__parse_expression_list(), var)
+      else:
+        term = var
+    elif self.token_type is LexicalLabels.INT_CONST:
+      term = IntConst(int(self.current_token))
+      self.__advance()
+    elif self.token_type is LexicalLabels.STR_CONST:
+      term = StrConst(self.current_token[1:-1])
+      self.__advance()
+    elif self.current_token == '(':
+      self.__process_token('(')
+      term = self.__parse_expression()
+      self.__process_token(')')
+    elif self.current_token in ['-', '~']:
+      op = self.current_token
+      self.__advance()
+      term = UnaryOp(op, self.__parse_term())
+    elif self.token_type is LexicalLabels.IDENTIFIER:
+      name = self.__process_st_name(LexicalLabels.IDENTIFIER)
+      if self.current_token == '(':
+        term = Call(self.class_name + '.' + name, self.__parse_expression_list(), KeywordConst(THIS))
+      elif self.current_token == '.':
+        self.__process_token('.')
+        method = self.__process_st_name(LexicalLabels.IDENTIFIER)
+        term = Call(name + '.' + method, self.__parse_expression_list())
+      else:
+        term = self.__lookup(name)
+    else:
+      raise Exception(f'Token {self.current_token} of type {self.token_type} was not expected token')
+    if not bare: self.__end_tag('term')
+    return term
+
+  def __parse_expression_list(self) -> list[Expression]:
+    self.__process_token('(')
+    self.__start_tag('expressionList')
+    args = []
+    if self.current_token != ')':
+      args.append(self.__parse_expression())
+      while self.current_token == ',':
+        self.__process_token(',')
+        args.append(self.__parse_expression())
+    self.__end_tag('expressionList')
+    self.__process_token(')')
+    return args
+
+def is_blank(line: str):
+  return line == ''
+
+def is_comment(line: str):
+  return len(line) > 2 and line[0] == '/' and line[1] == '/'
+
+def block_comment_start(line: str):
+  return len(line) > 2 and line[0:3] == '/**'
+
+def remove_trailing_comments(line: str):
+  return line.split('//')[0].strip() if '//' in line else line.split('/**')[0].strip()
+
+def tokenize_line(line):
+  tokens = []; s = ''; otl = 0; cs = ''
+
+  for index, c in enumerate(line):
+    if otl != len(tokens):
+      s = ''; cs = ''; otl = len(tokens)
+    s += c; cs += c; s = s.strip()
+    if len(s) > 0 and (s[0] in string.ascii_letters or s[0] == '_') and c == ' ':
+      tokens.append(s)
+    elif len(s) > 1 and s[0] == '"' and s[-1] == '"':
+      tokens.append(cs.strip())
+    elif s in SYMBOLS:
+      tokens.append(s)
+    elif s in KEYWORDS and (len(tokens) <= 0 or tokens[-1] != '.') and (index+1 < len(line) and line[index+1] not in string.ascii_letters):
+      tokens.append(s)
+    elif c in SYMBOLS and s != c and (len(s) > 0 and s[0] != '"'):
+      tokens.append(s[:-1])
+      tokens.append(c)
+
+  return tokens
+
+# Yields the tokens of a file line by line, so a streaming reader only holds the current line
+def iter_tokens(file_path):
+  in_block_comment = False
+
+  with open(file_path, 'r') as f:
+    for line in f:
+      line = line.strip('\n').strip()
+      if block_comment_start(line):
+        in_block_comment = True
+
+      if in_block_comment and '*/' in line:
+        in_block_comment = False
+      elif not is_blank(line) and not is_comment(line) and not in_block_comment:
+        yield from tokenize_line(remove_trailing_comments(line))
+
+def tokenize(file_path):
+  return list(iter_tokens(file_path))
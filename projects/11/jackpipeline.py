@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+import argparse
+import time
+from array import array
+from dataclasses import dataclass, field
+from pathlib import Path
+
+from jackcompiler import (INLINE_SIZE, PASSES, VM_PASSES, CompilationEngine, Inliner, LabelValue, PassManager,
+                          Tokenizer, load_project_module)
+
+vmtranslator = load_project_module('vmtranslator', '../08/vmtranslator.py')
+assembler = load_project_module('assembler', '../06/assembler.py')
+
+STAGES = ['compile', 'translate', 'assemble']
+ROM_SIZE = 32768
+
+# Stages hand each other records instead of text: VM commands such as ('push', 'local', 2) and assembly
+# instructions such as ('@', 'SP') or ('C', 'M', 'M+1', ''), and the assembler emits ROM words directly
+@dataclass
+class BuildResult:
+  vm: dict[str, list[tuple]]
+  asm: list[tuple]
+  rom: array
+  timings: dict[str, float] = field(default_factory=dict)
+
+# Compiles every Jack class into its VM commands, keyed by class file stem in source order
+def compile_jack(candidates: list[Path], pool_strings: bool = False, passes: None | list[str] = None,
+                 inline: bool = False, inline_size: int = INLINE_SIZE) -> dict[str, list[tuple]]:
+  label_value = LabelValue()
+  pass_manager = PassManager(list(PASSES) + list(VM_PASSES) if passes is None else passes)
+  engines = [CompilationEngine(Tokenizer(fp), label_value, pool_strings, pass_manager) for fp in candidates]
+
+  class_nodes = [None] * len(engines)
+  if inline:
+    class_nodes = [compilation_engine.parse_class() for compilation_engine in engines]
+    pass_manager.add_pass('inline', Inliner(class_nodes, inline_size))
+
+  units = {}
+  for fp, compilation_engine, class_node in zip(candidates, engines, class_nodes):
+    compilation_engine.compile_class(class_node)
+    units[fp.stem] = compilation_engine.buffer
+  return units
+
+# Static labels match what the VM translator derives from a <stem>.vm file on disk
+def translate_vm(units: dict[str, list[tuple]], bootstrap: bool = True) -> list[tuple]:
+  label_value = vmtranslator.LabelValue()
+  buffer = vmtranslator.bootstrap_records(False, label_value) if bootstrap else []
+  for name in sorted(units):
+    buffer += vmtranslator.translate_commands(units[name], name + '.vm', False, label_value)
+  return buffer
+
+def assemble_asm(asm: list[tuple]) -> array:
+  words = assembler.assemble_records(asm)
+  if len(words) > ROM_SIZE:
+    raise ValueError(f'Program needs {len(words)} instructions but the ROM holds {ROM_SIZE}')
+  return array('H', words)
+
+# Builds a Jack program into a ROM image. VM files in the folder without a Jack source next to them
+# (such as the compiled OS) are linked in as they are.
+def build(file_path: Path, bootstrap: bool = True, pool_strings: bool = False, passes: None | list[str] = None,
+          inline: bool = False, inline_size: int = INLINE_SIZE) -> BuildResult:
+  candidates = [file_path] if not file_path.is_dir() else sorted(file_path.glob('*.jack'))
+  timings = {}
+
+  start = time.perf_counter()
+  units = compile_jack(candidates, pool_strings, passes, inline, inline_size)
+  if file_path.is_dir():
+    for fp in sorted(file_path.glob('*.vm')):
+      if fp.stem not in units:
+        with open(fp, 'r') as f:
+          units[fp.stem] = vmtranslator.parse_commands(f.read().splitlines())
+  timings['compile'] = time.perf_counter() - start
+
+  start = time.perf_counter()
+  asm = translate_vm(units, bootstrap)
+  timings['translate'] = time.perf_counter() - start
+
+  start = time.perf_counter()
+  rom = assemble_asm(asm)
+  timings['assemble'] = time.perf_counter() - start
+
+  return BuildResult(units, asm, rom, timings)
+
+def main():
+  parser = argparse.ArgumentParser(description='Builds a Jack program into Hack machine code in one process')
+  parser.add_argument('--f', help='Input Jack program or folder containing Jack programs and OS VM code')
+  parser.add_argument('--o', help='Hack machine code output file')
+  parser.add_argument('--asm', help='Also write the Hack assembly to this file')
+  parser.add_argument('-n', '--no-bootstrap', help='Do not generate the bootstrap that calls Sys.init',
+                      action='store_true')
+  parser.add_argument('-p', '--pool-strings', help='Intern string literals into class statics built on first use',
+                      action='store_true')
+  default_passes = ','.join(list(PASSES) + list(VM_PASSES))
+  parser.add_argument('--passes', help=f'Comma separated optimization passes to run (default: {default_passes})',
+                      default=default_passes)
+  parser.add_argument('-i', '--inline', help='Inline trivial getters, setters and small functions across all classes',
+                      action='store_true')
+  parser.add_argument('--inline-size', help=f'Largest body in AST nodes that is inlined (default: {INLINE_SIZE})',
+                      type=int, default=INLINE_SIZE)
+  parser.add_argument('-t', '--time', help='Report the time spent in each stage', action='store_true')
+
+  args = parser.parse_args()
+  file_path = Path(args.f)
+  passes = [name for name in args.passes.split(',') if name != '']
+
+  result = build(file_path, not args.no_bootstrap, args.pool_strings, passes, args.inline, args.inline_size)
+
+  if args.asm is not None:
+    with open(args.asm, 'w') as f:
+      f.writelines(vmtranslator.format_instruction(record) + '\n' for record in result.asm)
+  if args.o is not None:
+    with open(args.o, 'w') as f:
+      f.writelines(format(word, '016b') + '\n' for word in result.rom)
+
+  if args.time:
+    for stage in STAGES:
+      print(f'{stage:<12}{result.timings[stage] * 1000:>10.2f} ms')
+    print(f'{len(result.vm)} classes, {sum(len(commands) for commands in result.vm.values())} VM commands, '
+          f'{len(result.asm)} assembly records, {len(result.rom)} ROM words')
+
+if __name__ == '__main__':
+  main()
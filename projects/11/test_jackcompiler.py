@@ -0,0 +1,143 @@
+import os
+import sys
+from pathlib import Path
+
+import pytest
+
+from jackcompiler import INLINE_SIZE, WatchSession
+from jackpipeline import compile_jack
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / '08'))
+from vminterpreter import NATIVES, VMMachine, VMProgram
+
+RESULT = 8000
+
+SYS = '''
+class Sys {
+  function void init() {
+    do Memory.poke(8000, Main.main());
+    while (true) {}
+  }
+}
+'''
+
+# Compiles Main.jack with a Sys.init that stores the result of Main.main, runs it on the VM interpreter
+# with the OS natively and returns the stored result
+def run_main(tmp_path: Path, source: str, passes: None | list[str], inline: bool = False,
+             classes: dict[str, str] = {}) -> int:
+  (tmp_path / 'Main.jack').write_text(source)
+  (tmp_path / 'Sys.jack').write_text(SYS)
+  for name, class_source in classes.items():
+    (tmp_path / f'{name}.jack').write_text(class_source)
+  units = compile_jack(sorted(tmp_path.glob('*.jack')), passes=passes, inline=inline)
+  machine = VMMachine(VMProgram(units, True, NATIVES))
+  machine.run(100_000)
+  assert machine.halted
+  return machine.ram[RESULT]
+
+@pytest.mark.parametrize('passes', [None, []])
+def test_array_offsets_with_calls_are_not_reused(tmp_path, passes):
+  source = '''
+class Main {
+  function int one() { return 1; }
+  function int five() { return 5; }
+  function int main() {
+    var Array a;
+    var int k, s, t;
+    let a = Array.new(10);
+    let k = 2;
+    let a[3] = 100;
+    let a[7] = 203;
+    let s = a[Main.one() + k];
+    let t = a[Main.five() + k];
+    return s + t;
+  }
+}
+'''
+  assert run_main(tmp_path, source, passes) == 303
+
+@pytest.mark.parametrize('passes', [None, []])
+def test_array_offsets_with_reused_subexpressions_are_not_reused(tmp_path, passes):
+  source = '''
+class Main {
+  function int main() {
+    var Array a;
+    var int i, j, k, m, n, s, t;
+    let a = Array.new(20);
+    let i = 2; let j = 3; let k = 1; let m = 3; let n = 4;
+    let a[7] = 1000;
+    let a[13] = 300;
+    let s = a[(i * j) + k] + (i * j);
+    let t = a[(m * n) + k] + (m * n);
+    return s + t;
+  }
+}
+'''
+  assert run_main(tmp_path, source, passes) == 1318
+
+@pytest.mark.parametrize('passes', [None, []])
+def test_bitwise_not_of_constant_conditions(tmp_path, passes):
+  source = '''
+class Main {
+  function int main() {
+    var int n, s;
+    if (~1) { let s = 10; } else { let s = 20; }
+    while (~0) {
+      let n = n + 1;
+      if (n = 5) { return s + n; }
+    }
+    return 0;
+  }
+}
+'''
+  assert run_main(tmp_path, source, passes) == 15
+
+POINT = '''
+class Point {
+  field int x, y;
+  constructor Point new(int ax, int ay) { let x = ax; let y = ay; return this; }
+  method void setXY(int a, int b) { let x = a; let y = b; return; }
+  method int getX() { return x; }
+  method int getY() { return y; }
+  method void swap() { do setXY(y, x); return; }
+  method void swapThrough(Point p) { do p.setXY(y, x); return; }
+}
+'''
+
+@pytest.mark.parametrize('inline', [False, True])
+@pytest.mark.parametrize('swap', ['p.swap()', 'p.swapThrough(p)'])
+def test_inlined_setter_arguments_read_fields_before_stores(tmp_path, inline, swap):
+  source = f'''
+class Main {{
+  function int main() {{
+    var Point p;
+    let p = Point.new(3, 7);
+    do {swap};
+    return (p.getX() * 10) + p.getY();
+  }}
+}}
+'''
+  assert run_main(tmp_path, source, None, inline, {'Point': POINT}) == 73
+
+# Writes a class with a distinct mtime, so the watch session sees the edit even on coarse clocks
+def write_class(file_path: Path, source: str, mtime: int):
+  file_path.write_text(source)
+  os.utime(file_path, ns=(mtime, mtime))
+
+def test_watch_retries_every_changed_file_after_a_syntax_error(tmp_path, monkeypatch):
+  monkeypatch.chdir(tmp_path)
+  session = WatchSession(tmp_path, False, [], False, INLINE_SIZE)
+  write_class(tmp_path / 'A.jack', 'class A { function int f() { return 1; } }', 1_000_000_000)
+  write_class(tmp_path / 'B.jack', 'class B { function int g() { return 2; } }', 1_000_000_000)
+  assert sorted(session.refresh()) == ['A', 'B']
+
+  write_class(tmp_path / 'A.jack', 'class A { function int f() { return 11; } }', 2_000_000_000)
+  write_class(tmp_path / 'B.jack', 'class B { function int g() { return 2 } }', 2_000_000_000)
+  with pytest.raises(Exception):
+    session.refresh()
+  assert session.refresh() == []
+
+  write_class(tmp_path / 'B.jack', 'class B { function int g() { return 12; } }', 3_000_000_000)
+  assert sorted(session.refresh()) == ['A', 'B']
+  assert 'push constant 11' in (tmp_path / 'A.vm').read_text()
+  assert 'push constant 12' in (tmp_path / 'B.vm').read_text()